@@ -0,0 +1,393 @@
+# analyzer.py
+from typing import Dict, List, Optional, Set, Tuple
+
+from errors import CompilationError
+from isa import MNEMONICS, INSTRUCTION_SIZES, DEFAULT_CYCLES, OPCODES
+
+BANK_SIZE = 256
+TERMINATORS = ('JMP', 'RET', 'HLT')  # после них выполнение не продолжается на следующей инструкции
+BRANCHES = ('JMP', 'JE', 'JNE')
+
+
+class Block:
+    """Базовый блок: инструкции от входа до перехода (или до следующего входа)."""
+
+    def __init__(self, start: int):
+        self.start = start
+        self.end = start
+        self.instructions: List[Tuple[int, str, bytes]] = []  # (адрес, мнемоника, операнды)
+        self.cycles = 0
+        self.successors: List[int] = []  # начала блоков, куда может перейти управление
+        self.calls: List[int] = []  # адреса подпрограмм, вызываемых из блока
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+
+class Loop:
+    """Цикл: заголовок, блоки тела и худшая стоимость одной итерации."""
+
+    def __init__(self, header: int, body: Set[int], cycles: int, size: int):
+        self.header = header
+        self.body = body
+        self.cycles = cycles
+        self.size = size
+
+
+class Analysis:
+    """Статический анализ машинного кода: граф переходов, стоимость блоков, меток, подпрограмм и циклов.
+
+    Банк цели перехода - последний BANK по тексту программы, как при проверке
+    переходов компилятором. Стоимость подпрограммы - худший путь от входа до
+    выхода, где каждый цикл проходится один раз и к CALL прибавляется худшая
+    стоимость вызываемой подпрограммы.
+    """
+
+    def __init__(self, machine_code: bytes, labels: Dict[str, int], cycles: Optional[Dict[str, int]] = None):
+        self.machine_code = machine_code
+        self.labels = labels
+        self.cycle_table = dict(DEFAULT_CYCLES)
+        if cycles:
+            unknown = [name for name in cycles if name not in OPCODES]
+            if unknown:
+                raise ValueError(f"неизвестные инструкции в таблице тактов: {', '.join(unknown)}")
+            self.cycle_table.update(cycles)
+        self._names = {}
+        for name, address in sorted(labels.items(), key=lambda item: item[1]):
+            self._names.setdefault(address, name)
+        self.blocks: Dict[int, Block] = {}
+        self.subroutines: Set[int] = set()
+        self.loops: List[Loop] = []
+        self._costs: Dict[int, int] = {}
+        self._build()
+        self._predecessors: Dict[int, List[int]] = {}
+        for address, block in self.blocks.items():
+            for successor in block.successors:
+                self._predecessors.setdefault(successor, []).append(address)
+        self._find_loops()
+
+    def name(self, address: int) -> str:
+        return self._names.get(address, hex(address))
+
+    def _decode(self) -> List[Tuple[int, str, bytes, Optional[int]]]:
+        """Инструкции по порядку: (адрес, мнемоника, операнды, цель перехода)."""
+        code = self.machine_code
+        result = []
+        address = 0
+        bank = 0
+        while address < len(code):
+            opcode = code[address]
+            size = INSTRUCTION_SIZES[opcode]
+            if size == 0:
+                raise CompilationError(f"Неизвестный опкод {hex(opcode)} по адресу {hex(address)}")
+            if address + size > len(code):
+                raise CompilationError(f"Инструкция по адресу {hex(address)} выходит за конец программы")
+            name = MNEMONICS[opcode]
+            operands = code[address + 1:address + size]
+            target = None
+            if name == 'BANK':
+                bank = operands[0]
+            elif name in BRANCHES or name == 'CALL':
+                target = bank * BANK_SIZE + operands[0]
+            result.append((address, name, operands, target))
+            address += size
+        return result
+
+    def _build(self):
+        instructions = self._decode()
+        end = len(self.machine_code)
+        leaders = {0} | {address for address in self.labels.values() if address < end}
+        for address, name, operands, target in instructions:
+            if target is not None and target < end:
+                leaders.add(target)
+                if name == 'CALL':
+                    self.subroutines.add(target)
+            if name in BRANCHES or name in ('RET', 'HLT'):
+                leaders.add(address + 1 + len(operands))
+        starts = {address for address, _, _, _ in instructions}
+        leaders &= starts  # переход в середину инструкции не образует блок
+
+        block = None
+        for address, name, operands, target in instructions:
+            if address in leaders:
+                if block is not None and block.instructions[-1][1] not in TERMINATORS:
+                    block.successors.append(address)
+                block = self.blocks[address] = Block(address)
+            block.instructions.append((address, name, operands))
+            block.end = address + 1 + len(operands)
+            block.cycles += self.cycle_table.get(name, 1)
+            if target in leaders:
+                if name == 'CALL':
+                    block.calls.append(target)
+                else:
+                    block.successors.append(target)
+        self.subroutines.add(0)
+
+    # Графовые обходы
+
+    def _reachable(self, entry: int) -> List[int]:
+        """Блоки подпрограммы: достижимые от входа без захода в вызываемые подпрограммы."""
+        seen = {entry}
+        order = [entry]
+        for address in order:
+            for successor in self.blocks[address].successors:
+                if successor not in seen:
+                    seen.add(successor)
+                    order.append(successor)
+        return order
+
+    def _back_edges(self, entry: int) -> Set[Tuple[int, int]]:
+        """Обратные рёбра обхода в глубину: переход на блок, который ещё на стеке обхода."""
+        back = set()
+        on_stack = {entry}
+        visited = {entry}
+        stack = [(entry, iter(self.blocks[entry].successors))]
+        while stack:
+            address, successors = stack[-1]
+            for successor in successors:
+                if successor in on_stack:
+                    back.add((address, successor))
+                elif successor not in visited:
+                    visited.add(successor)
+                    on_stack.add(successor)
+                    stack.append((successor, iter(self.blocks[successor].successors)))
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(address)
+        return back
+
+    def _find_loops(self):
+        seen_headers = set()
+        for entry in sorted(self.subroutines):
+            back = self._back_edges(entry)
+            latches: Dict[int, Set[int]] = {}
+            for source, header in back:
+                latches.setdefault(header, set()).add(source)
+            for header, sources in sorted(latches.items()):
+                if header in seen_headers:
+                    continue
+                seen_headers.add(header)
+                body = {header}
+                work = list(sources)
+                while work:
+                    address = work.pop()
+                    if address not in body:
+                        body.add(address)
+                        work.extend(self._predecessors.get(address, ()))
+                cycles = self._longest(header, back, body, sources)
+                size = sum(self.blocks[address].size for address in body)
+                self.loops.append(Loop(header, body, cycles, size))
+
+    def _block_cost(self, address: int, calls: bool = True) -> int:
+        block = self.blocks[address]
+        if not calls:
+            return block.cycles
+        return block.cycles + sum(self.cost(target) for target in block.calls)
+
+    def _longest(self, entry: int, back: Set[Tuple[int, int]], allowed: Optional[Set[int]] = None,
+                 exits: Optional[Set[int]] = None, calls: bool = True) -> int:
+        """Худший путь по тактам от entry без обратных рёбер.
+
+        allowed - допустимые блоки (тело цикла), exits - блоки, на которых путь
+        заканчивается (по умолчанию - на любом блоке без дальнейших переходов),
+        calls - прибавлять ли стоимость вызываемых подпрограмм.
+        """
+        memo: Dict[int, int] = {}
+        # Обратный топологический порядок: обход в глубину с явным стеком
+        order = []
+        visited = {entry}
+        stack = [(entry, iter(self.blocks[entry].successors))]
+        while stack:
+            address, successors = stack[-1]
+            for successor in successors:
+                if (address, successor) in back or successor in visited:
+                    continue
+                if allowed is not None and successor not in allowed:
+                    continue
+                visited.add(successor)
+                stack.append((successor, iter(self.blocks[successor].successors)))
+                break
+            else:
+                stack.pop()
+                order.append(address)
+        for address in order:
+            best = 0
+            if exits is None or address not in exits:
+                for successor in self.blocks[address].successors:
+                    if (address, successor) not in back and successor in memo:
+                        best = max(best, memo[successor])
+            memo[address] = self._block_cost(address, calls) + best
+        return memo[entry]
+
+    # Стоимость
+
+    def cost(self, entry: int) -> int:
+        """Худшая стоимость подпрограммы в тактах (циклы - по одной итерации)."""
+        if entry in self._costs:
+            return self._costs[entry]
+        if entry not in self.blocks:
+            return 0
+        self._costs[entry] = 0  # рекурсивный вызов считается бесплатным
+        self._costs[entry] = self._longest(entry, self._back_edges(entry))
+        return self._costs[entry]
+
+    def size(self, entry: int) -> int:
+        return sum(self.blocks[address].size for address in self._reachable(entry))
+
+    def label_costs(self) -> List[Tuple[str, int, int, int]]:
+        """(метка, адрес, байт, тактов) - от метки до следующей метки, без учёта переходов."""
+        addresses = sorted(set(self._names) | {0})
+        end = len(self.machine_code)
+        result = []
+        for index, address in enumerate(addresses):
+            if address >= end:
+                continue
+            stop = addresses[index + 1] if index + 1 < len(addresses) else end
+            cycles = sum(self.cycle_table.get(name, 1)
+                         for block in self.blocks.values() if address <= block.start < stop
+                         for _, name, _ in block.instructions)
+            result.append((self.name(address), address, stop - address, cycles))
+        return result
+
+    def bank_sizes(self) -> Dict[int, int]:
+        """Байт кода в каждом банке."""
+        end = len(self.machine_code)
+        return {bank: min(BANK_SIZE, end - bank * BANK_SIZE) for bank in range((end + BANK_SIZE - 1) // BANK_SIZE)}
+
+    def call_tree(self, entry: int = 0) -> List[Tuple[int, str, int, int]]:
+        """Дерево вызовов: (глубина, подпрограмма, собственный худший путь, с вызовами)."""
+        rows = []
+
+        def visit(address, depth, path):
+            own = self._longest(address, self._back_edges(address), calls=False)
+            rows.append((depth, self.name(address) + (' (рекурсия)' if address in path else ''), own,
+                         self.cost(address)))
+            if address in path:
+                return
+            callees = []
+            for block_address in self._reachable(address):
+                for target in self.blocks[block_address].calls:
+                    if target not in callees:
+                        callees.append(target)
+            for target in callees:
+                visit(target, depth + 1, path | {address})
+
+        visit(entry, 0, frozenset())
+        return rows
+
+    # Бюджеты
+
+    def violations(self, loop_budget: Optional[int] = None, bank_budget: Optional[int] = None) -> List[str]:
+        """Циклы дороже loop_budget тактов за итерацию и банки больше bank_budget байт."""
+        result = []
+        if loop_budget is not None:
+            for loop in self.loops:
+                if loop.cycles > loop_budget:
+                    result.append(f"Цикл {self.name(loop.header)}: {loop.cycles} тактов за итерацию "
+                                  f"(бюджет {loop_budget})")
+        if bank_budget is not None:
+            for bank, size in self.bank_sizes().items():
+                if size > bank_budget:
+                    result.append(f"Банк {bank}: {size} байт (бюджет {bank_budget})")
+        return result
+
+    def format(self) -> str:
+        rows = ["\nБазовые блоки:", "-" * 64,
+                f"{'Блок':<20} {'Адрес':>8} {'Байт':>6} {'Тактов':>8}  Переходы", "-" * 64]
+        for address in sorted(self.blocks):
+            block = self.blocks[address]
+            targets = ', '.join(self.name(successor) for successor in block.successors)
+            calls = ', '.join(f"CALL {self.name(target)}" for target in block.calls)
+            rows.append(f"{self.name(address):<20} {hex(address):>8} {block.size:>6} {block.cycles:>8}  "
+                        f"{'; '.join(part for part in (targets, calls) if part)}")
+
+        rows += ["\nМетки:", "-" * 64, f"{'Метка':<20} {'Адрес':>8} {'Байт':>6} {'Тактов':>8}", "-" * 64]
+        for name, address, size, cycles in self.label_costs():
+            rows.append(f"{name:<20} {hex(address):>8} {size:>6} {cycles:>8}")
+
+        rows += ["\nДерево вызовов (худший путь, циклы - по одной итерации):", "-" * 64,
+                 f"{'Подпрограмма':<36} {'Собств.':>12} {'С вызовами':>12}", "-" * 64]
+        for depth, name, own, total in self.call_tree():
+            rows.append(f"{'  ' * depth + name:<36} {own:>12} {total:>12}")
+
+        rows += ["\nЦиклы:", "-" * 64, f"{'Заголовок':<20} {'Блоков':>8} {'Байт':>6} {'Тактов/итер.':>14}", "-" * 64]
+        for loop in self.loops:
+            rows.append(f"{self.name(loop.header):<20} {len(loop.body):>8} {loop.size:>6} {loop.cycles:>14}")
+        if not self.loops:
+            rows.append("нет")
+
+        rows += ["\nБанки:", "-" * 64]
+        for bank, size in self.bank_sizes().items():
+            rows.append(f"Банк {bank}: {size} байт")
+        return '\n'.join(rows)
+
+
+def analyze(machine_code: bytes, labels: Dict[str, int], cycles: Optional[Dict[str, int]] = None) -> Analysis:
+    """Строит граф переходов собранной программы и считает её стоимость."""
+    return Analysis(machine_code, labels, cycles)
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    from pathlib import Path
+    from compiler import Compiler
+
+    args = sys.argv[1:]
+    usage = ("Использование: python analyzer.py <input_file> [-O] [--auto-bank] [--cycles <таблица.json>] "
+             "[--loop-budget <тактов>] [--bank-budget <байт>]")
+
+    def option(name):
+        if name not in args:
+            return None
+        index = args.index(name)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    def flag(name):
+        if name in args:
+            args.remove(name)
+            return True
+        return False
+
+    try:
+        cycles_file = option('--cycles')
+        loop_budget = option('--loop-budget')
+        bank_budget = option('--bank-budget')
+    except IndexError:
+        print(usage)
+        sys.exit(1)
+    compiler = Compiler()
+    compiler.optimize = flag('-O')
+    compiler.auto_bank = flag('--auto-bank')
+    if len(args) != 1:
+        print(usage)
+        sys.exit(1)
+
+    try:
+        cycles = None
+        if cycles_file:
+            with open(cycles_file, 'r', encoding='utf-8') as f:
+                cycles = json.load(f)
+        compiler.current_directory = Path(args[0]).parent
+        with open(args[0], 'r', encoding='utf-8') as f:
+            machine_code = compiler.assemble(f.readlines(), args[0])
+        analysis = analyze(bytes(machine_code), compiler.labels, cycles)
+    except CompilationError as e:
+        print(f"Ошибка компиляции: {e}")
+        sys.exit(1)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+
+    print(analysis.format())
+    problems = analysis.violations(int(loop_budget) if loop_budget else None,
+                                   int(bank_budget) if bank_budget else None)
+    if problems:
+        print("\nПревышен бюджет:")
+        for problem in problems:
+            print(f"- {problem}")
+        sys.exit(2)
@@ -0,0 +1,117 @@
+# assembler.py
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from binformat import FORMAT_HEX, encode_program
+from compiler import Compiler, DATA_START_ADDRESS
+from debugmap import DebugMap
+from errors import CompilationError
+
+BANK_SIZE = 256
+
+# Виды диагностик
+ERROR = 'error'
+WARNING = 'warning'
+
+Source = Union[str, Iterable[str]]
+# resolver(имя из .INCLUDE, файл, в котором стоит .INCLUDE) -> (путь, текст или строки) либо None
+IncludeResolver = Callable[[str, str], Optional[Tuple[str, Source]]]
+
+
+class Diagnostic:
+    """Сообщение сборки: ошибка (сборка не удалась) или предупреждение."""
+
+    def __init__(self, severity: str, message: str):
+        self.severity = severity
+        self.message = message
+
+    def __repr__(self):
+        return f"Diagnostic({self.severity!r}, {self.message!r})"
+
+    def __str__(self):
+        return self.message
+
+
+class AssemblyResult:
+    """Результат сборки в памяти: машинный код, метки, размеры банков и диагностики."""
+
+    def __init__(self, code: bytes, labels: Dict[str, int], diagnostics: List[Diagnostic], data: Optional[bytes] = None,
+                 included_files: Optional[List[str]] = None, optimization=None, bank_layout=None,
+                 debug_map: Optional[DebugMap] = None):
+        self.code = code
+        self.labels = labels
+        self.diagnostics = diagnostics
+        self.data = data  # сегмент данных с адреса DATA_START_ADDRESS (None - сборка без data_segment)
+        self.included_files = included_files or []
+        self.optimization = optimization
+        self.bank_layout = bank_layout
+        self.debug_map = debug_map
+
+    @property
+    def ok(self) -> bool:
+        return not any(diagnostic.severity == ERROR for diagnostic in self.diagnostics)
+
+    @property
+    def bank_sizes(self) -> Dict[int, int]:
+        """Байт кода в каждом банке."""
+        size = len(self.code)
+        return {bank: min(BANK_SIZE, size - bank * BANK_SIZE) for bank in range((size + BANK_SIZE - 1) // BANK_SIZE)}
+
+    def encode(self, output_format: str = FORMAT_HEX) -> bytes:
+        """Программа в формате вывода (hex, bin или vbin; см. binformat)."""
+        return encode_program(self.code, output_format, data=self.data, data_address=DATA_START_ADDRESS)
+
+
+def no_includes(name: str, including_file: str):
+    """Resolver по умолчанию: .INCLUDE не разрешается, файловая система не используется."""
+    return None
+
+
+def file_resolver(directory='.') -> IncludeResolver:
+    """Resolver, читающий .INCLUDE с диска: рядом с включающим файлом, затем в каталоге directory."""
+    base = Path(directory)
+
+    def resolve(name: str, including_file: str):
+        for folder in (Path(including_file).parent, base):
+            candidate = (folder / name).resolve()
+            if candidate.is_file():
+                with open(candidate, 'r', encoding='utf-8') as f:
+                    return str(candidate), f.read()
+        return None
+    return resolve
+
+
+def assemble(source: Source, include_resolver: Optional[IncludeResolver] = None,
+             defines: Optional[Dict[str, int]] = None, source_name: str = '<source>',
+             single_pass: bool = False, optimize: bool = False, auto_bank: bool = False,
+             data_segment: bool = False, debug_map: bool = False, tracer=None) -> AssemblyResult:
+    """Собирает программу из строки (или строк) в памяти.
+
+    Ничего не выводит и не обращается к файлам, кроме как через
+    include_resolver; каждый вызов использует собственный Compiler, поэтому
+    функцию можно вызывать повторно без общего состояния. defines - константы,
+    как если бы они были заданы .DEFINE в начале программы. Ошибки
+    компиляции возвращаются в diagnostics, а не исключением.
+    """
+    lines = source.splitlines(True) if isinstance(source, str) else list(source)
+    compiler = Compiler(tracer)
+    compiler.include_resolver = include_resolver if include_resolver is not None else no_includes
+    compiler.predefines = {name.upper(): value for name, value in (defines or {}).items()}
+    compiler.optimize = optimize
+    compiler.auto_bank = auto_bank
+    compiler.data_segment = data_segment
+    if debug_map:
+        compiler.debug_ranges = []
+
+    try:
+        machine_code = compiler.assemble(lines, source_name, single_pass)
+    except CompilationError as e:
+        return AssemblyResult(b'', {}, [Diagnostic(ERROR, str(e))], included_files=compiler.included_files)
+
+    diagnostics = []
+    report = compiler.optimization_report
+    if report is not None and report.disabled:
+        diagnostics.append(Diagnostic(WARNING, f"Сокращение кода отключено: {report.disabled}"))
+    return AssemblyResult(bytes(machine_code), dict(compiler.labels), diagnostics,
+                          bytes(compiler.data_bytes) if data_segment else None, compiler.included_files,
+                          report, compiler.bank_layout_report, compiler.debug_map() if debug_map else None)
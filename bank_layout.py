@@ -0,0 +1,309 @@
+# bank_layout.py
+from typing import Dict, List, Set, Tuple, Union
+
+from lexer import LABEL, DIRECTIVE, INSTRUCTION, Statement, parse_number
+from errors import CompilationError
+from optimizer import JUMPS, TERMINATORS, active_statements, layout, numeric_jump
+
+BANK_SIZE = 256
+# Инструкции, обращающиеся к памяти: перед ними должен быть активен банк данных
+MEMORY_ACCESS = ('STOREV', 'STORER', 'STOREM', 'LOADR', 'LOADRR', 'SAVKEY', 'CREAD', 'CWRITE')
+TRANSITION_SIZE = 4  # BANK n + JMP метка
+
+
+class BankLayoutReport:
+    """Итоги автоматической раскладки по банкам."""
+
+    def __init__(self):
+        self.iterations = 0
+        self.banks = 0
+        self.removed = 0       # BANK перед переходами, заменённые рассчитанными
+        self.inserted = 0      # вставленные BANK
+        self.cross_bank = 0    # переходы в другой банк
+        self.transitions = 0   # BANK + JMP через выравнивание до следующего банка
+        self.padding = 0       # байт NOP для выравнивания блоков
+        self.moved = 0         # цепочек блоков, перенесённых в остаток банка
+
+    def format(self) -> str:
+        return (f"\nАвтоматическая раскладка по банкам ({self.iterations} итер.): банков {self.banks}, "
+                f"переходов в другой банк {self.cross_bank}, BANK вставлено {self.inserted} "
+                f"(удалено ручных: {self.removed}), переходов на следующий банк {self.transitions}, "
+                f"байт выравнивания {self.padding}, цепочек перенесено {self.moved}")
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BankLayoutReport':
+        report = cls()
+        report.__dict__.update(data)
+        return report
+
+
+def split_blocks(statements: List[Statement]) -> List[List[Statement]]:
+    """Делит программу на блоки, каждый (кроме первого) начинается с меток."""
+    blocks = [[]]
+    for stmt in statements:
+        if stmt.kind == LABEL and any(s.kind != LABEL for s in blocks[-1]):
+            blocks.append([])
+        blocks[-1].append(stmt)
+    return [block for block in blocks if block]
+
+
+def split_chains(blocks: List[List[Statement]]) -> List[List[List[Statement]]]:
+    """Делит блоки на цепочки: блоки цепочки выполняются подряд, без перехода между ними."""
+    chains = [[blocks[0]]]
+    for block in blocks[1:]:
+        if _falls_through(chains[-1][-1]):
+            chains[-1].append(block)
+        else:
+            chains.append([block])
+    return chains
+
+
+def _movable(chain: List[List[Statement]]) -> bool:
+    """Цепочку можно переставить: в неё не попадают проваливанием и из неё не выходят проваливанием,
+    в ней нет директив (порядок .DEFINE важен) и BANK (выбор банка данных по тексту)."""
+    return not _falls_through(chain[-1]) and not any(
+        stmt.kind == DIRECTIVE or (stmt.kind == INSTRUCTION and stmt.name == 'BANK')
+        for block in chain for stmt in block)
+
+
+def pack_chains(compiler, chains: List[List[List[Statement]]], report: BankLayoutReport) -> List[List[Statement]]:
+    """Порядок блоков: остаток банка заполняется цепочками, связанными с этим банком переходами.
+
+    Цепочки идут в порядке текста. Если первый блок очередной цепочки не
+    помещается в остаток банка (и остаток ушёл бы на выравнивание), туда
+    ставится более поздняя переставляемая цепочка, которая помещается и
+    больше других переходит на метки этого банка или принимает переходы
+    из него. Размеры оцениваются с запасом на BANK перед каждым переходом.
+    """
+    sizes = [sum(_estimate(compiler, stmt) for block in chain for stmt in block) for chain in chains]
+    firsts = [sum(_estimate(compiler, stmt) for stmt in chain[0]) for chain in chains]
+    names = [{stmt.name for block in chain for stmt in block if stmt.kind == LABEL} for chain in chains]
+    targets = [{stmt.operands[0] for block in chain for stmt in block
+                if stmt.kind == INSTRUCTION and stmt.name in JUMPS and stmt.operands} for chain in chains]
+    data_at = []  # банк данных по тексту перед цепочкой: при перестановке он не должен меняться
+    data = 0
+    for chain in chains:
+        data_at.append(data)
+        for block in chain:
+            for stmt in block:
+                if stmt.kind == INSTRUCTION and stmt.name == 'BANK' and stmt.operands:
+                    data = _bank_value(stmt.operands[0])
+    movable = [index > 0 and _movable(chain) for index, chain in enumerate(chains)]
+
+    order: List[int] = []
+    placed = [False] * len(chains)
+    address = 0
+    bank_names: Set[str] = set()
+    bank_targets: Set[str] = set()
+
+    def place(index: int):
+        nonlocal address, bank_names, bank_targets
+        if address // BANK_SIZE != (address + sizes[index]) // BANK_SIZE:
+            bank_names, bank_targets = set(), set()  # конец цепочки - уже в следующем банке
+        order.append(index)
+        placed[index] = True
+        address += sizes[index]
+        bank_names |= names[index]
+        bank_targets |= targets[index]
+
+    for index in range(len(chains)):
+        if placed[index]:
+            continue
+        while index and address % BANK_SIZE and firsts[index] <= BANK_SIZE and \
+                address % BANK_SIZE + firsts[index] > BANK_SIZE:
+            room = BANK_SIZE - address % BANK_SIZE
+            best: Tuple[int, int] = (0, 0)
+            for candidate in range(index + 1, len(chains)):
+                if placed[candidate] or not movable[candidate] or sizes[candidate] > room or \
+                        data_at[candidate] != data_at[index]:
+                    continue
+                affinity = len(targets[candidate] & bank_names) + len(names[candidate] & bank_targets)
+                if affinity > best[0]:
+                    best = (affinity, candidate)
+            if not best[0]:
+                break
+            place(best[1])
+            report.moved += 1
+        place(index)
+    return [block for index in order for block in chains[index]]
+
+
+def _estimate(compiler, stmt: Statement) -> int:
+    if stmt.kind == INSTRUCTION and stmt.name in JUMPS:
+        return stmt.size + 2  # возможный BANK перед переходом
+    return _size(compiler, stmt)
+
+
+def drop_jump_banks(statements: List[Statement], report: BankLayoutReport) -> List[Statement]:
+    """Удаляет ручные BANK, стоящие прямо перед переходом: их заменят рассчитанные.
+
+    Остальные BANK считаются выбором банка данных и сохраняются.
+    """
+    result = []
+    for index, stmt in enumerate(statements):
+        if stmt.kind == INSTRUCTION and stmt.name == 'BANK' and index + 1 < len(statements):
+            following = statements[index + 1]
+            if following.kind == INSTRUCTION and following.name in JUMPS:
+                report.removed += 1
+                continue
+        result.append(stmt)
+    return result
+
+
+def _synthetic(compiler, stmt: Statement, name: str, operand: str, comment: str) -> Statement:
+    return Statement(INSTRUCTION, name, compiler.opcodes[name], (operand,), 2, stmt.file, stmt.line,
+                     f"{name} {operand}    ; {comment}")
+
+
+def _nop(compiler, stmt: Statement) -> Statement:
+    return Statement(INSTRUCTION, 'NOP', compiler.opcodes['NOP'], (), 1, stmt.file, stmt.line, "NOP    ; выравнивание банка")
+
+
+def _size(compiler, stmt: Statement) -> int:
+    if stmt.kind == DIRECTIVE and stmt.name == '.DB' and compiler.data_segment:
+        return 0
+    return stmt.size
+
+
+def _bank_value(operand: str) -> Union[int, str]:
+    """Номер банка из BANK n или имя метки из BANK <метка>."""
+    try:
+        return parse_number(operand)
+    except ValueError:
+        return operand
+
+
+def _emit(compiler, blocks, labels: Dict[str, int], decisions: Set[Tuple], report: BankLayoutReport) -> List[Statement]:
+    """Один проход раскладки по оценке адресов меток labels.
+
+    r - значение регистра банка во время выполнения (None - неизвестно),
+    linear - банк, который видит проверка компилятора (последний BANK по тексту),
+    data - банк данных, выбранный программистом.
+
+    decisions - перенесённые блоки и места вставленных BANK с прошлых итераций:
+    они сохраняются, даже если по новым адресам уже не нужны (лишний BANK
+    безвреден). Набор только растёт, а при том же наборе размеры вывода те же,
+    поэтому итерации сходятся - метка у границы банка не переходит туда и обратно.
+    """
+    out: List[Statement] = []
+    address = 0
+    r, linear, data = 0, 0, 0
+
+    def put(stmt):
+        nonlocal address
+        out.append(stmt)
+        address += _size(compiler, stmt)
+
+    for index, block in enumerate(blocks):
+        size = sum(_size(compiler, stmt) for stmt in block)
+        offset = address % BANK_SIZE
+        entered = True  # банк при входе в блок равен банку его меток
+        if index and offset and size <= BANK_SIZE and (('push', index) in decisions or offset + size > BANK_SIZE):
+            # Блок не помещается в остаток банка - переносим его в следующий банк целиком
+            decisions.add(('push', index))
+            next_bank = address // BANK_SIZE + 1
+            first = block[0]
+            if _falls_through(blocks[index - 1]):
+                if BANK_SIZE - offset >= TRANSITION_SIZE:
+                    put(_synthetic(compiler, first, 'BANK', str(next_bank), "переход на следующий банк"))
+                    put(_synthetic(compiler, first, 'JMP', first.name, "переход на следующий банк"))
+                    report.transitions += 1
+                    r = linear = next_bank
+                else:
+                    entered = False  # для BANK + JMP нет места: выполнение дойдёт до блока по NOP
+            padding = next_bank * BANK_SIZE - address
+            report.padding += padding
+            for _ in range(padding):
+                put(_nop(compiler, first))
+
+        for position, stmt in enumerate(block):
+            if stmt.kind == LABEL:
+                # По построению в метку попадают с регистром банка, равным её банку
+                r = address // BANK_SIZE if entered else None
+                put(stmt)
+                continue
+            if stmt.kind == INSTRUCTION and stmt.name in JUMPS and stmt.operands and stmt.operands[0] in labels:
+                target = labels[stmt.operands[0]] // BANK_SIZE
+                if target != address // BANK_SIZE:
+                    report.cross_bank += 1
+                if _decide(decisions, ('jump', index, position), r != target or linear != target):
+                    put(_synthetic(compiler, stmt, 'BANK', str(target), f"переход на {stmt.operands[0]}"))
+                    report.inserted += 1
+                    r = linear = target
+                put(stmt)
+                if stmt.name == 'CALL':
+                    r = None  # подпрограмма могла оставить другой банк
+                continue
+            if (stmt.kind == INSTRUCTION and stmt.name in MEMORY_ACCESS) or \
+                    (stmt.kind == DIRECTIVE and stmt.name == '.DB' and not compiler.data_segment):
+                if _decide(decisions, ('data', index, position), r != data):
+                    put(_synthetic(compiler, stmt, 'BANK', str(data), "банк данных"))
+                    report.inserted += 1
+                    r = linear = data
+            elif stmt.kind == INSTRUCTION and stmt.name == 'BANK' and stmt.operands:
+                r = linear = data = _bank_value(stmt.operands[0])
+            put(stmt)
+
+        if index + 1 < len(blocks) and _falls_through(block):
+            next_bank = labels.get(blocks[index + 1][0].name, address) // BANK_SIZE
+            if _decide(decisions, ('next', index), r != next_bank):
+                put(_synthetic(compiler, block[-1], 'BANK', str(next_bank), "переход на следующий блок"))
+                report.inserted += 1
+                r = linear = next_bank
+    return out
+
+
+def _decide(decisions: Set[Tuple], key: Tuple, needed: bool) -> bool:
+    """Вставка нужна сейчас или была нужна на прошлой итерации."""
+    if needed:
+        decisions.add(key)
+        return True
+    return key in decisions
+
+
+def _falls_through(block: List[Statement]) -> bool:
+    instructions = [stmt for stmt in block if stmt.kind == INSTRUCTION]
+    return not instructions or instructions[-1].name not in TERMINATORS
+
+
+def auto_bank(compiler, statements: List[Statement]):
+    """Раскладывает программу по банкам и расставляет BANK сама.
+
+    Программа делится на блоки по меткам; блок, который помещается в банк,
+    не разрезается границей банка (при нехватке места он начинается со
+    следующего банка), чтобы циклы не переключали банк на каждой итерации.
+    Остаток банка перед таким переносом заполняется подходящими цепочками
+    блоков (pack_chains). BANK вставляется только перед переходами в другой
+    банк и там, где банк уже не тот, что нужен. Вставки сдвигают адреса,
+    поэтому раскладка повторяется до совпадения адресов меток с предыдущей
+    итерацией; решения прошлых итераций не отменяются, так что повторы конечны.
+    """
+    statements = active_statements(compiler, statements)
+    fixed = numeric_jump(statements)
+    if fixed is not None:
+        raise CompilationError(f"{fixed.location()}: Переход по числовому адресу или выражению несовместим с --auto-bank\n{fixed.text}")
+
+    report = BankLayoutReport()
+    statements = drop_jump_banks(statements, report)
+    if not statements:
+        return statements, report
+    blocks = pack_chains(compiler, split_chains(split_blocks(statements)), report)
+    removed, moved = report.removed, report.moved
+    labels = layout(compiler, [stmt for block in blocks for stmt in block])
+    decisions: Set[Tuple] = set()
+    iteration = 0
+    while True:
+        iteration += 1
+        report = BankLayoutReport()
+        report.removed, report.moved = removed, moved
+        report.iterations = iteration
+        out = _emit(compiler, blocks, labels, decisions, report)
+        new_labels = layout(compiler, out)
+        if new_labels == labels:
+            size = sum(_size(compiler, stmt) for stmt in out)
+            report.banks = (size + BANK_SIZE - 1) // BANK_SIZE
+            return out, report
+        labels = new_labels
@@ -0,0 +1,160 @@
+# batch.py
+import glob
+import os
+import shlex
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from compiler import Compiler
+from build_cache import BuildCache
+from errors import CompilationError
+from binformat import EXTENSIONS, FORMAT_HEX
+
+
+class BatchJob:
+    """Один исходник пакетной сборки и место, куда записать результат."""
+    __slots__ = ('index', 'input_file', 'output_file', 'section')
+
+    def __init__(self, index: int, input_file: str, output_file: str, section: Optional[int] = None):
+        self.index = index
+        self.input_file = input_file
+        self.output_file = output_file
+        self.section = section  # номер секции кассеты или None для обычного файла
+
+
+class BatchResult:
+    """Результат сборки одного исходника в процессе-исполнителе."""
+    __slots__ = ('job', 'machine_code', 'error', 'seconds', 'lines')
+
+    def __init__(self, job: BatchJob, machine_code: Optional[List[int]], error: Optional[str], seconds: float, lines: int):
+        self.job = job
+        self.machine_code = machine_code
+        self.error = error
+        self.seconds = seconds
+        self.lines = lines
+
+
+def parse_manifest(path) -> List[BatchJob]:
+    """Читает манифест: по строке на исходник в формате командной строки main.py.
+
+        <output_file> <input_file>
+        --cassette <section_number> <output_file> <input_file>
+
+    Пустые строки и строки, начинающиеся с ';' или '#', пропускаются.
+    Относительные пути отсчитываются от каталога манифеста.
+    """
+    base = Path(path).parent
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line[0] in ';#':
+                continue
+            parts = shlex.split(line)
+            section = None
+            if parts[0] == '--cassette':
+                try:
+                    section = int(parts[1])
+                except (ValueError, IndexError):
+                    section = -1
+                parts = parts[2:]
+            if len(parts) != 2 or (section is not None and section < 0):
+                raise CompilationError(f"{path}, строка {line_num}: Неверный формат задания: {line}")
+            output_file, input_file = (str(base / part) for part in parts)
+            jobs.append(BatchJob(len(jobs), input_file, output_file, section))
+    return jobs
+
+def jobs_from_glob(pattern: str, output_format: str = FORMAT_HEX) -> List[BatchJob]:
+    """Задания для всех файлов по маске; результат пишется рядом с исходником с расширением формата."""
+    extension = EXTENSIONS[output_format]
+    return [BatchJob(index, path, str(Path(path).with_suffix(extension)))
+            for index, path in enumerate(sorted(glob.glob(pattern, recursive=True)))]
+
+
+def assemble_job(job: BatchJob, single_pass: bool, cache_dir: Optional[str]) -> BatchResult:
+    """Собирает один исходник новым экземпляром Compiler (выполняется в процессе пула).
+
+    Любая ошибка сборки записывается в результат задания: один исходник
+    (например, не в UTF-8) не должен прерывать весь пакет.
+    """
+    start = time.perf_counter()
+    compiler = Compiler()
+    cache = BuildCache(cache_dir) if cache_dir is not None else None
+    output_mode = 'cassette' if job.section is not None else 'hex'
+    try:
+        machine_code = compiler.build(job.input_file, single_pass, cache, output_mode)
+        error = None
+    except (CompilationError, OSError) as e:
+        machine_code = None
+        error = str(e)
+    except UnicodeDecodeError as e:
+        machine_code = None
+        error = f"Файл не в кодировке UTF-8 ({e.reason}, байт {e.start})"
+    except Exception as e:
+        machine_code = None
+        error = f"{type(e).__name__}: {e}"
+    return BatchResult(job, machine_code, error, time.perf_counter() - start, compiler.stats.lines)
+
+
+def run_batch(jobs: List[BatchJob], workers: Optional[int] = None, single_pass: bool = False,
+              cache_dir: Optional[str] = None, output_format: str = FORMAT_HEX) -> List[BatchResult]:
+    """Собирает исходники параллельно и записывает результаты.
+
+    Результаты возвращаются и записываются в порядке заданий, поэтому вывод
+    не зависит от порядка завершения процессов. Секции одной кассеты
+    собираются вместе, и файл кассеты перезаписывается один раз.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        results = [assemble_job(job, single_pass, cache_dir) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            results = list(pool.map(assemble_job, jobs, [single_pass] * len(jobs), [cache_dir] * len(jobs)))
+
+    writer = Compiler()
+    cassettes: Dict[str, Dict[int, List[int]]] = {}
+    cassette_results: Dict[str, List[BatchResult]] = {}
+    for result in results:
+        job = result.job
+        if result.error is not None:
+            continue
+        if job.section is None:
+            if not writer._write_to_file(job.output_file, result.machine_code, output_format):
+                result.error = f"Ошибка записи в файл: {job.output_file}"
+            continue
+        key = os.path.normcase(os.path.abspath(job.output_file))
+        sections = cassettes.setdefault(key, {})
+        if job.section in sections:
+            result.error = f"Секция {job.section} кассеты '{job.output_file}' уже занята другим исходником"
+            continue
+        sections[job.section] = result.machine_code
+        cassette_results.setdefault(key, []).append(result)
+
+    for key, sections in cassettes.items():
+        output_file = cassette_results[key][0].job.output_file
+        if not writer._write_cassette_sections(output_file, sections):
+            for result in cassette_results[key]:
+                result.error = f"Ошибка записи в кассету: {output_file}"
+    return results
+
+
+def format_summary(results: List[BatchResult], seconds: float) -> str:
+    """Сводка пакетной сборки: ошибки по файлам и пропускная способность."""
+    rows = []
+    failed = [result for result in results if result.error is not None]
+    for result in failed:
+        rows.append(f"Ошибка: {result.job.input_file}\n{result.error}\n")
+    lines = sum(result.lines for result in results)
+    size = sum(len(result.machine_code) for result in results if result.error is None and result.machine_code)
+    rows.append("Пакетная сборка:")
+    rows.append("-" * 40)
+    rows.append(f"{'Файлов':<24} {len(results):>10} (ошибок: {len(failed)})")
+    rows.append(f"{'Строк исходника':<24} {lines:>10}")
+    rows.append(f"{'Байт машинного кода':<24} {size:>10}")
+    rows.append(f"{'Время':<24} {seconds * 1000:>10.3f} мс")
+    if seconds > 0:
+        rows.append(f"{'Скорость':<24} {len(results) / seconds:>10.1f} файлов/с, {lines / seconds:.0f} строк/с")
+    rows.append("-" * 40)
+    return '\n'.join(rows)
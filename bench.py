@@ -0,0 +1,295 @@
+# bench.py
+import contextlib
+import io
+import json
+import math
+import platform
+import statistics
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from binformat import FORMAT_BIN
+from cassette import Cassette, SECTION_SIZE
+from compiler import Compiler
+from disassembly import Disassembler
+from tracing import Stats, PHASE_NAMES
+
+RESULTS_VERSION = 2
+PHASES = ('include', 'pass1', 'pass2', 'output', 'cassette', 'disassemble')
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 10.0  # допустимое замедление фазы, %
+DEFAULT_MIN_DELTA = 0.001  # замедление меньше этого (секунд) - шум, а не регрессия
+DATA_SIZE = 0x100 - 0x80  # байт сегмента данных с DATA_START_ADDRESS до конца банка
+
+STRAIGHT_LINE = ('ADD R1 R2', 'MOV R3 R1', 'SET R2 0X05', 'CMP R1 R3', 'NOP', 'SETPX R1 R2 R3')
+
+# Генераторы: параметр -> {имя файла: текст}, основной файл - MAIN
+MAIN = 'main.asm'
+Files = Dict[str, str]
+
+
+def straight_line(lines: int) -> Files:
+    """Линейный код без переходов."""
+    body = [f"    {STRAIGHT_LINE[i % len(STRAIGHT_LINE)]}\n" for i in range(lines)]
+    return {MAIN: ":START\n" + ''.join(body) + "    HLT\n"}
+
+
+def jump_heavy(banks: int) -> Files:
+    """Банки по 256 байт: циклы с переходами внутри банка и CALL в следующий банк через BANK <метка>."""
+    rows = []
+    for bank in range(banks):
+        target = (bank + 1) % banks
+        rows += [f"BANK {bank}\n", f":LOOP{bank}\n"]
+        for i in range(40):
+            rows.append("    CMP R1 R3\n" if i % 4 == 0 else f"    JNE LOOP{bank}\n" if i % 2 else "    ADD R1 R2\n")
+        rows += [f"    BANK FUNC{target}\n", f"    CALL FUNC{target}\n", f"    BANK {bank}\n",
+                 f"    JMP LOOP{bank}\n", f":FUNC{bank}\n", "    RET\n"]
+        # BANK 2 + 10*3 + 20*2 + 10*3 + BANK 2 + CALL 2 + BANK 2 + JMP 2 + RET 1 = 111 байт
+        rows += ["    NOP\n"] * (SECTION_SIZE - 111)
+    return {MAIN: ''.join(rows)}
+
+
+def db_tables(values: int) -> Files:
+    """Таблицы .DB по 16 значений в строке.
+
+    Данные размещаются с адреса 0x80 до конца банка, поэтому значений не
+    больше 128; для большего объёма таблицы повторяются в условных блоках,
+    которые разбираются, но не попадают в сборку.
+    """
+    rows = [".DEFINE BASE 0X80\n"]
+    for block in range(0, values, DATA_SIZE):
+        count = min(DATA_SIZE, values - block)
+        if block:
+            rows.append(".IFNDEF BASE\n")
+        for start in range(0, count, 16):
+            rows.append(".DB " + ', '.join(str((block + start + i) % 256) for i in range(min(16, count - start))) + "\n")
+        if block:
+            rows.append(".ENDIF\n")
+    rows += [":START\n", "    SET R1 BASE\n", "    HLT\n"]
+    return {MAIN: ''.join(rows)}
+
+
+def include_tree(depth: int, fanout: int = 4, lines: int = 20) -> Files:
+    """Дерево .INCLUDE глубины depth с защитой .IFNDEF; общий файл включается из каждого узла."""
+    files = {'common.asm': ".IFNDEF COMMON_ASM\n.DEFINE COMMON_ASM 1\n    NOP\n.ENDIF\n"}
+
+    def node(path: str, level: int) -> str:
+        name = f"inc{path}.asm"
+        guard = f"INC{path}_ASM"
+        rows = [f".IFNDEF {guard}\n", f".DEFINE {guard} 1\n", ".INCLUDE common.asm\n"]
+        if level < depth:
+            rows += [f".INCLUDE {node(f'{path}_{child}', level + 1)}\n" for child in range(fanout)]
+        rows += [f"    {STRAIGHT_LINE[i % len(STRAIGHT_LINE)]}\n" for i in range(lines)]
+        rows.append(".ENDIF\n")
+        files[name] = ''.join(rows)
+        return name
+
+    files[MAIN] = f":START\n.INCLUDE {node('', 0)}\n.INCLUDE inc.asm\n    HLT\n"
+    return files
+
+
+def many_defines(count: int) -> Files:
+    """count констант .DEFINE и по инструкции на каждую."""
+    rows = [f".DEFINE C{i} {i % 256}\n" for i in range(count)]
+    rows.append(":START\n")
+    rows += [f"    SET R{1 + i % 3} C{i}\n" for i in range(count)]
+    rows.append("    HLT\n")
+    return {MAIN: ''.join(rows)}
+
+
+# Сценарии: имя -> (генератор, параметр при масштабе 1)
+SCENARIOS: Dict[str, Tuple[Callable[[int], Files], int]] = {
+    'straight': (straight_line, 20000),
+    'jumps': (jump_heavy, 64),
+    'db': (db_tables, 16384),
+    'includes': (include_tree, 4),
+    'defines': (many_defines, 5000),
+}
+
+
+def _write(directory: Path, files: Files):
+    for name, text in files.items():
+        with open(directory / name, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def measure(directory: Path) -> Tuple[Stats, int]:
+    """Один прогон всех фаз над программой в directory; возвращает время фаз и размер кода."""
+    stats = Stats()
+    compiler = Compiler()  # новый компилятор - кэш INCLUDE пуст, как при запуске main.py
+    compiler.stats = stats
+    compiler.current_directory = directory
+    source = directory / MAIN
+    binary = directory / 'program.bin'
+    tape = directory / 'program.vcas'
+
+    with open(source, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    with stats.phase('include'):
+        statements = compiler.preprocess_includes(lines, str(source))
+    with stats.phase('pass1'):
+        compiler.first_pass(statements)
+    compiler.defines = dict(compiler.predefines)
+    with stats.phase('pass2'):
+        machine_code = compiler.second_pass(statements)
+
+    sections = {index: machine_code[start:start + SECTION_SIZE]
+                for index, start in enumerate(range(0, len(machine_code), SECTION_SIZE))}
+    Cassette.create(tape, max(1, len(sections))).close()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with stats.phase('output'):
+            written = compiler._write_to_file(binary, machine_code, FORMAT_BIN)
+        with stats.phase('cassette'):
+            written = compiler._write_cassette_sections(tape, sections) and written
+        with stats.phase('disassemble'):
+            written = Disassembler().disassemble(str(binary), str(directory / 'program.asm')) and written
+    if not written:
+        raise RuntimeError("ошибка записи результата (см. вывод компилятора)")
+    return stats, len(machine_code)
+
+
+def run(scale: float = 1.0, repeat: int = DEFAULT_REPEAT, only: Optional[List[str]] = None, progress=None) -> Dict:
+    """Прогоняет сценарии repeat раз; время фазы - медиана, отдельные замеры сохраняются для сравнения."""
+    results = {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'repeat': repeat,
+        'scenarios': {},
+    }
+    for name, (generator, parameter) in SCENARIOS.items():
+        if only and name not in only:
+            continue
+        if generator is include_tree:
+            # число файлов растёт как 4 ** глубина, поэтому масштаб меняет глубину
+            parameter = max(1, parameter + round(math.log(scale, 4)))
+        else:
+            parameter = max(1, round(parameter * scale))
+        files = generator(parameter)
+        samples: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+        with tempfile.TemporaryDirectory(prefix='vasm-bench-') as folder:
+            directory = Path(folder)
+            _write(directory, files)
+            for _ in range(repeat):
+                stats, size = measure(directory)
+                for phase in PHASES:
+                    samples[phase].append(stats.phases[phase])
+        results['scenarios'][name] = {
+            'parameter': parameter,
+            'files': len(files),
+            'lines': stats.lines,
+            'bytes': size,
+            'phases': {phase: statistics.median(samples[phase]) for phase in PHASES},
+            'samples': {phase: sorted(samples[phase]) for phase in PHASES},
+        }
+        if progress is not None:
+            progress(name, results['scenarios'][name])
+    return results
+
+
+def compare(old: Dict, new: Dict, threshold: float = DEFAULT_THRESHOLD,
+            min_delta: float = DEFAULT_MIN_DELTA) -> Tuple[List[str], List[str]]:
+    """Сравнивает два прогона; возвращает строки таблицы и список регрессий.
+
+    Регрессия - медиана фазы выросла больше чем на threshold процентов и
+    не меньше чем на min_delta секунд, а каждый новый замер медленнее
+    каждого прежнего. Шум между прогонами на одном дереве бывает в десятки
+    процентов, поэтому одного порога в процентах мало.
+    """
+    rows = [f"{'Сценарий':<10} {'Фаза':<24} {'Было, мс':>10} {'Стало, мс':>10} {'Изменение':>10}", "-" * 68]
+    regressions = []
+    for name, scenario in new['scenarios'].items():
+        baseline = old.get('scenarios', {}).get(name)
+        if baseline is None:
+            continue
+        if baseline['parameter'] != scenario['parameter']:
+            rows.append(f"{name:<10} другой размер программы ({baseline['parameter']} -> {scenario['parameter']}), пропущен")
+            continue
+        for phase, seconds in scenario['phases'].items():
+            before = baseline['phases'].get(phase)
+            if before is None:
+                continue
+            change = (seconds - before) * 100 / before if before else 0.0
+            mark = ''
+            separated = min(scenario['samples'][phase]) > max(baseline['samples'][phase])
+            if change > threshold and seconds - before >= min_delta and separated:
+                mark = '  РЕГРЕССИЯ'
+                regressions.append(f"{name}: {PHASE_NAMES.get(phase, phase)} медленнее на {change:.1f}% "
+                                   f"({before * 1000:.3f} -> {seconds * 1000:.3f} мс)")
+            rows.append(f"{name:<10} {PHASE_NAMES.get(phase, phase):<24} {before * 1000:>10.3f} "
+                        f"{seconds * 1000:>10.3f} {change:>+9.1f}%{mark}")
+    return rows, regressions
+
+
+def format_scenario(name: str, scenario: Dict) -> str:
+    total = sum(scenario['phases'].values())
+    rows = [f"\n{name}: параметр {scenario['parameter']}, файлов {scenario['files']}, строк {scenario['lines']}, "
+            f"байт кода {scenario['bytes']}"]
+    for phase, seconds in scenario['phases'].items():
+        rows.append(f"  {PHASE_NAMES.get(phase, phase):<24} {seconds * 1000:>10.3f} мс")
+    rate = scenario['lines'] / total if total > 0 else 0.0
+    rows.append(f"  {'Всего':<24} {total * 1000:>10.3f} мс ({rate:.0f} строк/с)")
+    return '\n'.join(rows)
+
+
+if __name__ == "__main__":
+    import sys
+
+    args = sys.argv[1:]
+    usage = ("Использование: python bench.py [--scale <множитель>] [--repeat <n>] [--only <сценарий,...>] "
+             "[--output <результат.json>] [--compare <прошлый.json>] [--threshold <%>] [--min-delta <мс>]\n"
+             f"Сценарии: {', '.join(SCENARIOS)}")
+
+    def option(name):
+        if name not in args:
+            return None
+        index = args.index(name)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    try:
+        scale = float(option('--scale') or 1)
+        repeat = int(option('--repeat') or DEFAULT_REPEAT)
+        only = option('--only')
+        output_file = option('--output')
+        baseline_file = option('--compare')
+        threshold = float(option('--threshold') or DEFAULT_THRESHOLD)
+        min_delta = float(option('--min-delta') or DEFAULT_MIN_DELTA * 1000) / 1000
+    except (IndexError, ValueError):
+        print(usage)
+        sys.exit(1)
+    only = only.split(',') if only else None
+    if args or repeat < 1 or scale <= 0 or (only and any(name not in SCENARIOS for name in only)):
+        print(usage)
+        sys.exit(1)
+
+    baseline = None
+    if baseline_file:
+        try:
+            with open(baseline_file, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка чтения {baseline_file}: {e}")
+            sys.exit(1)
+        if baseline.get('version') != RESULTS_VERSION:
+            print(f"Ошибка: {baseline_file} записан другой версией bench.py")
+            sys.exit(1)
+
+    results = run(scale, repeat, only, lambda name, scenario: print(format_scenario(name, scenario), flush=True))
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты записаны в {output_file}")
+
+    if baseline is not None:
+        rows, regressions = compare(baseline, results, threshold, min_delta)
+        print(f"\nСравнение с {baseline_file} (порог {threshold:.1f}% и {min_delta * 1000:.3f} мс):")
+        print('\n'.join(rows))
+        if regressions:
+            print("\nРегрессии производительности:")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(2)
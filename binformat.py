@@ -0,0 +1,109 @@
+# binformat.py
+import struct
+from typing import Dict, Optional, Tuple
+
+# Форматы вывода программы
+FORMAT_HEX = 'hex'    # текст "01 02 ff ", как раньше
+FORMAT_BIN = 'bin'    # сырые байты
+FORMAT_VBIN = 'vbin'  # сырые байты с заголовком
+FORMATS = (FORMAT_HEX, FORMAT_BIN, FORMAT_VBIN)
+# Расширение файла по формату (для результатов пакетной сборки по маске)
+EXTENSIONS = {FORMAT_HEX: '.hex', FORMAT_BIN: '.bin', FORMAT_VBIN: '.vbin'}
+
+VBIN_MAGIC = b'VBIN'
+VBIN_VERSION = 2
+# magic, версия, флаги, размер программы, точка входа, число банков, резерв
+VBIN_HEADER = struct.Struct('<4sBBIHHH')
+# Заголовок версии 1 (размер и число банков не вмещали программу на всю память): только чтение
+VBIN_HEADER_V1 = struct.Struct('<4sBBHHBB')
+VBIN_HEADERS = {1: VBIN_HEADER_V1, VBIN_VERSION: VBIN_HEADER}
+# Флаг заголовка: за заголовком идёт описание сегмента данных (адрес, размер),
+# а сами данные - после кода; загрузчик копирует их в память до запуска
+FLAG_DATA_SEGMENT = 0x01
+VBIN_DATA_HEADER = struct.Struct('<HH')
+
+BANK_SIZE = 256
+
+
+def encode_program(machine_code, output_format: str = FORMAT_HEX, entry: int = 0,
+                   data: Optional[bytes] = None, data_address: int = 0) -> bytes:
+    """Кодирует машинный код (и сегмент данных, только для vbin) в выбранный формат одним буфером."""
+    code = bytes(machine_code)
+    if data is not None and output_format != FORMAT_VBIN:
+        raise ValueError(f"сегмент данных можно записать только в формате {FORMAT_VBIN}")
+    if output_format == FORMAT_HEX:
+        return (code.hex(' ') + ' ').encode('ascii') if code else b''
+    if output_format == FORMAT_BIN:
+        return code
+    if output_format == FORMAT_VBIN:
+        banks = (len(code) + BANK_SIZE - 1) // BANK_SIZE
+        if data is None:
+            return VBIN_HEADER.pack(VBIN_MAGIC, VBIN_VERSION, 0, len(code), entry, banks, 0) + code
+        return (VBIN_HEADER.pack(VBIN_MAGIC, VBIN_VERSION, FLAG_DATA_SEGMENT, len(code), entry, banks, 0) +
+                VBIN_DATA_HEADER.pack(data_address, len(data)) + code + bytes(data))
+    raise ValueError(f"неизвестный формат вывода: {output_format}")
+
+
+def unpack_vbin_header(data) -> Tuple[Dict, int]:
+    """Сведения заголовка vbin любой поддерживаемой версии и его размер."""
+    version = data[len(VBIN_MAGIC)] if len(data) > len(VBIN_MAGIC) else None
+    header = VBIN_HEADERS.get(version)
+    if header is None:
+        raise ValueError(f"неподдерживаемая версия формата VBIN: {version}")
+    if len(data) < header.size:
+        raise ValueError("заголовок VBIN обрезан")
+    _, version, flags, size, entry, banks, _ = header.unpack_from(data)
+    return {'format': FORMAT_VBIN, 'version': version, 'flags': flags,
+            'size': size, 'entry': entry, 'banks': banks}, header.size
+
+
+def decode_program(data: bytes) -> Tuple[bytes, Dict]:
+    """Определяет формат по содержимому и возвращает машинный код и сведения заголовка."""
+    if data.startswith(VBIN_MAGIC) and len(data) > len(VBIN_MAGIC):
+        info, offset = unpack_vbin_header(data)
+        flags, size = info['flags'], info['size']
+        if flags & FLAG_DATA_SEGMENT:
+            info['data_address'], data_size = VBIN_DATA_HEADER.unpack_from(data, offset)
+            offset += VBIN_DATA_HEADER.size
+            info['data'] = data[offset + size:offset + size + data_size]
+        return data[offset:offset + size], info
+    try:
+        text = data.decode('ascii')
+        code = bytes.fromhex(text)
+        if len(text.split()) == len(code):  # каждый байт - отдельный токен "xx"
+            return code, {'format': FORMAT_HEX, 'size': len(code), 'entry': 0}
+    except (UnicodeDecodeError, ValueError):
+        pass
+    return data, {'format': FORMAT_BIN, 'size': len(data), 'entry': 0}
+
+
+def detect_format(head: bytes, complete: bool = True) -> str:
+    """Определяет формат по началу файла (без чтения всего файла).
+
+    complete=False - head обрезан посередине файла, последний неполный токен
+    hex-текста при проверке отбрасывается. Hex-текст всегда разделён
+    пробелами или переводами строк: начало без разделителей (например,
+    мегабайт байтов 0x01 в сыром дампе) - это bin.
+    """
+    if head.startswith(VBIN_MAGIC):
+        return FORMAT_VBIN
+    try:
+        text = head.decode('ascii')
+    except UnicodeDecodeError:
+        return FORMAT_BIN
+    if not complete:
+        text = text[:max(text.rfind(' '), text.rfind('\n')) + 1]
+    if ' ' not in text and '\n' not in text:
+        return FORMAT_BIN
+    try:
+        code = bytes.fromhex(text)
+    except ValueError:
+        return FORMAT_BIN
+    return FORMAT_HEX if len(text.split()) == len(code) else FORMAT_BIN
+
+
+def read_program(path) -> Tuple[bytes, Dict]:
+    """Читает программу в любом из форматов вывода ассемблера."""
+    with open(path, 'rb') as f:
+        return decode_program(f.read())
+
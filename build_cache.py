@@ -0,0 +1,173 @@
+# build_cache.py
+import contextlib
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка через msvcrt
+    fcntl = None
+    import msvcrt
+
+CACHE_FORMAT_VERSION = 2
+
+
+def _sources_digest() -> str:
+    """Хэш исходников ассемблера (все модули рядом с этим файлом).
+
+    Входит в ключ записи: после обновления ассемблера (новые проверки,
+    другие операнды инструкций) тот же исходник может собираться иначе,
+    и прежние записи не должны подставляться.
+    """
+    hasher = hashlib.sha256()
+    for path in sorted(Path(__file__).resolve().parent.glob('*.py')):
+        hasher.update(path.name.encode('utf-8'))
+        hasher.update(hashlib.sha256(path.read_bytes()).digest())
+    return hasher.hexdigest()
+
+
+ASSEMBLER_VERSION = _sources_digest()  # считается при загрузке модуля - по коду, который и выполняется
+DEFAULT_CACHE_DIR = Path(os.environ.get('VASM_CACHE_DIR', Path.home() / '.cache' / 'vasm'))
+DEFAULT_SIZE_LIMIT = int(os.environ.get('VASM_CACHE_LIMIT', 64 * 1024 * 1024))  # байт
+
+
+class BuildCache:
+    """Постоянный кэш результатов сборки, адресуемый по содержимому исходников.
+
+    Ключ записи - хэш содержимого основного файла и всех файлов .INCLUDE,
+    таблицы опкодов, режима вывода и исходников самого ассемблера. Список зависимостей основного файла
+    хранится отдельно (deps/), чтобы при проверке не разбирать исходник.
+    Записи (entries/) вытесняются по давности использования (LRU) при
+    превышении size_limit.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, size_limit: int = DEFAULT_SIZE_LIMIT):
+        self.directory = Path(directory)
+        self.size_limit = size_limit
+        self.entries_dir = self.directory / 'entries'
+        self.deps_dir = self.directory / 'deps'
+        self.stats_file = self.directory / 'stats.json'
+        self.lock_file = self.directory / 'stats.lock'
+
+    def _digest(self, data) -> str:
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _deps_path(self, source_file, options: Dict) -> Path:
+        root = os.path.normcase(str(Path(source_file).resolve()))
+        return self.deps_dir / f"{self._digest([root, options])}.json"
+
+    def _key(self, dependencies: List[str], options: Dict, opcodes: Dict[str, int]) -> Optional[str]:
+        """Хэш всего транзитивного входа сборки; None, если зависимость пропала."""
+        hasher = hashlib.sha256()
+        hasher.update(self._digest([CACHE_FORMAT_VERSION, ASSEMBLER_VERSION, sorted(opcodes.items()), options]).encode('ascii'))
+        for path in dependencies:
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except OSError:
+                return None
+            hasher.update(os.path.normcase(path).encode('utf-8'))
+            hasher.update(hashlib.sha256(content).digest())
+        return hasher.hexdigest()
+
+    def lookup(self, source_file, options: Dict, opcodes: Dict[str, int]) -> Optional[Dict]:
+        """Возвращает сохранённый результат сборки или None."""
+        result = None
+        try:
+            with open(self._deps_path(source_file, options), 'r', encoding='utf-8') as f:
+                dependencies = json.load(f)
+            key = self._key(dependencies, options, opcodes)
+            if key is not None:
+                entry_path = self.entries_dir / f"{key}.json"
+                with open(entry_path, 'r', encoding='utf-8') as f:
+                    result = json.load(f)
+                os.utime(entry_path)  # отмечаем использование для LRU
+                result['machine_code'] = list(bytes.fromhex(result['machine_code']))
+        except (OSError, ValueError, KeyError):
+            result = None
+        self._count('hits' if result is not None else 'misses')
+        return result
+
+    def store(self, source_file, options: Dict, opcodes: Dict[str, int], dependencies: List[str], result: Dict):
+        """Сохраняет результат сборки и вытесняет старые записи при переполнении."""
+        key = self._key(dependencies, options, opcodes)
+        if key is None:
+            return
+        entry = dict(result)
+        entry['machine_code'] = bytes(result['machine_code']).hex()
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+        self.deps_dir.mkdir(parents=True, exist_ok=True)
+        self._write_json(self.entries_dir / f"{key}.json", entry)
+        self._write_json(self._deps_path(source_file, options), dependencies)
+        self.evict()
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока кэш больше size_limit."""
+        entries = []
+        for path in self.entries_dir.glob('*.json'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.size_limit:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий и промахов, число записей и их объём в байтах."""
+        stats = self._read_stats()
+        entries = list(self.entries_dir.glob('*.json')) if self.entries_dir.is_dir() else []
+        stats['entries'] = len(entries)
+        stats['bytes'] = sum(path.stat().st_size for path in entries)
+        return stats
+
+    def _read_stats(self) -> Dict[str, int]:
+        try:
+            with open(self.stats_file, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {}
+        return {'hits': stats.get('hits', 0), 'misses': stats.get('misses', 0)}
+
+    def _count(self, name: str):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with self._stats_lock():
+                stats = self._read_stats()
+                stats[name] += 1
+                self._write_json(self.stats_file, stats)
+        except OSError:
+            pass
+
+    @contextlib.contextmanager
+    def _stats_lock(self):
+        """Межпроцессная блокировка счётчиков: в stats.json пишут процессы пакетной сборки и демон."""
+        with open(self.lock_file, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)  # снимается при закрытии файла
+                yield
+                return
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _write_json(self, path: Path, data):
+        """Атомарная запись: во временный файл и переименование."""
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
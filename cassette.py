@@ -0,0 +1,288 @@
+# cassette.py
+import json
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from typing import Dict, Optional
+
+from errors import CompilationError
+
+CASSETTE_MAGIC = b'VCAS'
+CASSETTE_VERSION = 1
+SECTION_SIZE = 256
+DEFAULT_SECTION_COUNT = 8
+
+# magic, версия, флаги, размер секции, число секций, размер метаданных, резерв
+HEADER = struct.Struct('<4sBBHHIH')
+# длина записанного кода, флаги, резерв, crc32 кода
+DIRECTORY_ENTRY = struct.Struct('<HBBI')
+
+# Журнал записи: magic, затем записи (смещение в файле, длина, байты), в конце crc32 всего предыдущего
+JOURNAL_MAGIC = b'VCJL'
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_RECORD = struct.Struct('<II')
+JOURNAL_CRC = struct.Struct('<I')
+
+SECTION_USED = 0x01       # в секции начинается записанный код
+SECTION_CONTINUED = 0x02  # секцию занимает продолжение кода из предыдущей
+
+
+def is_native(path) -> bool:
+    """Проверяет, записан ли файл в собственном формате кассеты."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(CASSETTE_MAGIC)) == CASSETTE_MAGIC
+    except OSError:
+        return False
+
+
+class Cassette:
+    """Кассета в собственном формате: заголовок, каталог секций и слоты по 256 байт.
+
+    Слоты лежат в файле по фиксированным смещениям, поэтому запись секции
+    меняет только её байты и запись каталога (через mmap), а не весь файл.
+    Метаданные (остальные ключи прежнего pickle-образа) хранятся в JSON
+    после слотов.
+
+    Запись нескольких секций атомарна: новые байты сначала попадают в
+    журнал рядом с кассетой (файл появляется целиком, через os.replace),
+    и только потом - в саму кассету. Журнал, оставшийся после сбоя,
+    применяется при следующем открытии.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'r+b')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        except ValueError:
+            self._file.close()
+            raise CompilationError(f"Файл кассеты '{path}' пуст")
+        magic, version, self.flags, self.section_size, self.section_count, self.meta_size, _ = \
+            HEADER.unpack_from(self._map)
+        if magic != CASSETTE_MAGIC or version != CASSETTE_VERSION:
+            self.close()
+            raise CompilationError(f"Файл '{path}' не является кассетой VCAS версии {CASSETTE_VERSION}")
+        self.directory_offset = HEADER.size
+        self.data_offset = self.directory_offset + self.section_count * DIRECTORY_ENTRY.size
+        self.meta_offset = self.data_offset + self.section_count * self.section_size
+        self.journal_path = f"{path}{JOURNAL_SUFFIX}"
+        if os.path.exists(self.journal_path):
+            self._recover()
+
+    @classmethod
+    def create(cls, path, section_count: int = DEFAULT_SECTION_COUNT, metadata: Optional[Dict] = None,
+               data: bytes = b'') -> 'Cassette':
+        """Создаёт пустую кассету (или заполненную data) и открывает её."""
+        meta = json.dumps(metadata or {}, ensure_ascii=False).encode('utf-8')
+        slots = bytearray(section_count * SECTION_SIZE)
+        slots[:len(data)] = data
+        directory = b''.join(DIRECTORY_ENTRY.pack(0, 0, 0, 0) for _ in range(section_count))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(CASSETTE_MAGIC, CASSETTE_VERSION, 0, SECTION_SIZE, section_count, len(meta), 0))
+            f.write(directory)
+            f.write(slots)
+            f.write(meta)
+        os.replace(tmp_path, path)
+        cassette = cls(path)
+        # длины программ в data неизвестны: непустые слоты отмечаются целиком
+        used = {index: data[index * SECTION_SIZE:(index + 1) * SECTION_SIZE]
+                for index in range(section_count) if any(data[index * SECTION_SIZE:(index + 1) * SECTION_SIZE])}
+        if used:
+            cassette.write_sections(used)
+        return cassette
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def metadata(self) -> Dict:
+        return json.loads(self._map[self.meta_offset:self.meta_offset + self.meta_size].decode('utf-8'))
+
+    def directory(self):
+        """Записи каталога: (длина кода, флаги, crc32) по каждой секции."""
+        entries = []
+        for index in range(self.section_count):
+            length, flags, _, crc = DIRECTORY_ENTRY.unpack_from(self._map, self.directory_offset + index * DIRECTORY_ENTRY.size)
+            entries.append((length, flags, crc))
+        return entries
+
+    def data(self) -> bytes:
+        """Содержимое всех слотов подряд."""
+        return self._map[self.data_offset:self.meta_offset]
+
+    def read_section(self, section_number: int) -> bytes:
+        """Код, записанный в секцию (вместе с продолжением в следующих слотах)."""
+        length, flags, crc = self.directory()[section_number]
+        if not flags & SECTION_USED:
+            raise CompilationError(f"Секция {section_number} кассеты '{self.path}' пуста")
+        start = self.data_offset + section_number * self.section_size
+        code = self._map[start:start + length]
+        if zlib.crc32(code) != crc:
+            raise CompilationError(f"Секция {section_number} кассеты '{self.path}' повреждена (неверная контрольная сумма)")
+        return code
+
+    def write_sections(self, sections: Dict[int, bytes]):
+        """Записывает несколько секций атомарно: после сбоя кассета содержит либо все, либо ни одной.
+
+        Все секции проверяются до записи первого байта: код должен
+        помещаться в кассету и не заходить в слоты, занятые другими
+        секциями (в том числе продолжениями их кода).
+        """
+        directory = self.directory()
+        owners = self._owners(directory)
+        for section_number, machine_code in sections.items():
+            if section_number >= self.section_count or \
+                    section_number * self.section_size + len(machine_code) > self.section_count * self.section_size:
+                raise CompilationError(f"Ошибка: бинарный код слишком велик для секции {section_number} кассеты.")
+        # Слоты перезаписываемых секций освобождаются, затем занимаются заново
+        owners = {slot: owner for slot, owner in owners.items() if owner not in sections}
+        entries = [(0, 0, 0) if owner is None else directory[slot] for slot, owner in
+                   ((slot, owners.get(slot)) for slot in range(self.section_count))]
+        records = []
+        for section_number, machine_code in sorted(sections.items()):
+            code = bytes(machine_code)
+            slots = range(section_number, section_number + max(1, self._slots(len(code))))
+            for slot in slots:
+                if slot in owners:
+                    raise CompilationError(
+                        f"Ошибка: код секции {section_number} заходит в слот {slot}, занятый секцией {owners[slot]} кассеты.")
+                owners[slot] = section_number
+                entries[slot] = (0, SECTION_CONTINUED, 0)
+            entries[section_number] = (len(code), SECTION_USED, zlib.crc32(code))
+            records.append((self.data_offset + section_number * self.section_size, code))
+        records.append((self.directory_offset, b''.join(DIRECTORY_ENTRY.pack(length, flags, 0, crc)
+                                                        for length, flags, crc in entries)))
+        self._write_journal(records)
+        self._apply(records)
+        os.unlink(self.journal_path)
+
+    def _owners(self, directory) -> Dict[int, int]:
+        """Слот -> секция, код которой его занимает."""
+        owners = {}
+        for index, (length, flags, _) in enumerate(directory):
+            if flags & SECTION_USED:
+                for slot in range(index, min(self.section_count, index + max(1, self._slots(length)))):
+                    owners[slot] = index
+        return owners
+
+    def _slots(self, length: int) -> int:
+        return (length + self.section_size - 1) // self.section_size
+
+    def _write_journal(self, records):
+        """Записывает журнал во временный файл и переименовывает: журнал либо есть целиком, либо его нет."""
+        journal = bytearray(JOURNAL_MAGIC)
+        for offset, data in records:
+            journal += JOURNAL_RECORD.pack(offset, len(data))
+            journal += data
+        journal += JOURNAL_CRC.pack(zlib.crc32(journal))
+        tmp_path = f"{self.journal_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(journal)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        _fsync_directory(self.journal_path)
+
+    def _apply(self, records):
+        for offset, data in records:
+            self._map[offset:offset + len(data)] = data
+        self._map.flush()
+
+    def _recover(self):
+        """Применяет журнал прерванной записи (или удаляет повреждённый - запись тогда не начиналась)."""
+        with open(self.journal_path, 'rb') as f:
+            journal = f.read()
+        body = journal[:-JOURNAL_CRC.size]
+        if journal.startswith(JOURNAL_MAGIC) and len(journal) >= len(JOURNAL_MAGIC) + JOURNAL_CRC.size and \
+                JOURNAL_CRC.unpack(journal[-JOURNAL_CRC.size:])[0] == zlib.crc32(body):
+            records = []
+            position = len(JOURNAL_MAGIC)
+            while position < len(body):
+                offset, length = JOURNAL_RECORD.unpack_from(body, position)
+                position += JOURNAL_RECORD.size
+                records.append((offset, body[position:position + length]))
+                position += length
+            self._apply(records)
+        os.unlink(self.journal_path)
+
+
+def _fsync_directory(path):
+    """Сохраняет на диске переименование в каталоге (где каталоги так не открываются - пропускается)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def import_pickle(pickle_path, output_path) -> Cassette:
+    """Преобразует pickle-образ кассеты ({'data': ..., ...}) в собственный формат.
+
+    Остальные ключи образа сохраняются в метаданных кассеты.
+    """
+    with open(pickle_path, 'rb') as f:
+        loaded_data = pickle.load(f)
+    data = bytes(loaded_data['data'])
+    metadata = {key: value for key, value in loaded_data.items() if key != 'data'}
+    try:
+        json.dumps(metadata)
+    except TypeError as e:
+        raise CompilationError(f"Метаданные кассеты '{pickle_path}' нельзя сохранить в JSON: {e}")
+    section_count = max(1, (len(data) + SECTION_SIZE - 1) // SECTION_SIZE)
+    return Cassette.create(output_path, section_count, metadata, data)
+
+
+def export_pickle(path, output_path):
+    """Записывает кассету обратно в pickle-образ для старых загрузчиков (данные - все слоты целиком)."""
+    with Cassette(path) as cassette:
+        loaded_data = dict(cassette.metadata())
+        loaded_data['data'] = list(cassette.data())
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(loaded_data, f)
+    os.replace(tmp_path, output_path)
+
+
+if __name__ == "__main__":
+    import sys
+    usage = ("Использование: python cassette.py create <cassette> [<число секций>]\n"
+             "       python cassette.py import <old.cas> <cassette>\n"
+             "       python cassette.py export <cassette> <old.cas>\n"
+             "       python cassette.py info <cassette>")
+    args = sys.argv[1:]
+    try:
+        if len(args) in (2, 3) and args[0] == 'create':
+            Cassette.create(args[1], int(args[2]) if len(args) == 3 else DEFAULT_SECTION_COUNT).close()
+        elif len(args) == 3 and args[0] == 'import':
+            import_pickle(args[1], args[2]).close()
+        elif len(args) == 3 and args[0] == 'export':
+            export_pickle(args[1], args[2])
+        elif len(args) == 2 and args[0] == 'info':
+            with Cassette(args[1]) as cassette:
+                print(f"Кассета '{args[1]}': {cassette.section_count} секций по {cassette.section_size} байт")
+                for index, (length, flags, crc) in enumerate(cassette.directory()):
+                    if flags & SECTION_USED:
+                        print(f"  секция {index}: {length} байт, crc32 {crc:08x}")
+                    elif flags & SECTION_CONTINUED:
+                        print(f"  секция {index}: продолжение")
+        else:
+            print(usage)
+            sys.exit(1)
+    except (CompilationError, OSError, ValueError, KeyError, pickle.UnpicklingError) as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
@@ -2,81 +2,343 @@
 
 from typing import List
 from errors import CompilationError
+from expr import Expression, is_expression, parse_expression
+from lexer import parse_number
 
-def generate_db_code(compiler, values, machine_code, line_num, original_line):
+# Виды исправлений (и перемещений объектного модуля)
+FIXUP_JUMP = 'JUMP'  # младший байт адреса перехода JMP/JE/JNE/CALL
+FIXUP_BYTE = 'BYTE'  # адрес метки как операнд, должен помещаться в байт
+FIXUP_BANK = 'BANK'  # номер банка метки (BANK <метка>)
+FIXUP_DATA = 'DATA'  # адрес данных .DB (сдвигается компоновщиком)
+
+# Виды токенов операндов (не зависят от места в программе, поэтому запоминаются)
+OPERAND_REGISTER = 'register'
+OPERAND_NUMBER = 'number'
+OPERAND_SYMBOL = 'symbol'  # константа .DEFINE, метка или ещё не объявленная метка
+OPERAND_EXPRESSION = 'expression'  # выражение с именами (expr.py), вычисляется при генерации
+
+def operand_kind(compiler, operand):
+    """Вид и значение токена операнда; каждый токен разбирается один раз за сборку.
+
+    Константы и метки ищутся уже по таблицам, без исключения ValueError
+    на каждой ссылке на метку.
+    """
+    kind = compiler.operand_kinds.get(operand)
+    if kind is None:
+        if operand in compiler.registers:
+            kind = (OPERAND_REGISTER, compiler.registers[operand])
+        elif operand[:1].isdigit() or operand[:1] in '+-':
+            try:
+                kind = (OPERAND_NUMBER, parse_number(operand))
+            except ValueError:
+                kind = _expression_kind(operand)
+        elif is_expression(operand):
+            kind = _expression_kind(operand)
+        else:
+            kind = (OPERAND_SYMBOL, None)  # имя не может быть числом - без попытки разбора
+        compiler.operand_kinds[operand] = kind
+    return kind
+
+def _expression_kind(operand):
+    """Выражение из одних чисел уже свёрнуто при разборе и становится числом."""
+    try:
+        expression = parse_expression(operand)
+    except ValueError:
+        return (OPERAND_SYMBOL, None)  # сообщит генерация кода: "Неверный операнд"
+    if expression.constant:
+        return (OPERAND_NUMBER, expression.node)
+    return (OPERAND_EXPRESSION, expression)
+
+def expression_value(compiler, stmt, expression: Expression, defer=False):
+    """Значение выражения по текущим константам и меткам.
+
+    defer - в однопроходном режиме вместо ошибки вернуть None, если в
+    выражении есть ещё не объявленная метка (значение подставит patch_fixups).
+    """
+    defines, labels = compiler.defines, compiler.labels
+    def lookup(name):
+        return defines[name] if name in defines else labels[name]
+    try:
+        return expression.evaluate(lookup)
+    except KeyError as e:
+        if defer and compiler.fixups is not None and not compiler.relocatable:
+            return None
+        note = " (в объектном модуле метки в выражениях не поддерживаются)" if compiler.relocatable else ""
+        raise CompilationError(
+            f"{stmt.location()}: Неизвестное имя {e.args[0]} в выражении {expression.text}{note}\n"
+            f"{stmt.text}"
+        )
+    except ValueError as e:
+        raise CompilationError(f"{stmt.location()}: Ошибка в выражении {expression.text}: {e}\n{stmt.text}")
+
+def byte_value(stmt, operand, value) -> int:
+    """Проверяет, что значение операнда помещается в байт."""
+    if not 0 <= value <= 255:
+        shown = operand if operand == str(value) else f"{operand} ({value})"
+        raise CompilationError(
+            f"{stmt.location()}: Значение {shown} не помещается в байт\n"
+            f"{stmt.text}"
+        )
+    return value
+
+def define_value(compiler, stmt, value, strict=True):
+    """Значение .DEFINE: число, константа, метка или выражение; None - пока не вычисляется.
+
+    В первом проходе метки ниже по тексту ещё не известны, поэтому без strict
+    такая константа пропускается (её задаст второй проход).
+    """
+    if value in compiler.defines:
+        return compiler.defines[value]
+    kind, number = operand_kind(compiler, value)
+    if kind == OPERAND_NUMBER:
+        return number
+    if value in compiler.labels:
+        return compiler.labels[value]
+    if kind == OPERAND_EXPRESSION:
+        if not strict:
+            names = compiler.defines.keys() | compiler.labels.keys()
+            if not number.names <= names:
+                return None
+        return expression_value(compiler, stmt, number)
+    if not strict:
+        return None
+    raise CompilationError(
+        f"{stmt.location()}: Неверное значение для .DEFINE: {value}\n"
+        f"{stmt.text}"
+    )
+
+def db_value(compiler, stmt, value) -> int:
+    """Значение байта .DB: константа .DEFINE или число."""
+    if value in compiler.defines:
+        return byte_value(stmt, value, compiler.defines[value])
+    try:
+        return byte_value(stmt, value, parse_number(value))
+    except ValueError:
+        kind, expression = operand_kind(compiler, value)
+        if kind == OPERAND_NUMBER:
+            return byte_value(stmt, value, expression)
+        if kind == OPERAND_EXPRESSION:
+            return byte_value(stmt, value, expression_value(compiler, stmt, expression))
+        raise CompilationError(
+            f"{stmt.location()}: Неверное значение для .DB: {value}\n"
+            f"{stmt.text}"
+        )
+
+def generate_db_code(compiler, stmt, machine_code):
     """Генерирует код для директивы .DB."""
-    for value in values:
-        value = value.strip()
+    if compiler.data_segment:
+        # Байты идут в сегмент данных, который загрузчик копирует в память целиком
+        for value in stmt.operands:
+            if compiler.current_db_address > 255:
+                raise CompilationError(
+                    f"{stmt.location()}: Данные .DB не помещаются в память (адрес {hex(compiler.current_db_address)})\n"
+                    f"{stmt.text}"
+                )
+            compiler.data_bytes.append(db_value(compiler, stmt, value))
+            compiler.current_db_address += 1
+        return machine_code
+    for value in stmt.operands:
         # Добавляем STOREV
         machine_code.append(compiler.opcodes['STOREV'])
         # Добавляем адрес
-        machine_code.append(compiler.current_db_address)
-        # Добавляем значение
-        if value in compiler.defines:
-            machine_code.append(compiler.defines[value])
+        if compiler.relocatable:
+            add_fixup(compiler, stmt, FIXUP_DATA, None, machine_code, compiler.current_db_address)
         else:
-            try:
-                machine_code.append(int(value))
-            except ValueError:
-                raise CompilationError(
-                    f"Строка {line_num}: Неверное значение для .DB: {value}\n"
-                    f"{original_line}"
-                )
+            machine_code.append(compiler.current_db_address)
+        # Добавляем значение
+        machine_code.append(db_value(compiler, stmt, value))
         compiler.current_db_address += 1
     return machine_code
 
-def generate_bank_code(compiler, parts, machine_code):
-    """Генерирует код для инструкции BANK."""
-    compiler.current_bank = int(parts[1], 16) if parts[1].startswith('0X') else int(parts[1])
+def generate_bank_code(compiler, stmt, machine_code):
+    """Генерирует код для инструкции BANK (номер банка или BANK <метка>)."""
+    value = stmt.operands[0]
     machine_code.append(compiler.opcodes['BANK'])
-    machine_code.append(compiler.current_bank)
+    kind, bank = operand_kind(compiler, value)
+    if kind == OPERAND_EXPRESSION:
+        expression = bank
+        bank = expression_value(compiler, stmt, expression, defer=True)
+        if bank is None:
+            # BANK BANK(метка ниже по тексту): номер банка станет известен при исправлении
+            expression = expression.bind(compiler.defines)
+            add_fixup(compiler, stmt, FIXUP_BYTE, None, machine_code, expression=expression)
+            compiler.current_bank = expression
+            return machine_code
+        byte_value(stmt, value, bank)
+    elif kind == OPERAND_NUMBER:
+        byte_value(stmt, value, bank)
+    elif value in compiler.defines:
+        bank = byte_value(stmt, value, compiler.defines[value])
+    else:
+        if value in compiler.labels:
+            bank = compiler.labels[value] // 256
+        elif compiler.fixups is not None:
+            # Банк метки станет известен при исправлении или компоновке
+            add_fixup(compiler, stmt, FIXUP_BANK, value, machine_code)
+            compiler.current_bank = value
+            return machine_code
+        else:
+            raise CompilationError(
+                f"{stmt.location()}: Неверный номер банка: {value}\n"
+                f"{stmt.text}"
+            )
+    compiler.current_bank = bank
+    machine_code.append(bank)
     return machine_code
 
-def generate_transition_code(compiler, instruction, target_addr, machine_code, line_num, original_line):
+def generate_transition_code(compiler, stmt, target_addr, machine_code):
     """Генерирует код для инструкций перехода."""
+    if compiler.relocatable or isinstance(compiler.current_bank, (str, Expression)):
+        # Банк в точке перехода ещё не известен - проверка будет при исправлении
+        machine_code.append(stmt.opcode)
+        return add_fixup(compiler, stmt, FIXUP_JUMP, None, machine_code, target_addr)
+
     bank, addr = compiler.get_bank_and_addr(target_addr)
     
-    print(f"CBT: {line_num} : {bank} : {addr} : {compiler.lines}")
-    compiler._check_bank_transition(line_num, compiler.lines, original_line, bank, compiler.current_bank)
+    compiler._check_bank_transition(stmt, compiler.prev_statement, bank, compiler.current_bank)
     
-    machine_code.append(compiler.opcodes[instruction])
+    machine_code.append(stmt.opcode)
     machine_code.append(addr)
     return machine_code
 
-def generate_instruction_code(compiler, instruction, operands, machine_code, line_num, original_line):
+def generate_instruction_code(compiler, stmt, machine_code):
     """Генерирует код для обычных инструкций."""
-    machine_code.append(compiler.opcodes[instruction])
+    instruction = stmt.name
+    if stmt.opcode is None:
+        raise CompilationError(
+            f"{stmt.location()}: Неизвестная инструкция: {instruction}\n"
+            f"{stmt.text}"
+        )
+    machine_code.append(stmt.opcode)
     
-    for operand in operands:
-        if operand in compiler.registers:
-            machine_code.append(compiler.registers[operand])
-        elif operand in compiler.defines:
-            machine_code.append(compiler.defines[operand])
+    registers = compiler.registers
+    defines = compiler.defines
+    operand_kinds = compiler.operand_kinds
+    for operand in stmt.operands:
+        if operand in registers:
+            machine_code.append(registers[operand])
+            continue
+        if operand in defines:
+            value = defines[operand]
+            if not 0 <= value <= 255:
+                byte_value(stmt, operand, value)
+            machine_code.append(value)
+            continue
+        kind, value = operand_kinds.get(operand) or operand_kind(compiler, operand)
+        if kind == OPERAND_NUMBER:
+            if not 0 <= value <= 255:
+                raise CompilationError(
+                    f"{stmt.location()}: Значение {value} превышает размер байта\n"
+                    f"{stmt.text}"
+                )
+            machine_code.append(value)
+        elif operand in compiler.labels:
+            machine_code.append(label_operand_value(compiler, stmt, operand, compiler.labels[operand]))
+        elif kind == OPERAND_EXPRESSION:
+            result = expression_value(compiler, stmt, value, defer=True)
+            if result is None:
+                add_fixup(compiler, stmt, FIXUP_BYTE, None, machine_code, expression=value.bind(defines))
+            else:
+                machine_code.append(byte_value(stmt, operand, result))
+        elif compiler.fixups is not None:
+            add_fixup(compiler, stmt, FIXUP_BYTE, operand, machine_code)
         else:
-            try:
-                value = int(operand, 16) if operand.startswith('0X') else int(operand)
-                if value > 255:
-                    raise CompilationError(
-                        f"Строка {line_num}: Значение {value} превышает размер байта\n"
-                        f"{original_line}"
-                    )
-                machine_code.append(value)
-            except ValueError:
-                if operand in compiler.labels:
-                    addr = compiler.labels[operand]
-                    if addr > 255:
-                        bank, local_addr = compiler.get_bank_and_addr(addr)
-                        raise CompilationError(
-                            f"Строка {line_num}: Адрес метки {operand} ({hex(addr)}) превышает размер банка\n"
-                            f"{original_line}\n"
-                            f"Подсказка: Разделите программу на банки. Для этого адреса используйте:\n"
-                            f"BANK {bank}\n"
-                            f"{instruction} {hex(local_addr)}"
-                        )
-                    machine_code.append(addr)
-                else:
-                    raise CompilationError(
-                        f"Строка {line_num}: Неверный операнд: {operand}\n"
-                        f"{original_line}"
-                    )
-    return machine_code
\ No newline at end of file
+            raise CompilationError(
+                f"{stmt.location()}: Неверный операнд: {operand}\n"
+                f"{stmt.text}"
+            )
+    return machine_code
+
+def label_operand_value(compiler, stmt, operand, addr):
+    """Проверяет, что адрес метки-операнда помещается в байт."""
+    if addr > 255:
+        bank, local_addr = compiler.get_bank_and_addr(addr)
+        raise CompilationError(
+            f"{stmt.location()}: Адрес метки {operand} ({hex(addr)}) превышает размер банка\n"
+            f"{stmt.text}\n"
+            f"Подсказка: Разделите программу на банки. Для этого адреса используйте:\n"
+            f"BANK {bank}\n"
+            f"{stmt.name} {hex(local_addr)}"
+        )
+    return addr
+
+class Fixup:
+    """Байт машинного кода, значение которого станет известно позже.
+
+    В однопроходном режиме это ссылки на ещё не объявленные метки,
+    в объектном модуле - все ссылки на метки (перемещения).
+    """
+    __slots__ = ('position', 'kind', 'label', 'addend', 'stmt', 'prev', 'bank', 'expression')
+
+    def __init__(self, position, kind, label, addend, stmt, prev, bank, expression=None):
+        self.position = position  # индекс байта в machine_code
+        self.kind = kind          # FIXUP_JUMP, FIXUP_BYTE, FIXUP_BANK или FIXUP_DATA
+        self.label = label        # метка или None для числового адреса
+        self.addend = addend      # адрес, если метки нет
+        self.stmt = stmt
+        self.prev = prev          # предыдущая запись (для проверки BANK)
+        self.bank = bank          # активный банк в точке перехода (число, метка, выражение или None)
+        self.expression = expression  # выражение с метками ниже по тексту (константы уже подставлены)
+
+def add_fixup(compiler, stmt, kind, label, machine_code, addend=0, expression=None):
+    """Резервирует байт под адрес метки и запоминает, где его исправить."""
+    compiler.fixups.append(Fixup(len(machine_code), kind, label, addend, stmt, compiler.prev_statement,
+                                 compiler.current_bank, expression))
+    machine_code.append(0)
+    return machine_code
+
+def patch_fixups(compiler, machine_code):
+    """Подставляет адреса меток вперёд; проверки банков выполняются здесь."""
+    labels = compiler.labels
+    for fixup in compiler.fixups:
+        stmt = fixup.stmt
+        kind = fixup.kind
+        if fixup.expression is not None:
+            addr = _fixup_expression_value(compiler, fixup)
+        elif fixup.label is None:
+            addr = fixup.addend
+        elif fixup.label in labels:
+            addr = labels[fixup.label]
+        elif kind == FIXUP_JUMP:
+            raise CompilationError(f"{stmt.location()}: Неверный адрес перехода: {fixup.label}")
+        elif kind == FIXUP_BANK:
+            raise CompilationError(
+                f"{stmt.location()}: Неверный номер банка: {fixup.label}\n"
+                f"{stmt.text}"
+            )
+        else:
+            raise CompilationError(
+                f"{stmt.location()}: Неверный операнд: {fixup.label}\n"
+                f"{stmt.text}"
+            )
+
+        if kind == FIXUP_JUMP:
+            bank, local_addr = compiler.get_bank_and_addr(addr)
+            current_bank = fixup.bank
+            if isinstance(current_bank, str):
+                current_bank = labels[current_bank] // 256
+            elif isinstance(current_bank, Expression):
+                current_bank = _fixup_expression_value(compiler, fixup, current_bank)
+            compiler._check_bank_transition(stmt, fixup.prev, bank, current_bank)
+            machine_code[fixup.position] = local_addr
+        elif kind == FIXUP_BANK:
+            machine_code[fixup.position] = addr // 256
+        elif fixup.expression is not None:
+            machine_code[fixup.position] = byte_value(stmt, fixup.expression.text, addr)
+        else:
+            machine_code[fixup.position] = label_operand_value(compiler, stmt, fixup.label, addr)
+    return machine_code
+
+def _fixup_expression_value(compiler, fixup, expression=None):
+    """Значение выражения исправления, когда известны все метки."""
+    expression = expression or fixup.expression
+    stmt = fixup.stmt
+    try:
+        return expression.evaluate(compiler.labels.__getitem__)
+    except KeyError as e:
+        raise CompilationError(
+            f"{stmt.location()}: Неизвестное имя {e.args[0]} в выражении {expression.text}\n"
+            f"{stmt.text}"
+        )
+    except ValueError as e:
+        raise CompilationError(f"{stmt.location()}: Ошибка в выражении {expression.text}: {e}\n{stmt.text}")
\ No newline at end of file
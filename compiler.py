@@ -5,67 +5,29 @@ import os
 from pathlib import Path
 from typing import Dict, List, Tuple
 
-from lexer import preprocess_line, tokenize_line
-from parser import Parser
-from code_generator import generate_db_code, generate_bank_code, generate_transition_code, generate_instruction_code
-from utils import Utils
+from lexer import LABEL, DIRECTIVE, INSTRUCTION, Statement, lex_lines, parse_number
+from include_cache import IncludeCache, CachedFile, apply_pragma_once, find_include_guard
+from code_generator import generate_db_code, generate_bank_code, generate_transition_code, generate_instruction_code, add_fixup, patch_fixups, FIXUP_JUMP, operand_kind, OPERAND_NUMBER, OPERAND_EXPRESSION, expression_value, define_value
+from objfile import ObjectModule, Relocation, save_object
 from errors import CompilationError
+from isa import OPCODES, REGISTERS
+from macro import MacroExpander, BLOCK_DIRECTIVES
+from binformat import FORMAT_HEX, encode_program
+from cassette import Cassette, is_native
+from optimizer import optimize, OptimizationReport
+from bank_layout import auto_bank, BankLayoutReport
+from debugmap import DebugMap, save_debug_map
+from tracing import Tracer, Stats, LEXER, PASS1, PASS2, BANK_CHECK, OUTPUT, CACHE, INFO, DEBUG, VERBOSE
 
 DATA_START_ADDRESS = 0x80  # Константа для начального адреса данных
 
 class Compiler:
     
-    def __init__(self):
-        # Таблица опкодов инструкций (без BANK)
-        self.opcodes: Dict[str, int] = {
-            'NOP':    0x00,
-            'SET':    0x01,
-            'MOV':    0x02,
-            'ADD':    0x03,
-            'SUB':    0x04,
-            'AND':    0x05,
-            'OR':     0x06,
-            'XOR':    0x07,
-            'JMP':    0x08,
-            'STOREV': 0x09,
-            'STORER': 0x0A,
-            'STOREM': 0x0B,
-            'LOADR':  0x0C,
-            'JE':     0x0D,
-            'JNE':    0x0E,
-            'CMP':    0x0F,
-            'PUSH':   0x10,
-            'POP':    0x11,
-            'MUL':    0x12,
-            'DIV':    0x13,
-            'SETPX':  0x14,    # Установить пиксель (x, y)
-            'CLRPX':  0x15,    # Очистить пиксель (x, y)
-            'DIGIT':  0x16,    # Вывести число на сегментный дисплей (позиция, значение)
-            'CLEAR':  0x17,    # Очистить весь дисплей
-            'GETKEY': 0x18,    # Новая инструкция для чтения клавиши
-            'CALL':   0x19,    # Вызов подпрограммы
-            'RET':    0x1A,
-            'RND':    0x1B,    # Случайное число в регистр
-            'HLT':    0xFF,
-            'BANK':   0x1C,    # Переключение банка
-            'SAVKEY': 0x1D,
-            'BRIGHT': 0x1E,    # Новая инструкция для установки яркости
-            'LOADRR': 0x1F,
-            'CREAD':  0x20,    # Чтение секции кассеты
-            'CWRITE': 0x21,    # Запись секции кассеты
-            'CSTAT':  0x22,    # Проверка статуса кассеты
-            'CINFO':  0x23,    # Получение информации о кассете
-        }
-        
-        # Регистры
-        self.registers: Dict[str, int] = {
-            'R1': 0x01,
-            'R2': 0x02,
-            'R3': 0x03,
-            'R4': 0x04,
-            'R5': 0x05,
-            'R6': 0x06
-        }
+    def __init__(self, tracer=None, include_cache=None):
+        # Таблица опкодов инструкций и регистры (общие с дизассемблером и эмулятором, см. isa.py)
+        self.opcodes: Dict[str, int] = dict(OPCODES)
+        self.registers: Dict[str, int] = dict(REGISTERS)
+        self.operand_kinds: Dict[str, Tuple[str, int]] = {}  # Память разбора токенов операндов (см. operand_kind)
         
         # Добавляем словарь для хранения меток
         self.labels: Dict[str, int] = {}
@@ -75,10 +37,34 @@ class Compiler:
         
         # Добавляем только словарь для констант
         self.defines: Dict[str, int] = {}
+        self.predefines: Dict[str, int] = {}  # Константы, заданные снаружи (как .DEFINE в начале программы)
         self.current_db_address: int = DATA_START_ADDRESS
-        self.lines : List[str] = []
-        self.included_files : List[Path] = [] #Список для отслеживания импортированных файлов
+        self.data_segment = False  # .DB пишется в сегмент данных (формат vbin), а не командами STOREV
+        self.data_bytes = bytearray()  # Содержимое сегмента данных с адреса DATA_START_ADDRESS
+        self.optimize = False  # Оптимизация списка записей перед проходами (-O)
+        self.optimization_report = None
+        self.auto_bank = False  # Автоматическая раскладка по банкам (--auto-bank)
+        self.bank_layout_report = None
+        self.cached_debug_map = None  # Отладочная карта из кэша сборки
+        self.debug_ranges = None  # Список диапазонов для отладочной карты (--debug-map), None - не собирать
+        self.statements : List[Statement] = []
+        self.fixups = None  # Список исправлений ссылок вперёд (только в однопроходном режиме)
+        self.prev_statement = None  # Последняя запись второго прохода, не являющаяся меткой
+        self.bank_errors : List[str] = []
+        self.relocatable = False  # Сборка перемещаемого объектного модуля
+        self.module_labels: Dict[str, int] = {}  # Метки объектного модуля (смещения от его начала)
+        self.exports : List[str] = []  # Метки из директив .EXPORT
+        self.included_files : List[str] = [] #Список для отслеживания импортированных файлов
         self.current_directory = Path('.')
+        self.include_cache = include_cache if include_cache is not None else IncludeCache()
+        # Функция resolver(имя, включающий файл) -> (путь, текст или строки) либо None; None - чтение с диска
+        self.include_resolver = None
+        self._include_stack : List[str] = []  # Файлы, раскрываемые в данный момент (для поиска циклов)
+        self._include_once = set()  # Файлы с защитой, уже включённые безусловно
+        self._include_depth = 0  # Вложенность .IFNDEF в точке текущего .INCLUDE
+        self.macros = MacroExpander(self.opcodes, {})  # Макросы и .REPT (заново при каждой сборке)
+        self.trace = tracer if tracer is not None else Tracer()  # По умолчанию трассировка выключена
+        self.stats = Stats()
 
     def get_bank_and_addr(self, full_addr: int) -> Tuple[int, int]:
             """Разделяет полный адрес на банк и адрес в банке."""
@@ -86,268 +72,535 @@ class Compiler:
             addr = full_addr % 256
             return bank, addr
 
-    def _check_bank_transition(self, line_num, lines, original_line, bank, current_bank):
-        """Проверяет наличие инструкции BANK перед переходом в другой банк."""
-        if bank != current_bank:
-            prev_line = None
-            # print(f"LINE_NUM: {line_num}")
-            for prev_num in range(line_num - 2, -1, -1):
-                if prev_num < 0:
-                    break
-                print(f"PREV_NUM: {prev_num} : {lines}")
-                prev_line = lines[prev_num].split(';')[0].strip().upper()
-                if prev_line and not prev_line.startswith(':'):
-                    break
-            if not prev_line or not prev_line.startswith('BANK'):
-                raise CompilationError(
-                    f"Строка {line_num}: Переход на адрес в другом банке без указания BANK\n"
-                    f"{original_line}\n"
-                    f"Подсказка: Добавьте перед этой строкой:\n"
-                    f"BANK {bank}"
-                )
+    def _check_bank_transition(self, stmt, prev, bank, current_bank):
+        """Проверяет наличие инструкции BANK перед переходом в другой банк.
+
+        prev - последняя запись перед переходом, не являющаяся меткой; она ведётся
+        во время прохода, поэтому проверка выполняется за O(1). Ошибки не прерывают
+        сборку, а копятся в self.bank_errors, чтобы сообщить обо всех сразу.
+        """
+        if self.trace.bank_check >= DEBUG:
+            self.trace.emit(BANK_CHECK, f"{stmt.location()}: банк перехода {bank}, текущий банк {current_bank}")
+        if bank != current_bank and (prev is None or prev.name != 'BANK'):
+            self.bank_errors.append(
+                f"{stmt.location()}: Переход на адрес в другом банке без указания BANK\n"
+                f"{stmt.text}\n"
+                f"Подсказка: Добавьте перед этой строкой:\n"
+                f"BANK {bank}"
+            )
+
+    def _raise_bank_errors(self):
+        """Сообщает обо всех найденных переходах без BANK."""
+        if not self.bank_errors:
+            return
+        message = '\n\n'.join(self.bank_errors)
+        if len(self.bank_errors) > 1:
+            message += f"\n\nВсего переходов без BANK: {len(self.bank_errors)}"
+        raise CompilationError(message)
+
+    def _parse_define(self, stmt, strict=False):
+        """Разбирает директиву .DEFINE и заносит константу в таблицу; возвращает её значение.
+
+        Значение - число или выражение (см. expr.py). strict - при генерации
+        кода: значение, которое нельзя вычислить, - ошибка.
+        """
+        if len(stmt.operands) == 2:
+            name, value = stmt.operands
+            try:
+                number = parse_number(value)
+            except ValueError:
+                number = define_value(self, stmt, value, strict)
+                if number is None:
+                    return None
+            self.defines[name] = number
+            return number
+        return None
     
-    def _process_include(self, file_path: str):
-        """Включает содержимое файла в текущую программу."""
-        file_path_obj = (self.current_directory / file_path).resolve()  # Получаем абсолютный путь
+    def _resolve_include(self, stmt, directory: Path) -> Path:
+        """Ищет файл .INCLUDE рядом с включающим файлом, затем в каталоге основного исходника."""
+        file_path = stmt.operands[0]
+        for base in (directory, self.current_directory):
+            candidate = (base / file_path).resolve()  # Получаем абсолютный путь
+            if candidate.is_file():
+                return candidate
+        raise CompilationError(f"{stmt.location()}: Файл не найден: {file_path}")
 
-        normalized_file_path = str(file_path_obj).lower()
+    def _load_include(self, stmt, directory: Path) -> Tuple[str, str, CachedFile]:
+        """Путь, ключ и разобранный файл .INCLUDE: через include_resolver или с диска через кэш."""
+        if self.include_resolver is not None:
+            resolved = self.include_resolver(stmt.operands[0], stmt.file)
+            if resolved is None:
+                raise CompilationError(f"{stmt.location()}: Файл не найден: {stmt.operands[0]}")
+            path, source = resolved
+            lines = source.splitlines(True) if isinstance(source, str) else list(source)
+            statements = apply_pragma_once(self._lex(lines, path), path)
+            return path, path, CachedFile(0, len(lines), statements, find_include_guard(statements))
 
-        #print("NORMFILE: ",normalized_file_path)
-        
-        # if normalized_file_path in [str(path).lower() for path in self.included_files]:
-        #         return [], current_address
-        
-        self.included_files.append(normalized_file_path)
-        
+        path = str(self._resolve_include(stmt, directory))
         try:
-            with open(normalized_file_path, 'r', encoding='utf-8') as f:
-                return f.readlines()
+            entry = self.include_cache.load(path, self._lex)
         except FileNotFoundError:
-            raise CompilationError(f"Файл не найден: {file_path}")
-        
-    def preprocess_includes(self, lines):
-        """Заменяет директивы INCLUDE содержимым файлов."""
-        processed_lines = []
+            raise CompilationError(f"{stmt.location()}: Файл не найден: {stmt.operands[0]}")
+        return path, os.path.normcase(path), entry
+
+    def _process_include(self, stmt, directory: Path, statements: List[Statement]):
+        """Включает записи файла в программу, рекурсивно раскрывая вложенные .INCLUDE."""
+        path, key, entry = self._load_include(stmt, directory)
+
+        if key in self._include_stack:
+            raise CompilationError(f"{stmt.location()}: Циклическое включение файла {stmt.operands[0]}")
+        if key in self._include_once:
+            # Файл уже включён целиком под защитой .IFNDEF - повторное включение ничего не добавит
+            if self.trace.lexer >= INFO:
+                self.trace.emit(LEXER, f"{stmt.location()}: пропуск повторного включения {path}")
+            return
+
+        if path not in self.included_files:
+            self.included_files.append(path)
+        if entry.guard is not None and self._include_depth == 0:
+            self._include_once.add(key)
+
+        self._include_stack.append(key)
+        self._expand(entry.statements, Path(path).parent, statements)
+        self.macros.finish(path)
+        self._include_stack.pop()
+
+    def _expand(self, source: List[Statement], directory: Path, statements: List[Statement]):
+        """Переносит записи в общий список, заменяя .INCLUDE содержимым файлов, а вызовы макросов и .REPT - их телом."""
+        macros = self.macros
+        for stmt in source:
+            if macros.block is not None:
+                # Запись тела .MACRO или .REPT; закрытый .REPT раскрывается сразу
+                expansion = macros.record(stmt)
+                if expansion:
+                    self._expand_block(expansion, directory, statements)
+                continue
+            if stmt.kind == DIRECTIVE:
+                directive = stmt.name
+                if directive == '.INCLUDE':
+                    self._process_include(stmt, directory, statements)
+                    continue
+                if directive in BLOCK_DIRECTIVES:
+                    macros.open(stmt)
+                    continue
+                if directive == '.IFNDEF':
+                    self._include_depth += 1
+                elif directive == '.ENDIF':
+                    self._include_depth -= 1
+                macros.track(stmt)
+            elif stmt.opcode is None and stmt.kind == INSTRUCTION and stmt.name in macros.macros:
+                self._expand_block(macros.call(stmt), directory, statements)
+                continue
+            statements.append(stmt)
+
+    def _expand_block(self, expansion: List[Statement], directory: Path, statements: List[Statement]):
+        """Раскрывает записи макроса или .REPT (в них могут быть вложенные вызовы и .INCLUDE)."""
+        self.macros.depth += 1
+        try:
+            self._expand(expansion, directory, statements)
+        finally:
+            self.macros.depth -= 1
+
+    def _lex(self, lines, file_name):
+        """Лексический разбор строк одного файла."""
+        statements = lex_lines(lines, self.opcodes, file_name)
+        self.stats.lines += len(lines)
+        trace = self.trace
+        if trace.lexer >= INFO:
+            trace.emit(LEXER, f"{file_name}: {len(lines)} строк, {len(statements)} записей")
+            if trace.lexer >= VERBOSE:
+                for stmt in statements:
+                    trace.emit(LEXER, repr(stmt))
+        return statements
         
-        parser = Parser(self.opcodes, self.registers, self.labels, self.defines, self.current_bank, self.program_size, self.current_db_address)
+    def preprocess_includes(self, lines, source_file='<source>', origins=None):
+        """Лексический разбор исходника; директивы INCLUDE рекурсивно заменяются записями файлов.
+
+        Если передан список origins, в него для каждой записи заносится номер
+        строки основного файла, из которой она получена (для записей из
+        .INCLUDE - строка директивы).
+        """
+        statements = []
+        if self.include_resolver is not None:
+            self._include_stack = [str(source_file)]
+        else:
+            self._include_stack = [os.path.normcase(str(Path(source_file).resolve()))]
+        self._include_once = set()
+        self._include_depth = 0
+        self.macros = MacroExpander(self.opcodes, self.predefines)
         
-        for line in lines:
-            line = preprocess_line(line)
-            if not line:
-                continue
-            
-            if parser.is_directive(line) and parser.get_directive(line) == '.INCLUDE':
-                file_path = parser.get_directive_values(line)[0]
-                included_lines = self._process_include(file_path)
-                if included_lines:
-                    processed_lines.extend(included_lines)
-            else:
-                processed_lines.append(line)
-        return processed_lines
+        source = self._lex(lines, str(source_file))
+        if origins is None:
+            self._expand(source, self.current_directory, statements)
+        else:
+            for stmt in source:
+                self._expand((stmt,), self.current_directory, statements)
+                origins.extend([stmt.line] * (len(statements) - len(origins)))
+        self.macros.finish()
+        if self.trace.lexer >= INFO:
+            cache = self.include_cache
+            self.trace.emit(LEXER, f"кэш INCLUDE: попаданий {cache.hits}, промахов {cache.misses}")
+        return statements
         
-    def first_pass(self, lines):
+    def first_pass(self, statements):
         """Первый проход - собираем метки и их адреса"""
         current_address = 0
         
-        parser = Parser(self.opcodes, self.registers, self.labels, self.defines, self.current_bank, self.program_size, self.current_db_address)
         conditional_stack = []
         is_wr = True
+        trace = self.trace
 
-        for line in lines:
-            line = preprocess_line(line)
-            if not line:
-                continue
+        for stmt in statements:
+            kind = stmt.kind
 
-            print(current_address)
+            if trace.pass1 >= DEBUG:
+                trace.emit(PASS1, f"{stmt.location()}: {current_address} {stmt.text}")
                 
-            if parser.is_directive(line):
-                directive = parser.get_directive(line)
+            if kind == DIRECTIVE:
+                directive = stmt.name
                 
                 if directive == '.IFNDEF':
-                    parts = tokenize_line(line)
-                    if len(parts) != 2:
+                    if len(stmt.operands) != 1:
                        raise CompilationError("Неверный формат .IFNDEF")
-                    symbol = parts[1]
-                    conditional_stack.append(symbol not in self.defines)
+                    conditional_stack.append(stmt.operands[0] not in self.defines)
                     is_wr = all(conditional_stack)
                     continue
                 elif directive == '.ENDIF':
                      if not conditional_stack:
                          raise CompilationError("Директива .ENDIF без соотв. .IFNDEF")
-                     is_wr = not all(conditional_stack) if conditional_stack else True
                      conditional_stack.pop()
+                     is_wr = all(conditional_stack)
                      continue
-                # elif not is_wr:
-                #     print(f"SKIP: {current_address}")
-                #     continue
-                elif directive == '.DB' and is_wr:
-                    values = parser.get_directive_values(line)
-                    for value in values:
-                        value = value.strip()
-                        current_address += 3
-                    continue
                 elif directive == '.DEFINE' and is_wr:
-                    parts = tokenize_line(line)
-                    if len(parts) == 3:
-                        name = parts[1]
-                        try:
-                            if parts[2].startswith('0x'):
-                                value = int(parts[2], 16)
-                            else:
-                                value = int(parts[2])
-                            self.defines[name] = value
-                        except ValueError:
-                            pass
+                    self._parse_define(stmt)
                     continue
+                elif directive == '.DB' and self.data_segment:
+                    continue  # данные не занимают места в коде
                 
             # Проверяем, является ли строка меткой
-            if parser.is_label(line) and is_wr:
-                label_name = parser.get_label_name(line)  # Преобразуем метку в верхний регистр
-                self.labels[label_name] = current_address
+            elif kind == LABEL:
+                if is_wr:
+                    self.labels[stmt.name] = current_address
                 continue
                 
-            # Считаем байты инструкции
-            instruction, operands = parser.parse_instruction(line, 0, line)
-            
-            if instruction in self.opcodes and is_wr:
-                # Считаем размер инструкции (опкод + операнды)
-                instruction_size = 1  # опкод
-                instruction_size += len(operands)  # добавляем размер операндов
-                current_address += instruction_size
+            # Считаем байты инструкции (опкод + операнды) и данных .DB
+            if is_wr:
+                current_address += stmt.size
         #self.program_size = current_address #Сохраняем размер
+        if trace.pass1 >= INFO:
+            trace.emit(PASS1, f"размер программы {current_address}, меток {len(self.labels)}")
+            if trace.pass1 >= VERBOSE:
+                trace.emit(PASS1, f"метки: {self.labels}")
         if conditional_stack:
            raise CompilationError("Незакрытые директивы .IFNDEF")
    
-    def compile(self, source_file, output_file, use_cassette=False, section_number=0):
-        # try:
-            self.current_directory = Path(source_file).parent # Получаем текущий каталог
-            with open(source_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            # Препроцессинг - заменяем INCLUDE
-            lines = self.preprocess_includes(lines)
-            
-            # Первый проход - собираем метки
-            self.first_pass(lines)
-            self.lines = lines
-            
-            machine_code = []
-            
-            utils = Utils(lines, self.labels, self.current_bank)
-            
-            self.defines = {} #Очищаем self.defines
+    def second_pass(self, statements):
+        """Второй проход - генерируем код.
+
+        В однопроходном режиме (self.fixups is not None) здесь же собираются
+        адреса меток, а ссылки вперёд записываются в список исправлений.
+        """
+        machine_code = []
+        collect_labels = self.fixups is not None
+        # В объектном модуле метки не подставляются сразу: каждая ссылка становится перемещением
+        label_table = self.module_labels if self.relocatable else self.labels
+        
+        conditional_stack = []
+        write_code = True #Флаг записи
+        trace = self.trace
+        self.bank_errors = []
+        self.data_bytes = bytearray()
+        prev = None
+        ranges = self.debug_ranges  # (начало, конец, запись) для отладочной карты или None
+        if ranges is not None:
+            ranges.clear()
+        mark, owner = 0, None
+       
+        for stmt in statements:
+            if ranges is not None:
+                # Байты с mark до текущего конца кода сгенерированы предыдущей записью
+                if len(machine_code) > mark:
+                    ranges.append((mark, len(machine_code), owner))
+                mark, owner = len(machine_code), stmt
+            kind = stmt.kind
             
-            parser = Parser(self.opcodes, self.registers, self.labels, self.defines, self.current_bank, self.program_size, self.current_db_address)
+            if kind == LABEL:
+                if collect_labels and write_code:
+                    label_table[stmt.name] = len(machine_code)
+                continue
+            # Предыдущая запись для проверки BANK перед переходом
+            self.prev_statement = prev
+            prev = stmt
             
-            conditional_stack = []
-            write_code = True #Флаг записи
-           
-            # Второй проход - генерируем код
-            for line_num, line in enumerate(lines, 1):
-                original_line = line.strip()
+             # Проверяем директивы
+            if kind == DIRECTIVE:
+                directive = stmt.name
                 
-                if parser.is_label(line) or not parser.process_conditional_directive(line, self.defines):
+                if directive == '.IFNDEF':
+                     if len(stmt.operands) != 1:
+                        raise CompilationError("Неверный формат .IFNDEF")
+                     symbol = stmt.operands[0]
+                     conditional_stack.append(symbol not in self.defines)
+                     write_code = all(conditional_stack)
+                     if trace.pass2 >= DEBUG:
+                         trace.emit(PASS2, f"{stmt.location()}: .IFNDEF {symbol} -> запись {write_code}, стек {conditional_stack}")
+                         if trace.pass2 >= VERBOSE:
+                             trace.emit(PASS2, f"константы: {self.defines}")
+                     continue
+                elif directive == '.ENDIF':
+                     if not conditional_stack:
+                          raise CompilationError("Директива .ENDIF без соотв. .IFNDEF")
+                     conditional_stack.pop()
+                     write_code = all(conditional_stack) if conditional_stack else True
+                     continue
+                elif directive == '.INCLUDE':
+                     continue #Пропускаем Include, т.к. он уже был обработан
+                elif directive == '.DEFINE':
+                    if write_code:
+                        self._parse_define(stmt, strict=True)
                     continue
-                
-                 # Проверяем директивы
-                if parser.is_directive(line):
-                    directive = parser.get_directive(line)
-                    
-                    if directive == '.IFNDEF':
-                         parts = tokenize_line(line)
-                         if len(parts) != 2:
-                            raise CompilationError("Неверный формат .IFNDEF")
-                         symbol = parts[1]
-                         conditional_stack.append(symbol not in self.defines)
-                         write_code = all(conditional_stack)
-                         print(f"WR: {write_code} CS: {conditional_stack} S: {symbol} DEF: {self.defines}")
-                         continue
-                    elif directive == '.ENDIF':
-                         if not conditional_stack:
-                              raise CompilationError("Директива .ENDIF без соотв. .IFNDEF")
-                         conditional_stack.pop()
-                         write_code = all(conditional_stack) if conditional_stack else True
-                         continue
-                    elif directive == '.INCLUDE':
-                         continue #Пропускаем Include, т.к. он уже был обработан
-                    elif directive == '.DEFINE':
-                        parts = tokenize_line(line)
-                        if len(parts) == 3:
-                            name = parts[1]
-                            try:
-                                if parts[2].startswith('0x'):
-                                    value = int(parts[2], 16)
-                                else:
-                                    value = int(parts[2])
-                                self.defines[name] = value
-                            except ValueError:
-                                pass
-                        continue
-                    elif directive == '.DB':
-                        values = parser.get_directive_values(line)
-                        if write_code:
-                            machine_code = generate_db_code(self, values, machine_code, line_num, original_line)
-                        continue
-                
-                instruction, operands = parser.parse_instruction(line, line_num, original_line)
-                
-                if instruction is None:
-                    continue #Если instruction None, ничего не делаем
+                elif directive == '.DB':
+                    if write_code:
+                        machine_code = generate_db_code(self, stmt, machine_code)
+                    continue
+                elif directive == '.EXPORT':
+                    if write_code:
+                        self.exports.extend(name for name in stmt.operands if name not in self.exports)
+                    continue
+                if write_code:
+                    raise CompilationError(f"{stmt.location()}: Неизвестная директива {directive}\n{stmt.text}")
+                continue
+            
+            if not write_code:
+                continue
 
-                # Отслеживаем текущий банк
-                if instruction == 'BANK':
-                     if write_code:
-                        machine_code = generate_bank_code(self, tokenize_line(line), machine_code)
-                     continue
+            if trace.pass2 >= DEBUG:
+                trace.emit(PASS2, f"{stmt.location()}: {len(machine_code)} {stmt.text}")
+            machine_code = self._generate_instruction(stmt, machine_code)
+
+        if ranges is not None and len(machine_code) > mark:
+            ranges.append((mark, len(machine_code), owner))
+        if conditional_stack:
+           raise CompilationError("Незакрытые директивы .IFNDEF")
+        if not collect_labels:
+            self._raise_bank_errors()
+        return machine_code
 
-                # Проверяем инструкции перехода
-                if instruction in ['JMP', 'JE', 'JNE', 'CALL']:
-                    label = operands[0]
-                    print(label)
-                    if label in self.labels:
-                        print(f"IS LABEL: {label} {self.labels}")
-                        target_addr = self.labels[label]
-                    else:
-                        print(f"NOT IS LABEL {label} : CODE {machine_code}")
-                        try:
-                            target_addr = int(label, 16) if label.startswith('0X') else int(label)
-                        except ValueError:
-                            raise CompilationError(f"Неверный адрес перехода: {label} в строке {line_num}")
+    def _generate_instruction(self, stmt, machine_code):
+        """Генерирует код одной инструкции (с учётом current_bank и prev_statement)."""
+        instruction = stmt.name
 
-                    if write_code:
-                       print("wrL")
-                       machine_code = generate_transition_code(self, instruction, target_addr, machine_code, line_num, original_line)
-                else:
-                    # Обычные инструкции
-                    if write_code:
-                       print("wrI")
-                       machine_code = generate_instruction_code(self, instruction, operands, machine_code, line_num, original_line)
-    
-            if conditional_stack:
-               raise CompilationError("Незакрытые директивы .IFNDEF")
+        # Отслеживаем текущий банк
+        if instruction == 'BANK':
+            return generate_bank_code(self, stmt, machine_code)
+
+        # Проверяем инструкции перехода
+        if instruction in ['JMP', 'JE', 'JNE', 'CALL']:
+            label = stmt.operands[0]
+            if label in self.labels:
+                target_addr = self.labels[label]
+            else:
+                kind, target_addr = operand_kind(self, label)
+                if kind == OPERAND_EXPRESSION:
+                    expression = target_addr
+                    target_addr = expression_value(self, stmt, expression, defer=True)
+                    if target_addr is None:
+                        machine_code.append(stmt.opcode)
+                        return add_fixup(self, stmt, FIXUP_JUMP, None, machine_code,
+                                         expression=expression.bind(self.defines))
+                elif kind != OPERAND_NUMBER:
+                    if self.fixups is None:
+                        raise CompilationError(f"{stmt.location()}: Неверный адрес перехода: {label}")
+                    target_addr = None
+
+            if target_addr is None:
+                # Метка ещё не встречалась - адрес будет подставлен в patch_fixups
+                machine_code.append(stmt.opcode)
+                return add_fixup(self, stmt, FIXUP_JUMP, label, machine_code)
+            return generate_transition_code(self, stmt, target_addr, machine_code)
+
+        # Обычные инструкции
+        return generate_instruction_code(self, stmt, machine_code)
+
+    def single_pass(self, statements):
+        """Однопроходная сборка: код и метки за один проход, ссылки вперёд исправляются в конце."""
+        self.fixups = []
+        try:
+            machine_code = self.second_pass(statements)
+            patch_fixups(self, machine_code)
+            self._raise_bank_errors()
+        finally:
+            self.fixups = None
+        return machine_code
+
+    def assemble_object(self, lines, source_file='<source>') -> ObjectModule:
+        """Собирает перемещаемый объектный модуль; адреса меток подставит компоновщик."""
+        self.defines = dict(self.predefines)
+        with self.stats.phase('include'):
+            statements = self.preprocess_includes(lines, source_file)
+        self.statements = statements
+
+        self.relocatable = True
+        self.fixups = []
+        self.module_labels = {}
+        self.current_bank = None  # банк станет известен только после размещения модуля
+        try:
+            with self.stats.phase('pass2'):
+                machine_code = self.second_pass(statements)
+            fixups = self.fixups
+        finally:
+            self.relocatable = False
+            self.fixups = None
+
+        for name in self.exports:
+            if name not in self.module_labels:
+                raise CompilationError(f"{source_file}: Экспортируемая метка {name} не объявлена")
+
+        relocations = [
+            Relocation(fixup.position, fixup.kind, fixup.label, fixup.addend, fixup.bank,
+                       fixup.prev is not None and fixup.prev.name == 'BANK',
+                       fixup.stmt.location(), fixup.stmt.text)
+            for fixup in fixups
+        ]
+        symbols = {reloc.symbol for reloc in relocations if reloc.symbol is not None}
+        symbols.update(reloc.bank for reloc in relocations if isinstance(reloc.bank, str))
+        imports = sorted(symbol for symbol in symbols if symbol not in self.module_labels)
+        return ObjectModule(Path(source_file).name, bytes(machine_code), dict(self.module_labels),
+                            list(self.exports), imports, relocations,
+                            self.current_db_address - DATA_START_ADDRESS)
+
+    def compile_object(self, source_file, output_file):
+        """Собирает объектный модуль из файла и записывает его."""
+        self.current_directory = Path(source_file).parent
+        with open(source_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        module = self.assemble_object(lines, source_file)
+        with self.stats.phase('output'):
+            save_object(module, output_file)
+        self.stats.bytes = len(module.code)
+        print(f"Объектный модуль записан в файл: '{output_file}' "
+              f"({len(module.code)} байт, экспорт: {len(module.exports)}, импорт: {len(module.imports)}, "
+              f"перемещений: {len(module.relocations)})")
+        return True
+
+    def debug_map(self) -> DebugMap:
+        """Отладочная карта последней сборки (адрес -> файл:строка и метка)."""
+        if self.cached_debug_map is not None:
+            return self.cached_debug_map
+        return DebugMap.from_statements(self.debug_ranges or [], self.labels)
+
+    def print_labels(self):
+        """Выводит размер программы и адреса всех меток."""
+        print(f"\nРазмер программы: {self.program_size} байт")
+        if self.data_segment:
+            print(f"Сегмент данных: {len(self.data_bytes)} байт с адреса {hex(DATA_START_ADDRESS)}")
+        
+       # Выводим адреса всех меток
+        print("\nАдреса меток:")
+        print("-" * 40)
+        print(f"{'Метка':<20} {'Адрес':<8} {'Банк:Смещение'}")
+        print("-" * 40)
+        for label, addr in sorted(self.labels.items(), key=lambda item: item[1]):
+            bank, offset = self.get_bank_and_addr(addr)
+            print(f"{label:<20} {addr:<8} {bank}:{hex(offset)}")
+        print("-" * 40)
+
+    def assemble(self, lines, source_file='<source>', single_pass=False):
+        """Собирает программу из строк исходника и возвращает машинный код."""
+        stats = self.stats
+        self.defines = dict(self.predefines)
+        # Препроцессинг - лексический разбор и подстановка INCLUDE
+        with stats.phase('include'):
+            statements = self.preprocess_includes(lines, source_file)
+        if self.optimize:
+            with stats.phase('optimize'):
+                statements, self.optimization_report = optimize(self, statements)
+        if self.auto_bank:
+            with stats.phase('bank-layout'):
+                statements, self.bank_layout_report = auto_bank(self, statements)
+        self.statements = statements
+        
+        if single_pass:
+            with stats.phase('pass2'):
+                machine_code = self.single_pass(statements)
+        else:
+            # Первый проход - собираем метки
+            with stats.phase('pass1'):
+                self.first_pass(statements)
             
-            self.program_size = len(machine_code)
-               
-            print(f"\nРазмер программы: {self.program_size} байт")
+            self.defines = dict(self.predefines) #Очищаем self.defines
             
-           # Выводим адреса всех меток
-            print("\nАдреса меток:")
-            print("-" * 40)
-            print(f"{'Метка':<20} {'Адрес':<8} {'Банк:Смещение'}")
-            print("-" * 40)
-            for label, addr in sorted(self.labels.items(), key=lambda item: item[1]):
-                bank, offset = self.get_bank_and_addr(addr)
-                print(f"{label:<20} {addr:<8} {bank}:{hex(offset)}")
-            print("-" * 40)
+            with stats.phase('pass2'):
+                machine_code = self.second_pass(statements)
+        return machine_code
+
+    def build(self, source_file, single_pass=False, cache=None, output_mode='hex'):
+        """Собирает программу из файла (с учётом кэша сборки) и возвращает машинный код."""
+        self.current_directory = Path(source_file).parent # Получаем текущий каталог
+        with open(source_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        
+        stats = self.stats
+        options = {'single_pass': single_pass, 'output': output_mode, 'data_segment': self.data_segment,
+                   'optimize': self.optimize, 'auto_bank': self.auto_bank, 'debug_map': self.debug_ranges is not None,
+                   'defines': self.predefines}
+        cached = None
+        if cache is not None:
+            with stats.phase('cache'):
+                cached = cache.lookup(source_file, options, self.opcodes)
+            if self.trace.cache >= INFO:
+                self.trace.emit(CACHE, f"{source_file}: {'попадание' if cached is not None else 'промах'}")
+        
+        if cached is not None:
+            machine_code = cached['machine_code']
+            self.labels = cached['labels']
+            self.data_bytes = bytearray.fromhex(cached.get('data', ''))
+            if cached.get('optimization'):
+                self.optimization_report = OptimizationReport.from_dict(cached['optimization'])
+            if cached.get('debug_map'):
+                self.cached_debug_map = DebugMap.from_dict(cached['debug_map'])
+            if cached.get('bank_layout'):
+                self.bank_layout_report = BankLayoutReport.from_dict(cached['bank_layout'])
+        else:
+            machine_code = self.assemble(lines, source_file, single_pass)
+            if cache is not None:
+                with stats.phase('cache'):
+                    dependencies = [str(Path(source_file).resolve())] + self.included_files
+                    cache.store(source_file, options, self.opcodes, dependencies, {
+                        'machine_code': machine_code,
+                        'labels': self.labels,
+                        'data': self.data_bytes.hex(),
+                        'optimization': self.optimization_report.to_dict() if self.optimization_report else None,
+                        'bank_layout': self.bank_layout_report.to_dict() if self.bank_layout_report else None,
+                        'debug_map': self.debug_map().to_dict() if self.debug_ranges is not None else None,
+                        'program_size': len(machine_code),
+                    })
+        
+        self.program_size = len(machine_code)
+        stats.bytes = self.program_size
+        return machine_code
+
+    def compile(self, source_file, output_file, use_cassette=False, section_number=0, single_pass=False, cache=None,
+                output_format=FORMAT_HEX, debug_map_file=None):
+        # try:
+            machine_code = self.build(source_file, single_pass, cache, 'cassette' if use_cassette else 'hex')
+               
+            self.print_labels()
+            if self.optimization_report is not None:
+                print(self.optimization_report.format())
+            if self.bank_layout_report is not None:
+                print(self.bank_layout_report.format())
             # Записываем машинный код в файл или кассету
 
-            if use_cassette:
-                if not self._write_to_cassette(output_file, machine_code, section_number):
-                   return False
-            else:
-                if not self._write_to_file(output_file, machine_code):
-                    return False
-            return True
+            with self.stats.phase('output'):
+                if use_cassette:
+                    written = self._write_to_cassette(output_file, machine_code, section_number)
+                else:
+                    written = self._write_to_file(output_file, machine_code, output_format)
+                if written and debug_map_file is not None:
+                    save_debug_map(self.debug_map(), debug_map_file)
+                    print(f"Отладочная карта записана в файл: '{debug_map_file}'")
+            return written
 
         # except CompilationError as e:
         #     print(f"Ошибка компиляции: {str(e)}")
@@ -356,11 +609,15 @@ class Compiler:
         #     print(f"Неизвестная ошибка компиляции: {str(e)}")
         #     return False
     
-    def _write_to_file(self, output_file, machine_code):
+    def _write_to_file(self, output_file, machine_code, output_format=FORMAT_HEX):
+        """Записывает программу в формате hex, bin или vbin (см. binformat) одним вызовом write."""
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                for byte in machine_code:
-                    f.write(f"{byte:02x} ")
+            data = encode_program(machine_code, output_format,
+                                  data=self.data_bytes if self.data_segment else None, data_address=DATA_START_ADDRESS)
+            with open(output_file, 'wb') as f:
+                f.write(data)
+            if self.trace.output >= INFO:
+                self.trace.emit(OUTPUT, f"{output_file}: {len(machine_code)} байт, формат {output_format}, в файле {len(data)} байт")
             print(f"Код успешно записан в файл: '{output_file}'")
             return True
         except Exception as e:
@@ -368,7 +625,20 @@ class Compiler:
             return False
 
     def _write_to_cassette(self, output_file, machine_code, section_number):
+        return self._write_cassette_sections(output_file, {section_number: machine_code})
+
+    def _write_cassette_sections(self, output_file, sections):
+        """Записывает несколько секций в кассету за одно чтение и одну запись файла.
+
+        Кассеты собственного формата (cassette.py) меняются на месте, только
+        в слотах записываемых секций; старые pickle-образы перезаписываются целиком.
+        """
         try:
+            if is_native(output_file):
+                with Cassette(output_file) as cassette:
+                    cassette.write_sections(sections)
+                self._report_cassette_sections(output_file, sections)
+                return True
             with open(output_file, 'rb+') as f:
                 try:
                     loaded_data = pickle.load(f)  # загружаем данные с помощью pickle
@@ -377,22 +647,33 @@ class Compiler:
                     return False
                 cassette_data = loaded_data['data']
                 
-                start_byte = section_number * 256
-                end_byte = start_byte + len(machine_code)
-                
-                if end_byte > len(cassette_data):
-                    print("Ошибка: бинарный код слишком велик для выбранной секции кассеты.")
-                    return False
+                for section_number, machine_code in sections.items():
+                    start_byte = section_number * 256
+                    end_byte = start_byte + len(machine_code)
+                    
+                    if end_byte > len(cassette_data):
+                        print(f"Ошибка: бинарный код слишком велик для секции {section_number} кассеты.")
+                        return False
 
-                cassette_data[start_byte:end_byte] = machine_code # записываем код в нужную секцию
+                    cassette_data[start_byte:end_byte] = machine_code # записываем код в нужную секцию
                 loaded_data['data'] = cassette_data # обновляем данные
                 f.seek(0) # устанавливаем курсор в начало файла
                 pickle.dump(loaded_data, f) # перезаписываем данные
-                print(f"Код успешно записан в секцию {section_number} файла кассеты '{output_file}'")
-                return True
+                f.truncate() # новый образ может оказаться короче старого
+            self._report_cassette_sections(output_file, sections)
+            return True
         except FileNotFoundError:
                 print(f"Ошибка: Файл кассеты '{output_file}' не найден")
                 return False
+        except CompilationError as e:
+                print(str(e))
+                return False
         except Exception as e:
                  print(f"Ошибка записи в кассету: {str(e)}")
-                 return False
\ No newline at end of file
+                 return False
+
+    def _report_cassette_sections(self, output_file, sections):
+        for section_number, machine_code in sections.items():
+            if self.trace.output >= INFO:
+                self.trace.emit(OUTPUT, f"{output_file}: секция {section_number}, {len(machine_code)} байт")
+            print(f"Код успешно записан в секцию {section_number} файла кассеты '{output_file}'")
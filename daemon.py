@@ -0,0 +1,311 @@
+# daemon.py
+import asyncio
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from build_cache import DEFAULT_CACHE_DIR
+from include_cache import IncludeCache
+
+DEFAULT_SOCKET = os.environ.get('VASM_DAEMON_SOCKET', os.path.join(DEFAULT_CACHE_DIR, 'daemon.sock'))
+CONNECT_TIMEOUT = 0.5  # секунд на подключение клиента к демону
+# Секунд на ответ демона: зависший демон не должен подвешивать main.py (тогда сборка идёт в процессе)
+BUILD_TIMEOUT = float(os.environ.get('VASM_DAEMON_TIMEOUT', 120))
+
+# Коды ошибок JSON-RPC 2.0
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+
+class AssemblerService:
+    """Состояние демона, общее для всех запросов.
+
+    Кэш INCLUDE (разобранные файлы, проверка по mtime и размеру) живёт между
+    запросами; кэш сборки на диске пропускает неизменённые программы целиком.
+    Запросы выполняются по одному: сборка использует текущий каталог и
+    перехватывает stdout/stderr процесса.
+    """
+
+    def __init__(self):
+        self.include_cache = IncludeCache()
+        self.started = time.time()
+        self.requests = 0
+        self.running = True
+        self.sessions = {}  # имя сессии (обычно путь к файлу в редакторе) -> session.Session
+
+    def handle(self, message: Dict) -> Optional[Dict]:
+        """Обрабатывает запрос JSON-RPC и возвращает ответ (None - для уведомления без id)."""
+        if not isinstance(message, dict) or not isinstance(message.get('method'), str):
+            return _error(None, INVALID_REQUEST, "неверный запрос")
+        request_id = message.get('id')
+        method = getattr(self, 'rpc_' + message['method'], None)
+        if method is None:
+            return _error(request_id, METHOD_NOT_FOUND, f"неизвестный метод: {message['method']}")
+        self.requests += 1
+        try:
+            result = method(**(message.get('params') or {}))
+        except TypeError as e:
+            return _error(request_id, INVALID_REQUEST, str(e))
+        except Exception as e:
+            return _error(request_id, INTERNAL_ERROR, f"{type(e).__name__}: {e}")
+        if request_id is None:
+            return None
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    def rpc_build(self, args: List[str], cwd: str, cache_dir: Optional[str] = None) -> Dict:
+        """Выполняет командную строку main.py в каталоге клиента; возвращает вывод и код выхода."""
+        from main import main
+        stdout, stderr = io.StringIO(), io.StringIO()
+        exit_code = 0
+        previous = os.getcwd()
+        try:
+            os.chdir(cwd)
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    main(args, self.include_cache, cache_dir)
+                except SystemExit as e:
+                    exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                except Exception:
+                    traceback.print_exc()
+                    exit_code = 1
+        finally:
+            os.chdir(previous)
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'exit_code': exit_code}
+
+    def rpc_assemble(self, source: str, directory: Optional[str] = None, defines: Optional[Dict[str, int]] = None,
+                     source_name: str = '<source>', **options) -> Dict:
+        """Собирает текст программы в памяти (assembler.assemble); .INCLUDE ищутся в directory."""
+        from assembler import assemble, file_resolver
+        return _result(assemble(source, file_resolver(directory) if directory else None, defines, source_name, **options))
+
+    def rpc_open(self, session: str, source: str, directory: Optional[str] = None,
+                 defines: Optional[Dict[str, int]] = None, source_name: str = '<source>') -> Dict:
+        """Открывает сессию правок (session.Session) и возвращает результат полной сборки."""
+        from assembler import file_resolver
+        from session import Session
+        self.sessions[session] = Session(source, file_resolver(directory) if directory else None, defines, source_name)
+        return self._session_result(session)
+
+    def rpc_edit(self, session: str, line: int, count: int, text: str) -> Dict:
+        """Заменяет count строк с line (с 1) текстом text и пересобирает изменённое."""
+        self._session(session).edit(line, count, text)
+        return self._session_result(session)
+
+    def rpc_update(self, session: str, source: str) -> Dict:
+        """Принимает новый текст файла целиком (например, после сохранения)."""
+        self._session(session).update(source)
+        return self._session_result(session)
+
+    def rpc_close(self, session: str) -> bool:
+        return self.sessions.pop(session, None) is not None
+
+    def _session(self, name: str):
+        if name not in self.sessions:
+            raise ValueError(f"сессия не открыта: {name}")
+        return self.sessions[name]
+
+    def _session_result(self, name: str) -> Dict:
+        session = self.sessions[name]
+        result = _result(session.result())
+        result['build'] = session.last_build
+        return result
+
+    def rpc_ping(self) -> str:
+        return 'pong'
+
+    def rpc_stats(self) -> Dict:
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started,
+            'requests': self.requests,
+            'sessions': len(self.sessions),
+            'include_cache': {'files': len(self.include_cache.files), 'hits': self.include_cache.hits,
+                              'misses': self.include_cache.misses},
+        }
+
+    def rpc_shutdown(self) -> bool:
+        self.running = False
+        return True
+
+
+def _result(result) -> Dict:
+    """AssemblyResult в виде JSON."""
+    return {
+        'ok': result.ok,
+        'code': result.code.hex(),
+        'labels': result.labels,
+        'bank_sizes': result.bank_sizes,
+        'data': result.data.hex() if result.data is not None else None,
+        'diagnostics': [{'severity': item.severity, 'message': item.message} for item in result.diagnostics],
+    }
+
+
+def _error(request_id, code: int, message: str) -> Dict:
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+def _respond(service: AssemblerService, line: bytes) -> Optional[bytes]:
+    try:
+        message = json.loads(line)
+    except ValueError:
+        response = _error(None, PARSE_ERROR, "неверный JSON")
+    else:
+        response = service.handle(message)
+    if response is None:
+        return None
+    return json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+async def serve_socket(path: str = DEFAULT_SOCKET):
+    """Сервер на Unix-сокете: по строке JSON на запрос и ответ, клиентов может быть несколько."""
+    service = AssemblerService()
+    stopped = asyncio.Event()
+
+    async def client(reader, writer):
+        try:
+            while not reader.at_eof():
+                line = await reader.readline()
+                if not line.strip():
+                    continue
+                response = _respond(service, line)
+                if response is not None:
+                    writer.write(response)
+                    await writer.drain()
+                if not service.running:
+                    stopped.set()
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    _remove_stale_socket(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    server = await asyncio.start_unix_server(client, path)
+    print(f"Демон ассемблера слушает {path} (pid {os.getpid()})", flush=True)
+    try:
+        async with server:
+            await stopped.wait()
+    finally:
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+
+
+def serve_stdio():
+    """JSON-RPC через stdin/stdout: по строке на запрос и ответ (для редакторов)."""
+    service = AssemblerService()
+    output = sys.stdout.buffer
+    for line in sys.stdin.buffer:
+        if not line.strip():
+            continue
+        response = _respond(service, line)
+        if response is not None:
+            output.write(response)
+            output.flush()
+        if not service.running:
+            break
+
+
+def _remove_stale_socket(path: str):
+    """Удаляет файл сокета, оставшийся от завершившегося демона; если демон жив - ошибка."""
+    if not os.path.exists(path):
+        return
+    try:
+        request('ping', path=path)
+    except OSError:
+        os.unlink(path)
+        return
+    raise RuntimeError(f"демон уже запущен: {path}")
+
+
+# Клиент
+
+def request(method: str, params: Optional[Dict] = None, path: str = DEFAULT_SOCKET, timeout: float = BUILD_TIMEOUT):
+    """Отправляет запрос демону и возвращает result.
+
+    OSError - демон недоступен или не ответил за timeout секунд
+    (socket.timeout - тоже OSError).
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params or {}}).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as stream:
+            line = stream.readline()
+    if not line:
+        raise ConnectionError("демон закрыл соединение")
+    response = json.loads(line)
+    if 'error' in response:
+        raise RuntimeError(response['error']['message'])
+    return response['result']
+
+
+def forward(args: List[str]) -> Optional[int]:
+    """Выполняет командную строку main.py в демоне, если он запущен.
+
+    Возвращает код выхода или None, если сборку нужно выполнить в этом
+    процессе: демон не запущен или не ответил за BUILD_TIMEOUT секунд,
+    Unix-сокеты недоступны, задана --no-daemon или VASM_NO_DAEMON, либо
+    это пакетная сборка (у неё свои процессы).
+    """
+    if not hasattr(socket, 'AF_UNIX') or os.environ.get('VASM_NO_DAEMON') or \
+            '--no-daemon' in args or '--batch' in args or not os.path.exists(DEFAULT_SOCKET):
+        return None
+    try:
+        result = request('build', {'args': args, 'cwd': os.getcwd(), 'cache_dir': os.environ.get('VASM_CACHE_DIR')})
+    except (socket.timeout, OSError, ValueError, RuntimeError):
+        return None
+    sys.stdout.write(result['stdout'])
+    sys.stderr.write(result['stderr'])
+    return result['exit_code']
+
+
+if __name__ == "__main__":
+    usage = ("Использование: python daemon.py [--socket <путь>]   - демон на Unix-сокете\n"
+             "       python daemon.py --stdio               - JSON-RPC через stdin/stdout\n"
+             "       python daemon.py --stop | --status [--socket <путь>]")
+    args = sys.argv[1:]
+    socket_path = DEFAULT_SOCKET
+    if '--socket' in args:
+        index = args.index('--socket')
+        if index + 1 >= len(args):
+            print(usage)
+            sys.exit(1)
+        socket_path = args[index + 1]
+        del args[index:index + 2]
+
+    if args == ['--stdio']:
+        serve_stdio()
+    elif args in (['--stop'], ['--status']):
+        try:
+            if args == ['--stop']:
+                request('shutdown', path=socket_path)
+                print("Демон остановлен")
+            else:
+                print(json.dumps(request('stats', path=socket_path), ensure_ascii=False, indent=2))
+        except OSError:
+            print(f"Демон не запущен ({socket_path})")
+            sys.exit(1)
+    elif not args:
+        if not hasattr(asyncio, 'start_unix_server'):
+            print("Unix-сокеты недоступны на этой платформе, используйте --stdio")
+            sys.exit(1)
+        try:
+            asyncio.run(serve_socket(socket_path))
+        except RuntimeError as e:
+            print(f"Ошибка: {e}")
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(usage)
+        sys.exit(1)
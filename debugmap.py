@@ -0,0 +1,84 @@
+# debugmap.py
+import json
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+DEBUG_MAP_MAGIC = 'VDBG'
+DEBUG_MAP_VERSION = 1
+
+
+class DebugMap:
+    """Отображение адресов машинного кода на строки исходника и метки.
+
+    ranges - отсортированные по адресу диапазоны [начало, конец, номер файла, строка);
+    соседние диапазоны одной строки объединяются. Поиск - бинарный по началам.
+    """
+
+    def __init__(self, files: List[str], ranges: List[List[int]], labels: Dict[str, int]):
+        self.files = files
+        self.ranges = ranges
+        self.labels = labels
+        self._starts = [item[0] for item in ranges]
+        self._label_items = sorted((addr, name) for name, addr in labels.items())
+        self._label_addrs = [addr for addr, _ in self._label_items]
+
+    @classmethod
+    def from_statements(cls, ranges, labels: Dict[str, int]) -> 'DebugMap':
+        """Строит карту из записей второго прохода: (начало, конец, Statement)."""
+        files: List[str] = []
+        file_index: Dict[str, int] = {}
+        merged: List[List[int]] = []
+        for start, end, stmt in ranges:
+            index = file_index.get(stmt.file)
+            if index is None:
+                index = file_index[stmt.file] = len(files)
+                files.append(stmt.file)
+            if merged and merged[-1][1] == start and merged[-1][2] == index and merged[-1][3] == stmt.line:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end, index, stmt.line])
+        return cls(files, merged, dict(labels))
+
+    def lookup(self, address: int) -> Optional[Tuple[str, int]]:
+        """Файл и строка исходника, из которой получен байт по адресу."""
+        index = bisect_right(self._starts, address) - 1
+        if index < 0:
+            return None
+        start, end, file_index, line = self.ranges[index]
+        if address >= end:
+            return None
+        return self.files[file_index], line
+
+    def label_for(self, address: int) -> Optional[str]:
+        """Ближайшая метка не выше адреса (метка, внутри которой находится адрес)."""
+        index = bisect_right(self._label_addrs, address) - 1
+        if index < 0:
+            return None
+        # Из нескольких меток на одном адресе берём первую по алфавиту
+        return self._label_items[bisect_left(self._label_addrs, self._label_addrs[index])][1]
+
+    def to_dict(self) -> Dict:
+        return {
+            'magic': DEBUG_MAP_MAGIC,
+            'version': DEBUG_MAP_VERSION,
+            'files': self.files,
+            'ranges': self.ranges,
+            'labels': self.labels,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'DebugMap':
+        if data.get('magic') != DEBUG_MAP_MAGIC or data.get('version') != DEBUG_MAP_VERSION:
+            raise ValueError("неизвестный формат отладочной карты")
+        return cls(data['files'], data['ranges'], data['labels'])
+
+
+def save_debug_map(debug_map: DebugMap, path):
+    """Записывает отладочную карту в файл (компактный JSON)."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(debug_map.to_dict(), f, separators=(',', ':'))
+
+def load_debug_map(path) -> DebugMap:
+    """Читает отладочную карту из файла."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return DebugMap.from_dict(json.load(f))
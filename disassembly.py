@@ -1,147 +1,353 @@
+import mmap
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from binformat import FORMAT_HEX, FORMAT_VBIN, VBIN_DATA_HEADER, FLAG_DATA_SEGMENT, detect_format, unpack_vbin_header
+from cassette import CASSETTE_MAGIC, SECTION_USED, Cassette
+from isa import MNEMONICS, OPCODES, OPERANDS, INSTRUCTION_SIZES, REGISTER_NAMES, REG, BANK_NUMBER, JUMPS
+
+try:
+    import numpy as np
+except ImportError:  # без numpy границы инструкций ищутся циклом на Python
+    np = None
+
+CHUNK_SIZE = 1 << 20  # байт кода, декодируемых за раз
+NUMPY_THRESHOLD = 1 << 16  # с какого размера фрагмента выгоднее numpy
+BANK_SIZE = 256
+
+# Длина инструкции по опкоду; неизвестный опкод выводится комментарием и занимает 1 байт
+LENGTHS = tuple(size or 1 for size in INSTRUCTION_SIZES)
+
+# Комментарии к инструкциям: t - операнды как в тексте, v - числовые значения
+COMMENTS = {
+    'SET': '{t[0]} = {v[1]}',
+    'RND': '{t[0]} = {v[1]}',
+    'STOREV': 'MEM[{t[0]}] = {t[1]}',
+    'BANK': 'Банк {v[0]}',
+}
+COMMENTS.update({name: 'Переход на адрес {t[0]}' for name in JUMPS})
+JUMP_OPCODES = frozenset(OPCODES[name] for name in JUMPS)
+
+
+def _operand(kind: str, value: int) -> str:
+    if kind == REG:
+        return REGISTER_NAMES.get(value, f"R{value}")
+    if kind == BANK_NUMBER:
+        return str(value)
+    return hex(value)
+
+
+def _formatter(opcode: int) -> Callable[[bytes, int], str]:
+    """Функция форматирования инструкции с опкодом opcode по таблицам isa.py."""
+    if opcode not in MNEMONICS:
+        return lambda code, i: f"; Неизвестный опкод: {hex(opcode)}"
+    name = MNEMONICS[opcode]
+    kinds = OPERANDS[name]
+    comment = COMMENTS.get(name)
+    prefix = '\n' if name == 'BANK' else ''  # смена банка отделяется пустой строкой
+
+    def format_instruction(code, i):
+        values = code[i + 1:i + 1 + len(kinds)]
+        text = [_operand(kind, value) for kind, value in zip(kinds, values)]
+        line = ' '.join([name] + text)
+        if comment:
+            line += '    ; ' + comment.format(t=text, v=values)
+        return prefix + line
+    return format_instruction
+
+
+# Таблица декодирования на все 256 опкодов, строится из той же ISA, что и у ассемблера
+DECODERS: Tuple[Callable[[bytes, int], str], ...] = tuple(_formatter(opcode) for opcode in range(256))
+
+
+def instruction_starts(code: bytes) -> Tuple[List[int], int]:
+    """Адреса начала инструкций, целиком помещающихся в code, и конец последней из них.
+
+    На больших фрагментах используется numpy: длины всех байт считаются
+    одной операцией, а цепочка «начало -> следующее начало» проходится
+    удвоением шага (за log2(n) векторных шагов вместо n шагов цикла).
+    """
+    n = len(code)
+    if np is not None and n >= NUMPY_THRESHOLD:
+        lengths = np.array(LENGTHS, dtype=np.int64)[np.frombuffer(code, dtype=np.uint8)]
+        following = np.minimum(np.arange(n, dtype=np.int64) + lengths, n)
+        following = np.append(following, n)  # n - конец фрагмента, ведёт сам в себя
+        reached = np.zeros(n + 1, dtype=bool)
+        reached[0] = True
+        jumps = 1
+        while jumps <= n:
+            reached[following[np.flatnonzero(reached)]] = True
+            following = following[following]
+            jumps *= 2
+        starts = np.flatnonzero(reached[:n])
+        fits = starts + lengths[starts] <= n
+        end = int(starts[~fits][0]) if not fits.all() else n
+        return starts[fits].tolist(), end
+
+    starts = []
+    i = 0
+    while i < n:
+        size = LENGTHS[code[i]]
+        if i + size > n:
+            break
+        starts.append(i)
+        i += size
+    return starts, i
+
+
+def _mapped_chunks(buffer, start: int, end: int) -> Iterator[bytes]:
+    """Фрагменты буфера (mmap) от start до end: в память читаются только нужные страницы."""
+    for position in range(start, end, CHUNK_SIZE):
+        yield buffer[position:min(position + CHUNK_SIZE, end)]
+
+
+def _hex_chunks(f) -> Iterator[bytes]:
+    """Фрагменты hex-текста, разобранные в байты; токен на границе чтения переносится в следующий."""
+    rest = ''
+    while True:
+        text = f.read(CHUNK_SIZE * 3)
+        if not text:
+            break
+        text = rest + text
+        cut = max(text.rfind(' '), text.rfind('\n')) + 1
+        rest = text[cut:]
+        yield bytes.fromhex(text[:cut])
+    if rest.strip():
+        yield bytes.fromhex(rest)
+
+
+def _select(chunks: Iterable[bytes], offset: int, length: Optional[int]) -> Iterator[bytes]:
+    """Пропускает offset байт потока и обрезает его до length байт."""
+    for chunk in chunks:
+        if offset >= len(chunk):
+            offset -= len(chunk)
+            continue
+        chunk = chunk[offset:]
+        offset = 0
+        if length is not None:
+            chunk = chunk[:length]
+            length -= len(chunk)
+        if chunk:
+            yield chunk
+        if length == 0:
+            break
+
+
+class LabelIndex:
+    """Отсортированный индекс целей переходов с синтетическими метками.
+
+    Метка ставится только на цель, с которой начинается инструкция; имя -
+    банк и смещение в банке (L1_93 - банк 1, смещение 0x93). Поиск -
+    бинарный по отсортированному списку адресов.
+    """
+
+    def __init__(self, references: Dict[int, List[Tuple[int, str]]], starts: bytearray, base: int):
+        self.references = references
+        # Сортировка подсчётом: цели (не больше 65536 адресов) отмечаются в таблице и читаются по порядку
+        marks = bytearray(BANK_SIZE * BANK_SIZE)
+        for target in references:
+            marks[target] = 1
+        targets = []
+        position = marks.find(1)
+        while position >= 0:
+            targets.append(position)
+            position = marks.find(1, position + 1)
+        self.targets = targets
+        self.addresses = [target for target in targets
+                          if 0 <= target - base < len(starts) and starts[target - base]]
+
+    def label(self, address: int) -> Optional[int]:
+        """Номер метки для адреса или None, если по адресу нет метки."""
+        index = bisect_left(self.addresses, address)
+        if index < len(self.addresses) and self.addresses[index] == address:
+            return index
+        return None
+
+    @staticmethod
+    def name(address: int) -> str:
+        return f"L{address // BANK_SIZE}_{address % BANK_SIZE:02X}"
+
+    def format(self) -> Iterator[str]:
+        """Таблица перекрёстных ссылок (комментариями, чтобы текст оставался исходником)."""
+        if not self.targets:
+            return
+        yield "\n; Перекрёстные ссылки:"
+        for target in self.targets:
+            sources = ', '.join(f"{mnemonic} {hex(source)}" for source, mnemonic in self.references[target])
+            name = self.name(target) if self.label(target) is not None else f"{hex(target)} (не начало инструкции)"
+            yield f"; {name} <- {sources}"
+
+
 class Disassembler:
+    """Потоковый дизассемблер: читает программу фрагментами и выдаёт строки генератором."""
+
     def __init__(self):
-        # Таблица опкодов (обратная таблице в компиляторе)
-        self.opcodes = {
-            0x00: 'NOP',
-            0x01: 'SET',
-            0x02: 'MOV',
-            0x03: 'ADD',
-            0x04: 'SUB',
-            0x05: 'AND',
-            0x06: 'OR',
-            0x07: 'XOR',
-            0x08: 'JMP',
-            0x09: 'STOREV',
-            0x0A: 'STORER',
-            0x0B: 'STOREM',
-            0x0C: 'LOADR',
-            0x0D: 'JE',
-            0x0E: 'JNE',
-            0x0F: 'CMP',
-            0x10: 'PUSH',
-            0x11: 'POP',
-            0x12: 'MUL',
-            0x13: 'DIV',
-            0x14: 'SETPX',
-            0x15: 'CLRPX',
-            0x16: 'DIGIT',
-            0x17: 'CLEAR',
-            0x18: 'GETKEY',
-            0x19: 'CALL',
-            0x1A: 'RET',
-            0x1B: 'RND',
-            0x1C: 'BANK',
-            0x1D: 'SAVKEY',
-            0x1E: 'BRIGHT',
-            0x1F: 'LOADRR',
-            0xFF: 'HLT'
-        }
-        
-        # Обратная таблица регистров
-        self.registers = {
-            0x01: 'R1',
-            0x02: 'R2',
-            0x03: 'R3',
-            0x04: 'R4',
-            0x05: 'R5',
-            0x06: 'R6'
-        }
-        
-        # Размер операндов для каждой инструкции
-        self.operand_sizes = {
-            'NOP': 0,
-            'SET': 2,    # регистр + значение
-            'MOV': 2,    # регистр + регистр
-            'ADD': 2,    # регистр + регистр
-            'SUB': 2,
-            'AND': 2,
-            'OR': 2,
-            'XOR': 2,
-            'JMP': 1,    # адрес
-            'STOREV': 2, # адрес + значение
-            'STORER': 2, # адрес + регистр
-            'STOREM': 2,
-            'LOADR': 2,  # регистр + адрес
-            'JE': 1,     # адрес
-            'JNE': 1,    # адрес
-            'CMP': 2,    # регистр + регистр
-            'PUSH': 1,   # регистр
-            'POP': 1,    # регистр
-            'MUL': 2,
-            'DIV': 2,
-            'SETPX': 3,  # x + y + яркость
-            'CLRPX': 2,  # x + y
-            'DIGIT': 2,  # позиция + значение
-            'CLEAR': 0,
-            'GETKEY': 1, # регистр
-            'CALL': 1,   # адрес
-            'RET': 0,
-            'RND': 2,    # регистр + максимум
-            'BANK': 1,   # номер банка
-            'SAVKEY': 1, # адрес
-            'BRIGHT': 1, # яркость
-            'LOADRR': 2, # регистр + регистр
-            'HLT': 0
-        }
-
-    def disassemble(self, binary_file, output_file=None):
-        try:
-            # Читаем бинарный файл
-            with open(binary_file, 'r') as f:
-                data = f.read().strip().split()
-                program = [int(x, 16) for x in data]
-
-            current_bank = 0
-            address = 0
-            result = []
-            i = 0
-
-            while i < len(program):
-                # Получаем текущий опкод
-                opcode = program[i]
-                if opcode not in self.opcodes:
-                    result.append(f"; Неизвестный опкод: {hex(opcode)}")
-                    i += 1
+        self.opcodes = dict(MNEMONICS)
+        self.registers = dict(REGISTER_NAMES)
+        self.decoders = DECODERS
+
+    def decode(self, chunks: Iterable[bytes]) -> Iterator[str]:
+        """Строки ассемблера для потока машинного кода, разбитого на фрагменты произвольно."""
+        decoders = self.decoders
+        carry = b''
+        for chunk in chunks:
+            code = carry + bytes(chunk)
+            starts, end = instruction_starts(code)
+            for i in starts:
+                yield decoders[code[i]](code, i)
+            carry = code[end:]
+        if carry:
+            yield f"; Неполная инструкция: {carry.hex(' ')}"
+
+    def lines(self, binary_file, section: Optional[int] = None, offset: int = 0,
+              length: Optional[int] = None, labels: bool = False) -> Iterator[str]:
+        """Строки дизассемблированной программы или кассеты.
+
+        section - номер секции кассеты (остальные секции не читаются),
+        offset и length выбирают диапазон байт кода программы (или секции),
+        labels - двухпроходный режим с метками вместо адресов переходов
+        (вход читается дважды).
+        """
+        for title, chunks in self._segments(binary_file, section, offset, length):
+            if title is not None:
+                yield title
+            if chunks is None:
+                continue
+            if labels:
+                yield from self.labeled(chunks, offset)
+            else:
+                yield from self.decode(chunks())
+
+    def _segments(self, binary_file, section, offset, length):
+        """Части файла: (строка-заголовок или None, функция, создающая поток фрагментов кода, или None)."""
+        with open(binary_file, 'rb') as f:
+            head = f.read(CHUNK_SIZE)
+            complete = len(head) < CHUNK_SIZE
+        if head.startswith(CASSETTE_MAGIC):
+            yield from self._cassette_segments(binary_file, section, offset, length)
+            return
+        if section is not None:
+            raise ValueError("номер секции можно указать только для кассеты")
+        fmt = detect_format(head, complete)
+        if fmt == FORMAT_HEX:
+            def hex_chunks():
+                with open(binary_file, 'r', encoding='ascii') as f:
+                    yield from _select(_hex_chunks(f), offset, length)
+            yield None, hex_chunks
+            return
+        if not head:
+            return
+        with open(binary_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            start, end, data = 0, len(buffer), None
+            if fmt == FORMAT_VBIN:
+                info, start = unpack_vbin_header(buffer)
+                flags, size = info['flags'], info['size']
+                if flags & FLAG_DATA_SEGMENT:
+                    data_address, data_size = VBIN_DATA_HEADER.unpack_from(buffer, start)
+                    start += VBIN_DATA_HEADER.size
+                    data = (data_address, buffer[start + size:start + size + data_size])
+                end = start + size
+            yield None, lambda: self._range(buffer, start, end, offset, length)
+            # Сегмент данных vbin выводим директивами .DB (они занимают те же адреса с 0x80)
+            if data and data[1]:
+                data_address, values = data
+                yield f"\n; Сегмент данных: {len(values)} байт с адреса {hex(data_address)}", None
+                for position in range(0, len(values), 16):
+                    yield ".DB " + ', '.join(str(value) for value in values[position:position + 16]), None
+
+    def _range(self, buffer, start: int, end: int, offset: int, length: Optional[int]) -> Iterator[bytes]:
+        start = min(start + offset, end)
+        if length is not None:
+            end = min(end, start + length)
+        return _mapped_chunks(buffer, start, end)
+
+    def _cassette_segments(self, path, section, offset, length):
+        with Cassette(path) as cassette:
+            if section is not None:
+                if not 0 <= section < cassette.section_count:
+                    raise ValueError(f"в кассете нет секции {section}")
+                sections = [section]
+            else:
+                sections = [index for index, (_, flags, _) in enumerate(cassette.directory()) if flags & SECTION_USED]
+            for index in sections:
+                code = cassette.read_section(index)
+                yield f"; Секция {index}: {len(code)} байт", \
+                    lambda code=code: self._range(code, 0, len(code), offset, length)
+
+    # Двухпроходный режим с метками
+
+    def _instructions(self, chunks: Iterable[bytes], base: int):
+        """Инструкции потока: (адрес, код фрагмента, смещение в нём, банк перед инструкцией).
+
+        Банк - последний BANK по тексту, как при проверке переходов компилятором.
+        """
+        carry = b''
+        address = base
+        bank = 0
+        bank_opcode = OPCODES['BANK']
+        for chunk in chunks:
+            code = carry + bytes(chunk)
+            starts, end = instruction_starts(code)
+            for i in starts:
+                yield address + i, code, i, bank
+                if code[i] == bank_opcode:
+                    bank = code[i + 1]
+            address += end
+            carry = code[end:]
+        if carry:
+            yield address, carry, None, bank
+
+    def index(self, chunks: Iterable[bytes], base: int = 0) -> 'LabelIndex':
+        """Первый проход: цели всех переходов и вызовов (с учётом банка) и ссылки на них."""
+        references: Dict[int, List[Tuple[int, str]]] = {}
+        starts = bytearray()  # 1 - по адресу (от base) начинается инструкция
+        for address, code, i, bank in self._instructions(chunks, base):
+            if i is None:
+                break
+            if address - base >= len(starts):
+                starts.extend(bytes(CHUNK_SIZE))
+            starts[address - base] = 1
+            if code[i] in JUMP_OPCODES:
+                target = bank * BANK_SIZE + code[i + 1]
+                references.setdefault(target, []).append((address, MNEMONICS[code[i]]))
+        return LabelIndex(references, starts, base)
+
+    def labeled(self, chunks: Callable[[], Iterable[bytes]], base: int = 0) -> Iterator[str]:
+        """Два прохода по потоку: индекс целей, затем текст с метками и таблица перекрёстных ссылок.
+
+        Результат собирается компилятором обратно в тот же машинный код, если
+        в нём нет неизвестных опкодов и неполных инструкций.
+        """
+        index = self.index(chunks(), base)
+        decoders = self.decoders
+        pending = 0  # номер следующей метки в index.addresses
+        addresses = index.addresses
+        for address, code, i, bank in self._instructions(chunks(), base):
+            while pending < len(addresses) and addresses[pending] <= address:
+                if addresses[pending] == address:
+                    yield f":{index.name(address)}"
+                pending += 1
+            if i is None:
+                yield f"; Неполная инструкция: {code.hex(' ')}"
+                break
+            opcode = code[i]
+            if opcode in JUMP_OPCODES:
+                target = bank * BANK_SIZE + code[i + 1]
+                if index.label(target) is not None:
+                    yield f"{MNEMONICS[opcode]} {index.name(target)}"
                     continue
+            yield decoders[opcode](code, i)
+        yield from index.format()
 
-                instruction = self.opcodes[opcode]
-                operand_size = self.operand_sizes[instruction]
-                operands = program[i+1:i+1+operand_size]
-                
-                # Форматируем инструкцию
-                if instruction == 'BANK':
-                    current_bank = operands[0]
-                    result.append(f"\nBANK {operands[0]}    ; Банк {operands[0]}")
-                elif instruction in ['JMP', 'JE', 'JNE', 'CALL']:
-                    addr = operands[0]
-                    result.append(f"{instruction} {hex(addr)}    ; Переход на адрес {hex(addr)}")
-                elif instruction in ['SET', 'RND']:
-                    reg = self.registers.get(operands[0], f"R{operands[0]}")
-                    result.append(f"{instruction} {reg} {hex(operands[1])}    ; {reg} = {operands[1]}")
-                elif instruction in ['MOV', 'ADD', 'SUB', 'AND', 'OR', 'XOR', 'CMP', 'MUL', 'DIV']:
-                    reg1 = self.registers.get(operands[0], f"R{operands[0]}")
-                    reg2 = self.registers.get(operands[1], f"R{operands[1]}")
-                    result.append(f"{instruction} {reg1} {reg2}")
-                elif instruction in ['STOREV']:
-                    result.append(f"{instruction} {hex(operands[0])} {hex(operands[1])}    ; MEM[{hex(operands[0])}] = {hex(operands[1])}")
-                elif instruction in ['STORER', 'LOADR']:
-                    reg = self.registers.get(operands[1], f"R{operands[1]}")
-                    result.append(f"{instruction} {hex(operands[0])} {reg}")
-                else:
-                    operands_str = ' '.join(hex(op) for op in operands)
-                    if operands_str:
-                        result.append(f"{instruction} {operands_str}")
-                    else:
-                        result.append(instruction)
-
-                i += 1 + operand_size
-
-            # Записываем результат
+    def disassemble(self, binary_file, output_file=None, section=None, offset=0, length=None, labels=False):
+        try:
             if output_file:
-                with open(output_file, 'w') as f:
-                    f.write('\n'.join(result))
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    for line in self.lines(binary_file, section, offset, length, labels):
+                        f.write(line + '\n')
             else:
-                print('\n'.join(result))
+                for line in self.lines(binary_file, section, offset, length, labels):
+                    print(line)
 
             return True
 
@@ -151,11 +357,34 @@ class Disassembler:
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) < 2:
-        print("Использование: python disassembly.py input.bin [output.asm]")
+    args = sys.argv[1:]
+    usage = ("Использование: python disassembly.py input.bin [output.asm] [--labels] "
+             "[--section <номер секции кассеты>] [--offset <байт>] [--length <байт>]")
+
+    def option(name):
+        if name not in args:
+            return None
+        index = args.index(name)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return int(value, 0)
+
+    labels = '--labels' in args
+    if labels:
+        args.remove('--labels')
+    try:
+        section = option('--section')
+        offset = option('--offset') or 0
+        length = option('--length')
+    except (IndexError, ValueError):
+        print(usage)
+        sys.exit(1)
+    if not 1 <= len(args) <= 2:
+        print(usage)
         sys.exit(1)
 
     disassembler = Disassembler()
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else None
-    disassembler.disassemble(input_file, output_file) 
\ No newline at end of file
+    input_file = args[0]
+    output_file = args[1] if len(args) > 1 else None
+    if not disassembler.disassemble(input_file, output_file, section, offset, length, labels):
+        sys.exit(1)
@@ -0,0 +1,620 @@
+# emulator.py
+import random
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from errors import EmulatorError
+from isa import MNEMONICS, INSTRUCTION_SIZES, DEFAULT_CYCLES
+
+BANK_SIZE = 256
+BANK_COUNT = 8
+MEMORY_SIZE = BANK_SIZE * BANK_COUNT  # 2048 байт
+STACK_SIZE = 256
+NO_KEY = 0xFF  # GETKEY без нажатой клавиши
+
+HALT = -1  # pc после HLT
+CHUNK = 4096  # инструкций между проверками лимита на быстром пути
+
+
+class Halted(Exception):
+    """HLT: остановка выполнения (исключение, чтобы не проверять pc после каждой инструкции)."""
+
+# Причины остановки
+STOP_HALT = 'halt'
+STOP_INSTRUCTIONS = 'instructions'
+STOP_CYCLES = 'cycles'
+
+
+class Display:
+    """Заглушка дисплея: запоминает пиксели, цифры сегментного дисплея и яркость."""
+
+    def __init__(self):
+        self.pixels: Dict[tuple, int] = {}
+        self.digits: Dict[int, int] = {}
+        self.brightness = 0
+        self.clears = 0
+
+    def set_pixel(self, x: int, y: int, brightness: int):
+        self.pixels[(x, y)] = brightness
+
+    def clear_pixel(self, x: int, y: int):
+        self.pixels.pop((x, y), None)
+
+    def digit(self, position: int, value: int):
+        self.digits[position] = value
+
+    def clear(self):
+        self.pixels.clear()
+        self.digits.clear()
+        self.clears += 1
+
+
+class Keypad:
+    """Заглушка клавиатуры: очередь нажатий, которую заполняет вызывающий код."""
+
+    def __init__(self, keys=()):
+        self.keys = deque(keys)
+
+    def read(self) -> int:
+        return self.keys.popleft() if self.keys else NO_KEY
+
+
+class CassetteDevice:
+    """Заглушка кассеты: секции по 256 байт в памяти (None - кассета не вставлена)."""
+
+    def __init__(self, data: Optional[bytes] = None):
+        self.data = bytearray(data) if data is not None else None
+
+    @classmethod
+    def from_file(cls, path) -> 'CassetteDevice':
+        """Кассета собственного формата или pickle-образ."""
+        from cassette import Cassette, is_native
+        if is_native(path):
+            with Cassette(path) as cassette:
+                return cls(cassette.data())
+        import pickle
+        with open(path, 'rb') as f:
+            return cls(bytes(pickle.load(f)['data']))
+
+    def status(self) -> int:
+        return 1 if self.data is not None else 0
+
+    def info(self, kind: int) -> int:
+        """0 - число секций, 1 - размер секции / 16; остальные типы - 0."""
+        if self.data is None:
+            return 0
+        if kind == 0:
+            return min(len(self.data) // BANK_SIZE, 255)
+        if kind == 1:
+            return BANK_SIZE // 16
+        return 0
+
+    def read(self, section: int) -> bytes:
+        start = section * BANK_SIZE
+        if self.data is None or start + BANK_SIZE > len(self.data):
+            raise EmulatorError(f"Секции кассеты {section} нет")
+        return bytes(self.data[start:start + BANK_SIZE])
+
+    def write(self, section: int, chunk: bytes):
+        start = section * BANK_SIZE
+        if self.data is None or start + BANK_SIZE > len(self.data):
+            raise EmulatorError(f"Секции кассеты {section} нет")
+        self.data[start:start + BANK_SIZE] = chunk
+
+
+class RunResult:
+    """Итог запуска: причина остановки, число инструкций и тактов, время."""
+    __slots__ = ('reason', 'instructions', 'cycles', 'seconds')
+
+    def __init__(self, reason: str, instructions: int, cycles: int, seconds: float):
+        self.reason = reason
+        self.instructions = instructions
+        self.cycles = cycles
+        self.seconds = seconds
+
+    def __repr__(self):
+        return f"RunResult({self.reason}, instructions={self.instructions}, cycles={self.cycles})"
+
+
+class Emulator:
+    """Эмулятор VCPU.
+
+    Память - 8 банков по 256 байт, код и данные в общей памяти. Адрес
+    выполнения (pc) полный; переходы и обращения к памяти берут номер банка
+    из регистра банка (BANK). CMP устанавливает флаг ZF, который проверяют
+    JE/JNE. CALL кладёт в стек полный адрес возврата.
+
+    Инструкции декодируются один раз в замыкания (по одному на каждый адрес,
+    с уже подставленными операндами) и хранятся в плоском списке handlers;
+    каждое замыкание выполняет инструкцию и возвращает следующий pc. Запись
+    в память сбрасывает декодированные инструкции, которые её перекрывают.
+    """
+
+    def __init__(self, cycles: Optional[Dict[str, int]] = None, seed: Optional[int] = None,
+                 display: Optional[Display] = None, keypad: Optional[Keypad] = None,
+                 cassette: Optional[CassetteDevice] = None):
+        self.memory = bytearray(MEMORY_SIZE)
+        self.registers = [0] * 7  # R1-R6, индекс 0 не используется
+        self.zf = False
+        self.bank = 0
+        self.pc = 0
+        self.stack: List[int] = []
+        self.key_address: Optional[int] = None  # адрес из SAVKEY
+        self.display = display if display is not None else Display()
+        self.keypad = keypad if keypad is not None else Keypad()
+        self.cassette = cassette if cassette is not None else CassetteDevice()
+        self.random = random.Random(seed)
+        self.cycle_table = dict(DEFAULT_CYCLES)
+        if cycles:
+            self.cycle_table.update(cycles)
+        self._opcode_cycles = [self.cycle_table.get(MNEMONICS[opcode], 1) if opcode in MNEMONICS else 0
+                               for opcode in range(256)]
+        # Заглушки, которые декодируют инструкцию при первом выполнении; последний элемент - страж за концом памяти
+        self._stubs: List[Callable[[], int]] = [self._stub(pc) for pc in range(MEMORY_SIZE)] + [self._out_of_memory]
+        self.handlers: List[Callable[[], int]] = list(self._stubs)
+        self.costs = [0] * (MEMORY_SIZE + 1)
+        self.instructions = 0
+        self.cycles = 0
+        self.hook = None  # функция hook(pc, emulator) перед каждой инструкцией (профилировщик)
+
+    # Загрузка
+
+    def load(self, program: bytes, address: int = 0, data: Optional[bytes] = None, data_address: int = 0):
+        """Загружает программу (и сегмент данных vbin) в память."""
+        if address + len(program) > MEMORY_SIZE:
+            raise EmulatorError(f"Программа ({len(program)} байт) не помещается в память")
+        self.memory[address:address + len(program)] = program
+        if data:
+            self.memory[data_address:data_address + len(data)] = data
+        self._invalidate_all()
+        self.predecode(address, address + len(program))
+        self.pc = address
+
+    def load_file(self, path):
+        """Загружает программу в любом формате вывода ассемблера."""
+        from binformat import read_program
+        code, header = read_program(path)
+        self.load(code, 0, header.get('data'), header.get('data_address', 0))
+        self.pc = header.get('entry', 0)
+
+    def press_key(self, key: int):
+        """Нажатие клавиши: в очередь GETKEY и по адресу SAVKEY, если он задан."""
+        self.keypad.keys.append(key)
+        if self.key_address is not None:
+            self.write(self.key_address, key)
+
+    # Память
+
+    def write(self, address: int, value: int):
+        """Запись байта в память с учётом декодированных инструкций."""
+        self.memory[address] = value & 0xFF
+        self._invalidate(address)
+
+    def _invalidate(self, address: int):
+        # Байт может входить в инструкции, начинающиеся до 3 байт раньше
+        start = max(0, address - 3)
+        self.handlers[start:address + 1] = self._stubs[start:address + 1]
+
+    def _invalidate_all(self):
+        self.handlers[:] = self._stubs
+
+    def predecode(self, start: int = 0, end: int = MEMORY_SIZE):
+        """Декодирует инструкции по всем адресам диапазона (обычно - загруженные банки)."""
+        handlers, costs = self.handlers, self.costs
+        for pc in range(start, end):
+            handlers[pc], costs[pc] = self._decode(pc)
+
+    # Выполнение
+
+    def run(self, max_instructions: Optional[int] = None, max_cycles: Optional[int] = None) -> RunResult:
+        """Выполняет программу до HLT или до исчерпания лимита инструкций или тактов (считая от текущих)."""
+        handlers = self.handlers
+        costs = self.costs
+        pc = self.pc
+        instructions = self.instructions
+        cycles = self.cycles
+        instruction_limit = instructions + max_instructions if max_instructions is not None else None
+        cycle_limit = cycles + max_cycles if max_cycles is not None else None
+        hook = self.hook
+        reason = STOP_INSTRUCTIONS
+        start = time.perf_counter()
+        executed = -1
+        try:
+            if pc < 0:
+                raise Halted
+            if hook is None and cycle_limit is None:
+                # Быстрый путь: проверка лимита раз в CHUNK инструкций, HLT - исключением
+                while instruction_limit is None or instructions < instruction_limit:
+                    count = CHUNK if instruction_limit is None else min(CHUNK, instruction_limit - instructions)
+                    for executed in range(count):
+                        next_pc = handlers[pc]()
+                        cycles += costs[pc]
+                        pc = next_pc
+                    instructions += count
+                    executed = -1
+            else:
+                while instruction_limit is None or instructions < instruction_limit:
+                    if cycle_limit is not None and cycles >= cycle_limit:
+                        reason = STOP_CYCLES
+                        break
+                    if hook is not None:
+                        hook(pc, self)
+                    next_pc = handlers[pc]()
+                    cycles += costs[pc]
+                    instructions += 1
+                    pc = next_pc
+        except Halted:
+            if pc >= 0:
+                cycles += costs[pc]
+                instructions += executed + 1 if executed >= 0 else 1
+            pc = HALT
+            reason = STOP_HALT
+        except EmulatorError:
+            if executed >= 0:
+                instructions += executed
+            raise
+        finally:
+            # При ошибке pc остаётся адресом инструкции, на которой она возникла
+            self.pc = pc
+            self.instructions = instructions
+            self.cycles = cycles
+        return RunResult(reason, instructions, cycles, time.perf_counter() - start)
+
+    def step(self) -> RunResult:
+        """Выполняет одну инструкцию."""
+        return self.run(max_instructions=1)
+
+    @property
+    def halted(self) -> bool:
+        return self.pc < 0
+
+    # Декодирование
+
+    def _out_of_memory(self) -> int:
+        raise EmulatorError(f"Выполнение вышло за пределы памяти ({MEMORY_SIZE} байт)")
+
+    def _stub(self, pc: int) -> Callable[[], int]:
+        def decode_and_run():
+            handler, cost = self._decode(pc)
+            self.handlers[pc] = handler
+            self.costs[pc] = cost
+            return handler()
+        return decode_and_run
+
+    def _decode(self, pc: int):
+        """Обработчик и число тактов инструкции по адресу pc.
+
+        Ошибки декодирования (неверный регистр и т.п.) откладываются до
+        выполнения: по адресу могут лежать данные, а не код.
+        """
+        try:
+            return self._decode_instruction(pc)
+        except EmulatorError as e:
+            error = e
+            def fault():
+                raise error
+            return fault, 0
+
+    def _decode_instruction(self, pc: int):
+        memory = self.memory
+        opcode = memory[pc]
+        size = INSTRUCTION_SIZES[opcode]
+        if size == 0:
+            def unknown():
+                raise EmulatorError(f"Неизвестный опкод {hex(opcode)} по адресу {hex(pc)}")
+            return unknown, 0
+        if pc + size > MEMORY_SIZE:
+            return self._out_of_memory, 0
+        operands = bytes(memory[pc + 1:pc + size])
+        name = MNEMONICS[opcode]
+        return getattr(self, '_op_' + name.lower())(pc, pc + size, *operands), self._opcode_cycles[opcode]
+
+    def _reg(self, pc: int, number: int) -> int:
+        if not 1 <= number <= 6:
+            raise EmulatorError(f"Неверный регистр {number} в инструкции по адресу {hex(pc)}")
+        return number
+
+    # Обработчики инструкций: каждый возвращает замыкание, которое выполняет
+    # инструкцию и возвращает адрес следующей
+
+    def _op_nop(self, pc, nxt):
+        return lambda: nxt
+
+    def _op_hlt(self, pc, nxt):
+        def hlt():
+            raise Halted
+        return hlt
+
+    def _op_set(self, pc, nxt, reg, value):
+        regs, reg = self.registers, self._reg(pc, reg)
+        def set_():
+            regs[reg] = value
+            return nxt
+        return set_
+
+    def _op_mov(self, pc, nxt, dest, source):
+        regs, dest, source = self.registers, self._reg(pc, dest), self._reg(pc, source)
+        def mov():
+            regs[dest] = regs[source]
+            return nxt
+        return mov
+
+    def _alu(self, pc, nxt, dest, source, operation):
+        regs, dest, source = self.registers, self._reg(pc, dest), self._reg(pc, source)
+        def alu():
+            regs[dest] = operation(regs[dest], regs[source]) & 0xFF
+            return nxt
+        return alu
+
+    def _op_add(self, pc, nxt, dest, source):
+        return self._alu(pc, nxt, dest, source, int.__add__)
+
+    def _op_sub(self, pc, nxt, dest, source):
+        return self._alu(pc, nxt, dest, source, int.__sub__)
+
+    def _op_and(self, pc, nxt, dest, source):
+        return self._alu(pc, nxt, dest, source, int.__and__)
+
+    def _op_or(self, pc, nxt, dest, source):
+        return self._alu(pc, nxt, dest, source, int.__or__)
+
+    def _op_xor(self, pc, nxt, dest, source):
+        return self._alu(pc, nxt, dest, source, int.__xor__)
+
+    def _op_mul(self, pc, nxt, dest, source):
+        return self._alu(pc, nxt, dest, source, int.__mul__)
+
+    def _op_div(self, pc, nxt, dest, source):
+        return self._alu(pc, nxt, dest, source, lambda a, b: a // b if b else 0)
+
+    def _op_cmp(self, pc, nxt, first, second):
+        regs, first, second = self.registers, self._reg(pc, first), self._reg(pc, second)
+        def cmp():
+            self.zf = regs[first] == regs[second]
+            return nxt
+        return cmp
+
+    def _op_jmp(self, pc, nxt, addr):
+        def jmp():
+            return self.bank * BANK_SIZE + addr
+        return jmp
+
+    def _op_je(self, pc, nxt, addr):
+        def je():
+            return self.bank * BANK_SIZE + addr if self.zf else nxt
+        return je
+
+    def _op_jne(self, pc, nxt, addr):
+        def jne():
+            return nxt if self.zf else self.bank * BANK_SIZE + addr
+        return jne
+
+    def _op_call(self, pc, nxt, addr):
+        stack = self.stack
+        def call():
+            if len(stack) >= STACK_SIZE:
+                raise EmulatorError(f"Переполнение стека (CALL по адресу {hex(pc)})")
+            stack.append(nxt)
+            return self.bank * BANK_SIZE + addr
+        return call
+
+    def _op_ret(self, pc, nxt):
+        stack = self.stack
+        def ret():
+            if not stack:
+                raise EmulatorError(f"RET с пустым стеком по адресу {hex(pc)}")
+            return stack.pop()
+        return ret
+
+    def _op_push(self, pc, nxt, reg):
+        regs, stack, reg = self.registers, self.stack, self._reg(pc, reg)
+        def push():
+            if len(stack) >= STACK_SIZE:
+                raise EmulatorError(f"Переполнение стека (PUSH по адресу {hex(pc)})")
+            stack.append(regs[reg])
+            return nxt
+        return push
+
+    def _op_pop(self, pc, nxt, reg):
+        regs, stack, reg = self.registers, self.stack, self._reg(pc, reg)
+        def pop():
+            if not stack:
+                raise EmulatorError(f"POP с пустым стеком по адресу {hex(pc)}")
+            regs[reg] = stack.pop() & 0xFF
+            return nxt
+        return pop
+
+    def _op_bank(self, pc, nxt, bank):
+        if bank >= BANK_COUNT:
+            raise EmulatorError(f"Неверный номер банка {bank} по адресу {hex(pc)}")
+        def bank_():
+            self.bank = bank
+            return nxt
+        return bank_
+
+    def _op_storev(self, pc, nxt, addr, value):
+        write = self.write
+        def storev():
+            write(self.bank * BANK_SIZE + addr, value)
+            return nxt
+        return storev
+
+    def _op_storer(self, pc, nxt, addr, reg):
+        regs, write, reg = self.registers, self.write, self._reg(pc, reg)
+        def storer():
+            write(self.bank * BANK_SIZE + addr, regs[reg])
+            return nxt
+        return storer
+
+    def _op_storem(self, pc, nxt, addr, source):
+        memory, write = self.memory, self.write
+        def storem():
+            base = self.bank * BANK_SIZE
+            write(base + addr, memory[base + source])
+            return nxt
+        return storem
+
+    def _op_loadr(self, pc, nxt, reg, addr):
+        regs, memory, reg = self.registers, self.memory, self._reg(pc, reg)
+        def loadr():
+            regs[reg] = memory[self.bank * BANK_SIZE + addr]
+            return nxt
+        return loadr
+
+    def _op_loadrr(self, pc, nxt, reg, addr_reg):
+        regs, memory = self.registers, self.memory
+        reg, addr_reg = self._reg(pc, reg), self._reg(pc, addr_reg)
+        def loadrr():
+            regs[reg] = memory[self.bank * BANK_SIZE + regs[addr_reg]]
+            return nxt
+        return loadrr
+
+    def _op_rnd(self, pc, nxt, reg, limit):
+        regs, randint, reg = self.registers, self.random.randint, self._reg(pc, reg)
+        def rnd():
+            regs[reg] = randint(0, limit)
+            return nxt
+        return rnd
+
+    def _op_setpx(self, pc, nxt, x, y, brightness):
+        regs, display = self.registers, self.display
+        x, y, brightness = self._reg(pc, x), self._reg(pc, y), self._reg(pc, brightness)
+        def setpx():
+            display.set_pixel(regs[x], regs[y], regs[brightness])
+            return nxt
+        return setpx
+
+    def _op_clrpx(self, pc, nxt, x, y):
+        regs, display, x, y = self.registers, self.display, self._reg(pc, x), self._reg(pc, y)
+        def clrpx():
+            display.clear_pixel(regs[x], regs[y])
+            return nxt
+        return clrpx
+
+    def _op_digit(self, pc, nxt, position, value):
+        regs, display = self.registers, self.display
+        position, value = self._reg(pc, position), self._reg(pc, value)
+        def digit():
+            display.digit(regs[position], regs[value])
+            return nxt
+        return digit
+
+    def _op_clear(self, pc, nxt):
+        display = self.display
+        def clear():
+            display.clear()
+            return nxt
+        return clear
+
+    def _op_bright(self, pc, nxt, reg):
+        regs, display, reg = self.registers, self.display, self._reg(pc, reg)
+        def bright():
+            display.brightness = regs[reg]
+            return nxt
+        return bright
+
+    def _op_getkey(self, pc, nxt, reg):
+        regs, keypad, reg = self.registers, self.keypad, self._reg(pc, reg)
+        def getkey():
+            regs[reg] = keypad.read()
+            return nxt
+        return getkey
+
+    def _op_savkey(self, pc, nxt, addr):
+        def savkey():
+            self.key_address = self.bank * BANK_SIZE + addr
+            return nxt
+        return savkey
+
+    def _op_cread(self, pc, nxt, addr_reg, section_reg):
+        regs, cassette = self.registers, self.cassette
+        addr_reg, section_reg = self._reg(pc, addr_reg), self._reg(pc, section_reg)
+        def cread():
+            start = self.bank * BANK_SIZE + regs[addr_reg]
+            chunk = cassette.read(regs[section_reg])[:MEMORY_SIZE - start]
+            self.memory[start:start + len(chunk)] = chunk
+            self._invalidate_all()  # секция может содержать код
+            return nxt
+        return cread
+
+    def _op_cwrite(self, pc, nxt, addr_reg, section_reg):
+        regs, cassette = self.registers, self.cassette
+        addr_reg, section_reg = self._reg(pc, addr_reg), self._reg(pc, section_reg)
+        def cwrite():
+            start = self.bank * BANK_SIZE + regs[addr_reg]
+            chunk = bytes(self.memory[start:start + BANK_SIZE]).ljust(BANK_SIZE, b'\0')
+            cassette.write(regs[section_reg], chunk)
+            return nxt
+        return cwrite
+
+    def _op_cstat(self, pc, nxt, reg):
+        regs, cassette, reg = self.registers, self.cassette, self._reg(pc, reg)
+        def cstat():
+            regs[reg] = cassette.status()
+            return nxt
+        return cstat
+
+    def _op_cinfo(self, pc, nxt, kind_reg, reg):
+        regs, cassette = self.registers, self.cassette
+        kind_reg, reg = self._reg(pc, kind_reg), self._reg(pc, reg)
+        def cinfo():
+            regs[reg] = cassette.info(regs[kind_reg])
+            return nxt
+        return cinfo
+
+    def dump(self) -> str:
+        """Состояние процессора для вывода."""
+        registers = ' '.join(f"R{index}={self.registers[index]}" for index in range(1, 7))
+        return f"{registers} ZF={int(self.zf)} BANK={self.bank} PC={hex(self.pc) if self.pc >= 0 else 'HLT'} стек={len(self.stack)}"
+
+
+if __name__ == "__main__":
+    import sys
+    args = sys.argv[1:]
+    usage = ("Использование: python emulator.py <program> [--max-instructions <n>] [--max-cycles <n>] "
+             "[--cassette <файл>] [--keys <коды через запятую>]")
+
+    def option(name):
+        if name not in args:
+            return None
+        index = args.index(name)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    try:
+        max_instructions = option('--max-instructions')
+        max_cycles = option('--max-cycles')
+        cassette_file = option('--cassette')
+        keys = option('--keys')
+    except IndexError:
+        print(usage)
+        sys.exit(1)
+    if len(args) != 1:
+        print(usage)
+        sys.exit(1)
+
+    emulator = Emulator(
+        keypad=Keypad(int(key) for key in keys.split(',')) if keys else None,
+        cassette=CassetteDevice.from_file(cassette_file) if cassette_file else None,
+    )
+    try:
+        emulator.load_file(args[0])
+    except (OSError, ValueError, EmulatorError) as e:
+        print(f"Ошибка загрузки программы: {e}")
+        sys.exit(1)
+    try:
+        result = emulator.run(int(max_instructions) if max_instructions else None,
+                              int(max_cycles) if max_cycles else None)
+    except EmulatorError as e:
+        print(f"Ошибка выполнения: {e}")
+        print(emulator.dump())
+        sys.exit(1)
+    reasons = {STOP_HALT: 'HLT', STOP_INSTRUCTIONS: 'лимит инструкций', STOP_CYCLES: 'лимит тактов'}
+    print(f"Остановка: {reasons[result.reason]}")
+    print(emulator.dump())
+    speed = result.instructions / result.seconds if result.seconds > 0 else 0
+    print(f"Инструкций: {result.instructions}, тактов: {result.cycles}, {speed / 1e6:.2f} млн инструкций/с")
+    if emulator.display.digits:
+        print(f"Сегментный дисплей: {dict(sorted(emulator.display.digits.items()))}")
@@ -1,3 +1,11 @@
 class CompilationError(Exception):
     """Base class for compilation errors."""
-    pass
\ No newline at end of file
+    pass
+
+class LinkError(CompilationError):
+    """Ошибка компоновки объектных модулей."""
+    pass
+
+class EmulatorError(Exception):
+    """Ошибка выполнения программы в эмуляторе."""
+    pass
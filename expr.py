@@ -0,0 +1,209 @@
+# expr.py
+import functools
+import operator
+import re
+from typing import Callable, FrozenSet, List, Mapping, Union
+
+# Символы, по которым операнд считается выражением, а не именем или числом
+EXPRESSION_CHARS = re.compile(r'[-+*/&|^~()<>]')
+
+_TOKEN = re.compile(r'\s*(?:(0X[0-9A-F]+|[0-9]+)|(<<|>>|[-+*/&|^~()])|([^\s\-+*/&|^~()<>]+))')
+
+
+def _divide(left: int, right: int) -> int:
+    if right == 0:
+        raise ValueError("деление на ноль")
+    return left // right
+
+
+def _shift(function):
+    def shift(left: int, right: int) -> int:
+        if not 0 <= right < 64:
+            raise ValueError(f"недопустимый сдвиг на {right}")
+        return function(left, right)
+    return shift
+
+
+# Двуместные операции по уровням приоритета, от низшего к высшему (как в C)
+BINARY_LEVELS = (
+    {'|': operator.or_},
+    {'^': operator.xor},
+    {'&': operator.and_},
+    {'<<': _shift(operator.lshift), '>>': _shift(operator.rshift)},
+    {'+': operator.add, '-': operator.sub},
+    {'*': operator.mul, '/': _divide},
+)
+UNARY = {'-': operator.neg, '+': operator.pos, '~': operator.invert}
+# Функции от адреса: смещение в банке и номер банка (как Compiler.get_bank_and_addr)
+FUNCTIONS = {'LOW': lambda value: value % 256, 'BANK': lambda value: value // 256}
+
+# Узел дерева: int - число (свёрнутая константа), str - имя константы или метки,
+# кортеж (функция, операнды...) - операция над ещё не известными значениями
+Node = Union[int, str, tuple]
+
+
+class Expression:
+    """Разобранное выражение операнда или .DEFINE.
+
+    Части без имён сворачиваются в числа ещё при разборе, поэтому выражение
+    из одних чисел сразу имеет значение (constant), а остальные вычисляются
+    по таблицам констант и меток.
+    """
+    __slots__ = ('text', 'node', 'names')
+
+    def __init__(self, text: str, node: Node):
+        self.text = text
+        self.node = node
+        self.names: FrozenSet[str] = frozenset(_names(node))
+
+    @property
+    def constant(self) -> bool:
+        return isinstance(self.node, int)
+
+    def evaluate(self, lookup: Callable[[str], int]) -> int:
+        """Значение выражения; lookup(имя) возвращает значение или бросает KeyError."""
+        return _evaluate(self.node, lookup)
+
+    def bind(self, values: Mapping[str, int]) -> 'Expression':
+        """Подставляет известные значения (например, константы в точке использования) и сворачивает."""
+        if not self.names & values.keys():
+            return self
+        return Expression(self.text, _bind(self.node, values))
+
+    def __repr__(self):
+        return f"Expression({self.text!r})"
+
+
+def _names(node: Node):
+    if isinstance(node, str):
+        yield node
+    elif isinstance(node, tuple):
+        for child in node[1:]:
+            yield from _names(child)
+
+
+def _evaluate(node: Node, lookup) -> int:
+    if isinstance(node, int):
+        return node
+    if isinstance(node, str):
+        return lookup(node)
+    return node[0](*[_evaluate(child, lookup) for child in node[1:]])
+
+
+def _bind(node: Node, values: Mapping[str, int]) -> Node:
+    if isinstance(node, str):
+        return values.get(node, node)
+    if isinstance(node, int):
+        return node
+    return _apply(node[0], [_bind(child, values) for child in node[1:]])
+
+
+def _apply(function, children: List[Node]) -> Node:
+    """Операция над узлами: над числами выполняется сразу (свёртка констант)."""
+    if all(isinstance(child, int) for child in children):
+        return function(*children)
+    return (function, *children)
+
+
+class _Parser:
+    """Рекурсивный спуск по токенам выражения."""
+
+    def __init__(self, text: str):
+        self.tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = _TOKEN.match(text, position)
+            if match is None:
+                raise ValueError(f"неожиданный символ '{text[position:].strip()[:1]}'")
+            number, symbol, name = match.groups()
+            if number is not None:
+                self.tokens.append(int(number, 16) if number.startswith('0X') else int(number))
+            else:
+                self.tokens.append(('op', symbol) if symbol is not None else ('name', name))
+            position = match.end()
+        self.index = 0
+
+    def peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("выражение оборвано")
+        self.index += 1
+        return token
+
+    def expect(self, symbol: str):
+        if self.take() != ('op', symbol):
+            raise ValueError(f"ожидается '{symbol}'")
+
+    def parse(self) -> Node:
+        node = self.binary(0)
+        if self.peek() is not None:
+            raise ValueError(f"лишний токен {_describe(self.peek())}")
+        return node
+
+    def binary(self, level: int) -> Node:
+        if level == len(BINARY_LEVELS):
+            return self.unary()
+        operations = BINARY_LEVELS[level]
+        node = self.binary(level + 1)
+        while True:
+            token = self.peek()
+            if not (isinstance(token, tuple) and token[0] == 'op' and token[1] in operations):
+                return node
+            self.index += 1
+            node = _apply(operations[token[1]], [node, self.binary(level + 1)])
+
+    def unary(self) -> Node:
+        token = self.take()
+        if isinstance(token, int):
+            return token
+        kind, value = token
+        if kind == 'op' and value in UNARY:
+            return _apply(UNARY[value], [self.unary()])
+        if kind == 'op' and value == '(':
+            node = self.binary(0)
+            self.expect(')')
+            return node
+        if kind == 'name':
+            if value in FUNCTIONS and self.peek() == ('op', '('):
+                self.index += 1
+                node = self.binary(0)
+                self.expect(')')
+                return _apply(FUNCTIONS[value], [node])
+            return value
+        raise ValueError(f"неожиданный токен {_describe(token)}")
+
+
+def _describe(token) -> str:
+    return f"'{token if isinstance(token, int) else token[1]}'"
+
+
+PARSE_CACHE_SIZE = 4096  # Сколько последних разобранных выражений держать в памяти
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_expression(text: str) -> Expression:
+    """Разбирает выражение (текст в верхнем регистре); ValueError при ошибке.
+
+    Результат запоминается по тексту: одно и то же выражение в программе
+    разбирается и сворачивается один раз. Память ограничена
+    PARSE_CACHE_SIZE выражениями, чтобы не расти в демоне и сессиях правок.
+    """
+    return Expression(text, _Parser(text).parse())
+
+
+def is_expression(operand: str) -> bool:
+    return EXPRESSION_CHARS.search(operand) is not None
+
+
+def operand_names(operand: str) -> FrozenSet[str]:
+    """Имена (константы, метки, регистры), на которые ссылается операнд."""
+    if not is_expression(operand):
+        return frozenset() if operand[:1].isdigit() else frozenset((operand,))
+    try:
+        return parse_expression(operand).names
+    except ValueError:
+        return frozenset()
@@ -0,0 +1,102 @@
+# include_cache.py
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+from lexer import DIRECTIVE, Statement, parse_number
+
+
+class CachedFile:
+    """Разобранный файл .INCLUDE вместе с признаками, по которым проверяется актуальность."""
+    __slots__ = ('mtime', 'size', 'statements', 'guard')
+
+    def __init__(self, mtime: int, size: int, statements: List[Statement], guard: Optional[str]):
+        self.mtime = mtime
+        self.size = size
+        self.statements = statements  # записи файла; вложенные .INCLUDE не раскрыты
+        self.guard = guard            # символ защиты от повторного включения или None
+
+
+class IncludeCache:
+    """Кэш разобранных файлов для .INCLUDE: путь -> записи (проверка по mtime и размеру)."""
+
+    def __init__(self):
+        self.files: Dict[str, CachedFile] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def load(self, path: str, lex) -> CachedFile:
+        """Возвращает записи файла; файл читается и разбирается через lex только при изменении.
+
+        FileNotFoundError пробрасывается вызывающему.
+        """
+        stat = os.stat(path)
+        key = os.path.normcase(path)
+        entry = self.files.get(key)
+        if entry is not None and entry.mtime == stat.st_mtime_ns and entry.size == stat.st_size:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        statements = apply_pragma_once(lex(lines, path), key)
+        entry = CachedFile(stat.st_mtime_ns, stat.st_size, statements, find_include_guard(statements))
+        self.files[key] = entry
+        return entry
+
+
+def apply_pragma_once(statements: List[Statement], key: str) -> List[Statement]:
+    """Заменяет .PRAGMA ONCE обёрткой .IFNDEF/.DEFINE/.ENDIF с уникальным символом."""
+    pragmas = [stmt for stmt in statements
+               if stmt.kind == DIRECTIVE and stmt.name == '.PRAGMA' and stmt.operands == ('ONCE',)]
+    if not pragmas:
+        return statements
+
+    first = pragmas[0]
+    symbol = '__ONCE_' + hashlib.md5(key.encode('utf-8')).hexdigest()[:12].upper()
+    body = [stmt for stmt in statements if stmt not in pragmas]
+    last_line = statements[-1].line
+
+    def directive(name, operands, line):
+        return Statement(DIRECTIVE, name, None, operands, 0, first.file, line, first.text)
+
+    return ([directive('.IFNDEF', (symbol,), first.line),
+             directive('.DEFINE', (symbol, '1'), first.line)]
+            + body
+            + [directive('.ENDIF', (), last_line)])
+
+
+def find_include_guard(statements: List[Statement]) -> Optional[str]:
+    """Находит защиту вида .IFNDEF X / .DEFINE X n / ... / .ENDIF на весь файл.
+
+    Если файл целиком закрыт такой защитой, то после первого безусловного
+    включения все последующие ничего не добавляют в программу.
+    """
+    if len(statements) < 3:
+        return None
+    first, last = statements[0], statements[-1]
+    if first.kind != DIRECTIVE or first.name != '.IFNDEF' or len(first.operands) != 1:
+        return None
+    if last.kind != DIRECTIVE or last.name != '.ENDIF':
+        return None
+
+    symbol = first.operands[0]
+    depth = 0
+    defines_guard = False
+    for stmt in statements[1:-1]:
+        if stmt.kind != DIRECTIVE:
+            continue
+        if stmt.name == '.IFNDEF':
+            depth += 1
+        elif stmt.name == '.ENDIF':
+            if depth == 0:
+                return None  # защита закрывается раньше конца файла
+            depth -= 1
+        elif stmt.name == '.DEFINE' and depth == 0 and len(stmt.operands) == 2 and stmt.operands[0] == symbol:
+            try:
+                parse_number(stmt.operands[1])
+            except ValueError:
+                continue
+            defines_guard = True
+    return symbol if depth == 0 and defines_guard else None
@@ -0,0 +1,124 @@
+# isa.py
+from typing import Dict, Tuple
+
+# Таблица опкодов инструкций VCPU
+OPCODES: Dict[str, int] = {
+    'NOP':    0x00,
+    'SET':    0x01,
+    'MOV':    0x02,
+    'ADD':    0x03,
+    'SUB':    0x04,
+    'AND':    0x05,
+    'OR':     0x06,
+    'XOR':    0x07,
+    'JMP':    0x08,
+    'STOREV': 0x09,
+    'STORER': 0x0A,
+    'STOREM': 0x0B,
+    'LOADR':  0x0C,
+    'JE':     0x0D,
+    'JNE':    0x0E,
+    'CMP':    0x0F,
+    'PUSH':   0x10,
+    'POP':    0x11,
+    'MUL':    0x12,
+    'DIV':    0x13,
+    'SETPX':  0x14,    # Установить пиксель (x, y)
+    'CLRPX':  0x15,    # Очистить пиксель (x, y)
+    'DIGIT':  0x16,    # Вывести число на сегментный дисплей (позиция, значение)
+    'CLEAR':  0x17,    # Очистить весь дисплей
+    'GETKEY': 0x18,    # Чтение клавиши
+    'CALL':   0x19,    # Вызов подпрограммы
+    'RET':    0x1A,
+    'RND':    0x1B,    # Случайное число в регистр
+    'BANK':   0x1C,    # Переключение банка
+    'SAVKEY': 0x1D,
+    'BRIGHT': 0x1E,    # Установка яркости
+    'LOADRR': 0x1F,
+    'CREAD':  0x20,    # Чтение секции кассеты
+    'CWRITE': 0x21,    # Запись секции кассеты
+    'CSTAT':  0x22,    # Проверка статуса кассеты
+    'CINFO':  0x23,    # Получение информации о кассете
+    'HLT':    0xFF,
+}
+
+# Обратная таблица: опкод -> мнемоника
+MNEMONICS: Dict[int, str] = {opcode: name for name, opcode in OPCODES.items()}
+
+# Регистры
+REGISTERS: Dict[str, int] = {
+    'R1': 0x01,
+    'R2': 0x02,
+    'R3': 0x03,
+    'R4': 0x04,
+    'R5': 0x05,
+    'R6': 0x06,
+}
+REGISTER_NAMES: Dict[int, str] = {code: name for name, code in REGISTERS.items()}
+
+# Виды операндов
+REG = 'reg'      # номер регистра
+VALUE = 'value'  # непосредственное значение (байт)
+ADDR = 'addr'    # адрес в текущем банке (байт)
+BANK_NUMBER = 'bank'
+
+# Операнды каждой инструкции по порядку
+OPERANDS: Dict[str, Tuple[str, ...]] = {
+    'NOP':    (),
+    'SET':    (REG, VALUE),
+    'MOV':    (REG, REG),
+    'ADD':    (REG, REG),
+    'SUB':    (REG, REG),
+    'AND':    (REG, REG),
+    'OR':     (REG, REG),
+    'XOR':    (REG, REG),
+    'JMP':    (ADDR,),
+    'STOREV': (ADDR, VALUE),
+    'STORER': (ADDR, REG),
+    'STOREM': (ADDR, ADDR),    # MEM[первый] = MEM[второй]
+    'LOADR':  (REG, ADDR),
+    'JE':     (ADDR,),
+    'JNE':    (ADDR,),
+    'CMP':    (REG, REG),
+    'PUSH':   (REG,),
+    'POP':    (REG,),
+    'MUL':    (REG, REG),
+    'DIV':    (REG, REG),
+    'SETPX':  (REG, REG, REG),  # x, y, яркость
+    'CLRPX':  (REG, REG),
+    'DIGIT':  (REG, REG),       # позиция, значение
+    'CLEAR':  (),
+    'GETKEY': (REG,),
+    'CALL':   (ADDR,),
+    'RET':    (),
+    'RND':    (REG, VALUE),     # регистр, максимум
+    'BANK':   (BANK_NUMBER,),
+    'SAVKEY': (ADDR,),
+    'BRIGHT': (REG,),
+    'LOADRR': (REG, REG),       # регистр, регистр с адресом
+    'CREAD':  (REG, REG),       # адрес в памяти, номер секции
+    'CWRITE': (REG, REG),
+    'CSTAT':  (REG,),
+    'CINFO':  (REG, REG),       # тип информации, регистр результата
+    'HLT':    (),
+}
+
+# Число байт операндов каждой инструкции
+OPERAND_SIZES: Dict[str, int] = {name: len(operands) for name, operands in OPERANDS.items()}
+
+# Размер инструкции по опкоду (0 - неизвестный опкод); таблица на все 256 байт
+INSTRUCTION_SIZES: Tuple[int, ...] = tuple(
+    1 + OPERAND_SIZES[MNEMONICS[opcode]] if opcode in MNEMONICS else 0 for opcode in range(256)
+)
+
+JUMPS = ('JMP', 'JE', 'JNE', 'CALL')
+
+# Такты по умолчанию: выборка опкода и операндов, плюс обращения к памяти и устройствам
+DEFAULT_CYCLES: Dict[str, int] = {name: 1 + size for name, size in OPERAND_SIZES.items()}
+DEFAULT_CYCLES.update({
+    'STOREV': 4, 'STORER': 4, 'STOREM': 4, 'LOADR': 4, 'LOADRR': 4,
+    'PUSH': 3, 'POP': 3, 'CALL': 4, 'RET': 3,
+    'MUL': 4, 'DIV': 8,
+    'SETPX': 6, 'CLRPX': 5, 'DIGIT': 5, 'CLEAR': 16,
+    'CREAD': 256, 'CWRITE': 256,
+})
@@ -1,3 +1,45 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+from errors import CompilationError
+from expr import EXPRESSION_CHARS, is_expression, parse_expression
+from isa import OPERANDS, REGISTERS, REG
+
+# Виды записей промежуточного представления
+LABEL = 0
+DIRECTIVE = 1
+INSTRUCTION = 2
+
+# Для каждой инструкции: какие операнды должны быть регистрами (по схеме isa.OPERANDS)
+REGISTER_SLOTS: Dict[str, Tuple[bool, ...]] = {
+    name: tuple(kind == REG for kind in kinds) for name, kinds in OPERANDS.items()
+}
+_is_register = REGISTERS.__contains__
+
+
+class Statement:
+    """Запись промежуточного представления: одна значимая строка исходника."""
+    __slots__ = ('kind', 'name', 'opcode', 'operands', 'size', 'file', 'line', 'text')
+
+    def __init__(self, kind: int, name: str, opcode: Optional[int], operands: Tuple[str, ...],
+                 size: int, file: str, line: int, text: str):
+        self.kind = kind          # LABEL, DIRECTIVE или INSTRUCTION
+        self.name = name          # имя метки, директивы (.DB) или мнемоника
+        self.opcode = opcode      # опкод инструкции или None
+        self.operands = operands  # уже разобранные операнды
+        self.size = size          # размер в байтах машинного кода
+        self.file = file
+        self.line = line
+        self.text = text          # исходная строка без комментария
+
+    def location(self) -> str:
+        """Возвращает место в исходнике для сообщений об ошибках."""
+        return f"{os.path.basename(self.file)}, строка {self.line}"
+
+    def __repr__(self):
+        return f"Statement({self.name!r}, {self.operands!r}, {self.location()!r})"
+
+
 def preprocess_line(line):
     """Удаляет комментарии и лишние пробелы."""
     line = line.split(';')[0].strip()
@@ -5,4 +47,117 @@ def preprocess_line(line):
 
 def tokenize_line(line):
     """Разделяет строку на токены."""
-    return line.upper().split()
\ No newline at end of file
+    return line.upper().split()
+
+def split_operands(text: str) -> Tuple[str, ...]:
+    """Операнды после мнемоники или директивы: по пробелам, но выражение в скобках - один операнд."""
+    parts = text.split()[1:]
+    if '(' not in text:
+        return tuple(parts)
+    operands = []
+    depth = 0
+    for part in parts:
+        if depth > 0:
+            operands[-1] += ' ' + part
+        else:
+            operands.append(part)
+        depth += part.count('(') - part.count(')')
+    return tuple(operands)
+
+def check_expressions(operands, file: str, line_num: int, text: str):
+    """Разбирает выражения среди операндов (разбор запоминается), чтобы ошибка указывала на строку."""
+    for operand in operands:
+        if is_expression(operand):
+            try:
+                parse_expression(operand)
+            except ValueError as e:
+                raise CompilationError(
+                    f"{os.path.basename(file)}, строка {line_num}: Ошибка в выражении {operand}: {e}\n{text}"
+                )
+
+def parse_number(token):
+    """Разбирает десятичное или шестнадцатеричное (0X..) число; ValueError при ошибке."""
+    return int(token, 16) if token.startswith('0X') else int(token)
+
+def check_operands(name: str, operands: Tuple[str, ...], file: str, line_num: int, text: str):
+    """Проверяет число операндов и то, что регистры стоят ровно на местах регистров.
+
+    Значения и адреса здесь не проверяются: константа или метка станет
+    известна только при генерации кода.
+    """
+    slots = REGISTER_SLOTS.get(name)
+    if slots is None:
+        return  # инструкция не из isa (своя таблица опкодов)
+    if len(operands) != len(slots):
+        hint = ""
+        if any(is_expression(operand) for operand in operands):
+            hint = "\nПодсказка: выражение с пробелами заключите в скобки, например (TABLE + 1)"
+        raise CompilationError(
+            f"{os.path.basename(file)}, строка {line_num}: Инструкция {name} принимает операндов: {len(slots)}, "
+            f"указано: {len(operands)}\n{text}{hint}"
+        )
+    for index, (register, operand) in enumerate(zip(slots, operands), 1):
+        if register != (operand in REGISTERS):
+            expected = f"регистром ({', '.join(REGISTERS)})" if register else "значением или адресом, а не регистром"
+            raise CompilationError(
+                f"{os.path.basename(file)}, строка {line_num}: Операнд {index} инструкции {name} ({operand}) "
+                f"должен быть {expected}\n{text}"
+            )
+
+def lex_line(line: str, opcodes: Dict[str, int], file: str, line_num: int, check: bool = True) -> Optional[Statement]:
+    """Превращает строку исходника в запись Statement (или None для пустой строки).
+
+    check=False - не проверять регистры и число операндов (тело .MACRO:
+    они проверяются после подстановки аргументов).
+    """
+    text = preprocess_line(line)
+    if not text:
+        return None
+
+    if text.startswith(':'):
+        return Statement(LABEL, text[1:].strip().upper(), None, (), 0, file, line_num, text)
+
+    parts = text.split()
+    name = parts[0].upper()
+
+    if name.startswith('.'):
+        if name == '.INCLUDE':
+            # Путь к файлу не переводим в верхний регистр
+            operands = (' '.join(parts[1:]).strip().strip('"'),)
+            size = 0
+        elif name == '.DB':
+            values = ' '.join(parts[1:]).upper().split(',')
+            operands = tuple(value.strip().strip('"') for value in values)
+            check_expressions(operands, file, line_num, text)
+            size = 3 * len(operands)  # STOREV адрес значение на каждый байт
+        elif name == '.EXPORT':
+            operands = tuple(' '.join(parts[1:]).upper().replace(',', ' ').split())
+            size = 0
+        else:
+            operands = split_operands(text.upper())
+            if name == '.DEFINE':
+                check_expressions(operands[1:], file, line_num, text)
+            size = 0
+        return Statement(DIRECTIVE, name, None, operands, size, file, line_num, text)
+
+    operands = tuple(text.upper().split()[1:]) if '(' not in text else split_operands(text.upper())
+    opcode = opcodes.get(name)
+    # Быстрая проверка: совпадают ли места регистров со схемой; подробности - в check_operands
+    if check and opcode is not None and tuple(map(_is_register, operands)) != REGISTER_SLOTS.get(name, ()):
+        check_operands(name, operands, file, line_num, text)
+    if EXPRESSION_CHARS.search(text):
+        check_expressions(operands, file, line_num, text)
+    size = 1 + len(operands) if opcode is not None else 0
+    return Statement(INSTRUCTION, name, opcode, operands, size, file, line_num, text)
+
+def lex_lines(lines, opcodes: Dict[str, int], file: str) -> List[Statement]:
+    """Лексический разбор всех строк файла за один проход."""
+    statements = []
+    check = True
+    for line_num, line in enumerate(lines, 1):
+        stmt = lex_line(line, opcodes, file, line_num, check)
+        if stmt is not None:
+            statements.append(stmt)
+            if stmt.kind == DIRECTIVE and stmt.name in ('.MACRO', '.ENDM'):
+                check = stmt.name == '.ENDM'
+    return statements
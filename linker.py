@@ -0,0 +1,101 @@
+# linker.py
+from typing import Dict, List, Tuple
+
+from errors import LinkError
+from objfile import ObjectModule
+from code_generator import FIXUP_JUMP, FIXUP_BYTE, FIXUP_BANK, FIXUP_DATA
+
+BANK_SIZE = 256
+
+
+def place_modules(modules: List[ObjectModule], data_start: int) -> Tuple[List[int], List[int], int]:
+    """Назначает модулям адреса кода и данных.
+
+    Модуль, который помещается в банк, не разрезается границей банка:
+    при нехватке места он начинается со следующего банка.
+    Возвращает базы кода, сдвиги данных и общий размер программы.
+    """
+    bases = []
+    data_shifts = []
+    address = 0
+    data_address = data_start
+    for module in modules:
+        size = len(module.code)
+        offset = address % BANK_SIZE
+        if offset and size <= BANK_SIZE and offset + size > BANK_SIZE:
+            address += BANK_SIZE - offset
+        bases.append(address)
+        address += size
+        data_shifts.append(data_address - data_start)
+        data_address += module.data_size
+    return bases, data_shifts, address
+
+
+def link(modules: List[ObjectModule], data_start: int) -> Tuple[List[int], Dict[str, int]]:
+    """Компонует модули в одну программу.
+
+    Возвращает машинный код и таблицу экспортированных меток с итоговыми адресами.
+    """
+    bases, data_shifts, size = place_modules(modules, data_start)
+    machine_code = [0x00] * size  # промежутки между модулями заполняются NOP
+    for module, base in zip(modules, bases):
+        machine_code[base:base + len(module.code)] = module.code
+
+    exported: Dict[str, int] = {}
+    for module, base in zip(modules, bases):
+        for name in module.exports:
+            if name in exported:
+                raise LinkError(f"{module.name}: Метка {name} экспортируется несколькими модулями")
+            exported[name] = base + module.symbols[name]
+
+    errors = []
+    for module, base, data_shift in zip(modules, bases, data_shifts):
+        def resolve(symbol, reloc):
+            if symbol in module.symbols:
+                return base + module.symbols[symbol]
+            if symbol in exported:
+                return exported[symbol]
+            raise LinkError(f"{reloc.location}: Неопределённая метка {symbol}\n{reloc.text}")
+
+        for reloc in module.relocations:
+            position = base + reloc.offset
+            kind = reloc.kind
+            addr = reloc.addend if reloc.symbol is None else resolve(reloc.symbol, reloc)
+
+            if kind == FIXUP_JUMP:
+                bank = addr // BANK_SIZE
+                if reloc.bank is None:
+                    current_bank = position // BANK_SIZE  # банк, в котором выполняется переход
+                elif isinstance(reloc.bank, str):
+                    current_bank = resolve(reloc.bank, reloc) // BANK_SIZE
+                else:
+                    current_bank = reloc.bank
+                if bank != current_bank and not reloc.after_bank:
+                    errors.append(
+                        f"{reloc.location}: Переход на адрес в другом банке без указания BANK\n"
+                        f"{reloc.text}\n"
+                        f"Подсказка: Добавьте перед этой строкой:\n"
+                        f"BANK {bank}"
+                    )
+                machine_code[position] = addr % BANK_SIZE
+            elif kind == FIXUP_BANK:
+                machine_code[position] = addr // BANK_SIZE
+            elif kind == FIXUP_DATA:
+                addr += data_shift
+                if addr > 255:
+                    raise LinkError(f"{reloc.location}: Данные .DB модулей не помещаются в память (адрес {hex(addr)})")
+                machine_code[position] = addr
+            elif kind == FIXUP_BYTE:
+                if addr > 255:
+                    raise LinkError(
+                        f"{reloc.location}: Адрес метки {reloc.symbol} ({hex(addr)}) превышает размер банка\n"
+                        f"{reloc.text}"
+                    )
+                machine_code[position] = addr
+
+    if errors:
+        message = '\n\n'.join(errors)
+        if len(errors) > 1:
+            message += f"\n\nВсего переходов без BANK: {len(errors)}"
+        raise LinkError(message)
+    return machine_code, exported
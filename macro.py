@@ -0,0 +1,265 @@
+# macro.py
+import re
+from typing import Dict, List, Optional, Tuple
+
+from errors import CompilationError
+from expr import is_expression, operand_names, parse_expression
+from isa import REGISTERS
+from lexer import LABEL, DIRECTIVE, INSTRUCTION, Statement, check_operands, parse_number
+
+MAX_DEPTH = 64  # вложенность раскрытия (защита от макроса, вызывающего сам себя)
+MAX_REPEAT = 65536  # повторений .REPT (опечатка в числе не должна подвешивать сборку или демон)
+LOCAL_SEPARATOR = '@'  # метка тела блока получает номер раскрытия: LOOP -> LOOP@3
+
+# Директивы блоков: открывающая -> закрывающая
+OPENERS = {'.MACRO': '.ENDM', '.REPT': '.ENDR'}
+CLOSERS = {closer: opener for opener, closer in OPENERS.items()}
+BLOCK_DIRECTIVES = frozenset(OPENERS) | frozenset(CLOSERS)
+
+_NAME = re.compile(r'[^\s\-+*/&|^~()<>]+')  # имя или число внутри выражения
+
+
+def is_local_label(name: str) -> bool:
+    """Метка получена раскрытием макроса или .REPT."""
+    return LOCAL_SEPARATOR in name
+
+
+class Template:
+    """Тело блока: записи, разобранные лексером один раз, и где в них нужна подстановка.
+
+    names - имена, заменяемые при раскрытии (параметры, номер повторения);
+    к ним добавляются метки, объявленные в теле.
+    """
+
+    def __init__(self, body: List[Statement], names: Tuple[str, ...]):
+        self.body = body
+        self.locals = tuple(dict.fromkeys(stmt.name for stmt in body if stmt.kind == LABEL))
+        replaced = set(names) | set(self.locals)
+        # Для каждой записи: нужна ли подстановка (остальные только копируются)
+        self.substituted = [
+            stmt.name in replaced if stmt.kind == LABEL else
+            stmt.name != '.INCLUDE' and any(operand_names(operand) & replaced for operand in stmt.operands)
+            for stmt in body
+        ]
+
+    def parts(self, mapping: Dict[str, str], call: Optional[Statement] = None) -> List[Tuple]:
+        """Записи тела после подстановки: (запись тела, имя, операнды, текст).
+
+        call - вызов макроса: операнды инструкций проверяются после подстановки
+        (в теле .MACRO лексер их не проверял - регистр может прийти аргументом).
+        """
+        parts = []
+        for stmt, substituted in zip(self.body, self.substituted):
+            if not substituted:
+                parts.append((stmt, stmt.name, stmt.operands, stmt.text))
+            elif stmt.kind == LABEL:
+                name = mapping.get(stmt.name, stmt.name)
+                parts.append((stmt, name, (), ':' + name))
+            else:
+                operands = tuple(_substitute(operand, mapping) for operand in stmt.operands)
+                separator = ', ' if stmt.name == '.DB' else ' '
+                parts.append((stmt, stmt.name, operands, ' '.join((stmt.name, separator.join(operands))).rstrip()))
+        if call is not None:
+            for stmt, name, operands, text in parts:
+                if stmt.kind == INSTRUCTION and stmt.opcode is not None:
+                    check_operands(name, operands, call.file, call.line, text)
+        return parts
+
+
+def _substitute(operand: str, mapping: Dict[str, str]) -> str:
+    value = mapping.get(operand)
+    if value is not None:
+        return value
+    if not is_expression(operand):
+        return operand
+
+    def replace(match):
+        value = mapping.get(match.group(0))
+        if value is None:
+            return match.group(0)
+        return f"({value})" if is_expression(value) else value  # аргумент-выражение сохраняет приоритет
+    return _NAME.sub(replace, operand)
+
+
+def _instantiate(parts, file: Optional[str] = None, line: Optional[int] = None) -> List[Statement]:
+    """Новые записи по частям шаблона; file и line - место вызова макроса (для .REPT - строки тела)."""
+    return [Statement(stmt.kind, name, stmt.opcode, operands, stmt.size,
+                      stmt.file if file is None else file, stmt.line if line is None else line, text)
+            for stmt, name, operands, text in parts]
+
+
+class Macro:
+    """Макрос .MACRO: параметры, шаблон тела и раскрытия по аргументам (для тел без меток)."""
+
+    def __init__(self, name: str, params: Tuple[str, ...], body: List[Statement], stmt: Statement):
+        self.name = name
+        self.params = params
+        self.template = Template(body, params)
+        self.stmt = stmt
+        self.instances: Dict[Tuple[str, ...], List[Tuple]] = {}
+
+
+class Block:
+    """Записываемый блок .MACRO или .REPT (до парной закрывающей директивы)."""
+
+    def __init__(self, opener: Statement):
+        self.opener = opener
+        self.body: List[Statement] = []
+        self.nested: List[str] = []  # открытые внутри тела блоки (записываются как есть)
+
+
+class MacroExpander:
+    """Раскрытие .MACRO/.ENDM и .REPT/.ENDR в записях после лексического разбора.
+
+    Тела блоков не разбираются заново: записи тела копируются с подстановкой
+    аргументов, номера повторения и уникальных имён меток. Для числа
+    повторений .REPT ведётся своя таблица констант - .DEFINE и .IFNDEF
+    учитываются так же, как в первом проходе (метки ещё не известны).
+    """
+
+    def __init__(self, opcodes: Dict[str, int], predefines: Dict[str, int]):
+        self.opcodes = opcodes
+        self.macros: Dict[str, Macro] = {}
+        self.defines: Dict[str, Optional[int]] = dict(predefines)  # None - значение зависит от меток
+        self.conditions: List[bool] = []
+        self.block: Optional[Block] = None
+        self.blocks: List[Tuple[str, int, int]] = []  # (файл, первая и последняя строка) записанных блоков
+        self.expansions = 0  # номер для меток очередного раскрытия
+        self.depth = 0
+
+    @property
+    def active(self) -> bool:
+        return all(self.conditions)
+
+    def track(self, stmt: Statement):
+        """Учитывает .DEFINE, .IFNDEF и .ENDIF вне блоков."""
+        if stmt.name == '.IFNDEF' and len(stmt.operands) == 1:
+            self.conditions.append(stmt.operands[0] not in self.defines)
+        elif stmt.name == '.ENDIF' and self.conditions:
+            self.conditions.pop()
+        elif stmt.name == '.DEFINE' and len(stmt.operands) == 2 and self.active:
+            name, value = stmt.operands
+            try:
+                self.defines[name] = self._value(value)
+            except (KeyError, ValueError):
+                self.defines[name] = None
+
+    def _value(self, value: str) -> int:
+        """Значение числа, константы или выражения из констант; KeyError - имя без известного значения."""
+        try:
+            return parse_number(value)
+        except ValueError:
+            return parse_expression(value).evaluate(self._constant)
+
+    def _constant(self, name: str) -> int:
+        value = self.defines[name]
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def open(self, stmt: Statement):
+        """Открывает блок по .MACRO или .REPT; лишняя .ENDM или .ENDR - ошибка."""
+        if stmt.name in CLOSERS:
+            raise CompilationError(f"{stmt.location()}: Директива {stmt.name} без соотв. {CLOSERS[stmt.name]}")
+        self.block = Block(stmt)
+
+    def record(self, stmt: Statement) -> Optional[List[Statement]]:
+        """Добавляет запись в открытый блок; когда блок закрыт, возвращает записи для раскрытия."""
+        block = self.block
+        if stmt.kind == DIRECTIVE and stmt.name in BLOCK_DIRECTIVES:
+            if stmt.name in OPENERS:
+                if stmt.name == '.MACRO':
+                    raise CompilationError(f"{stmt.location()}: .MACRO внутри {block.opener.name} не поддерживается")
+                block.nested.append(stmt.name)
+            elif block.nested:
+                opener = block.nested.pop()
+                if OPENERS[opener] != stmt.name:
+                    raise CompilationError(f"{stmt.location()}: Директива {stmt.name} без соотв. {CLOSERS[stmt.name]}")
+            elif OPENERS[block.opener.name] != stmt.name:
+                raise CompilationError(f"{stmt.location()}: Директива {stmt.name} без соотв. {CLOSERS[stmt.name]}")
+            else:
+                self.block = None
+                if self.depth == 0:
+                    self.blocks.append((block.opener.file, block.opener.line, stmt.line))
+                if block.opener.name == '.MACRO':
+                    self._define(block)
+                    return None
+                return self._repeat(block)
+        block.body.append(stmt)
+        return None
+
+    def finish(self, file: Optional[str] = None):
+        """Проверяет, что блок, открытый в файле file (или любой), закрыт."""
+        block = self.block
+        if block is not None and (file is None or block.opener.file == file):
+            raise CompilationError(f"{block.opener.location()}: Незакрытая директива {block.opener.name}")
+
+    def _define(self, block: Block):
+        stmt = block.opener
+        if not stmt.operands:
+            raise CompilationError(f"{stmt.location()}: Неверный формат .MACRO\n{stmt.text}")
+        name, params = stmt.operands[0], stmt.operands[1:]
+        if name in self.opcodes or name in REGISTERS:
+            raise CompilationError(f"{stmt.location()}: Имя макроса {name} совпадает с инструкцией или регистром\n{stmt.text}")
+        for param in params:
+            if param in REGISTERS or is_expression(param) or param[:1].isdigit() or params.count(param) > 1:
+                raise CompilationError(f"{stmt.location()}: Неверный параметр макроса {name}: {param}\n{stmt.text}")
+        if self.active:
+            self.macros[name] = Macro(name, params, block.body, stmt)
+
+    def _repeat(self, block: Block) -> List[Statement]:
+        stmt = block.opener
+        if len(stmt.operands) not in (1, 2):
+            raise CompilationError(f"{stmt.location()}: Неверный формат .REPT (.REPT <число> [<имя номера>])\n{stmt.text}")
+        if not self.active:
+            return []  # блок не попадёт в сборку
+        try:
+            count = self._value(stmt.operands[0])
+        except (KeyError, ValueError):
+            count = -1
+        if not 0 <= count <= MAX_REPEAT:
+            raise CompilationError(
+                f"{stmt.location()}: Число повторений .REPT должно быть константой от 0 до {MAX_REPEAT}: {stmt.operands[0]}\n"
+                f"{stmt.text}"
+            )
+        self._check_depth(stmt)
+        index = stmt.operands[1:]
+        template = Template(block.body, index)
+        if not index and not template.locals:
+            return _instantiate(template.parts({}) * count)  # все повторения одинаковы
+        statements = []
+        for number in range(count):
+            mapping = {index[0]: str(number)} if index else {}
+            statements += _instantiate(template.parts(self._locals(template, mapping)))
+        return statements
+
+    def call(self, stmt: Statement) -> List[Statement]:
+        """Записи раскрытия вызова макроса (на месте вызова)."""
+        macro = self.macros[stmt.name]
+        if len(stmt.operands) != len(macro.params):
+            raise CompilationError(
+                f"{stmt.location()}: Макрос {macro.name} принимает аргументов: {len(macro.params)}, "
+                f"указано: {len(stmt.operands)}\n{stmt.text}"
+            )
+        self._check_depth(stmt)
+        template = macro.template
+        if template.locals:
+            parts = template.parts(self._locals(template, dict(zip(macro.params, stmt.operands))), stmt)
+        else:
+            # Без меток раскрытие зависит только от аргументов
+            parts = macro.instances.get(stmt.operands)
+            if parts is None:
+                parts = macro.instances[stmt.operands] = template.parts(dict(zip(macro.params, stmt.operands)), stmt)
+        return _instantiate(parts, stmt.file, stmt.line)
+
+    def _locals(self, template: Template, mapping: Dict[str, str]) -> Dict[str, str]:
+        """Добавляет к подстановке уникальные имена меток тела; номер расходуется, только если метки есть."""
+        if template.locals:
+            self.expansions += 1
+            for label in template.locals:
+                mapping[label] = f"{label}{LOCAL_SEPARATOR}{self.expansions}"
+        return mapping
+
+    def _check_depth(self, stmt: Statement):
+        if self.depth >= MAX_DEPTH:
+            raise CompilationError(f"{stmt.location()}: Слишком глубокая вложенность макросов и .REPT (больше {MAX_DEPTH})")
@@ -1,9 +1,179 @@
-from compiler import Compiler
+from compiler import Compiler, DATA_START_ADDRESS
+from tracing import Tracer, CATEGORIES, DEBUG
+from build_cache import BuildCache
+from objfile import load_object
+from linker import link
+from batch import parse_manifest, jobs_from_glob, run_batch, format_summary
+from binformat import FORMATS, FORMAT_HEX, FORMAT_VBIN
+from lexer import parse_number
+import os
 import sys
+import time
 
-def main():
-    if len(sys.argv) < 3:
-        print("Использование: python main.py [--cassette <section_number>] <output_file> <input_file>")
+USAGE = ("Использование: python main.py [--single-pass] [--stats] [--no-cache] [--trace <категории>] [--trace-level <n>] "
+         "[-D <ИМЯ>=<значение>] [-O] [--auto-bank] [--format hex|bin|vbin] [--data-segment] [--debug-map <файл>] [--cassette <section_number>] <output_file> <input_file>\n"
+         "       python main.py --object <output.vobj> <input_file>\n"
+         "       python main.py --link [--format hex|bin|vbin] <output_file> <module.vobj> [<module.vobj> ...]\n"
+         "       python main.py --batch <манифест|маска> [--jobs <n>] [--format hex|bin|vbin] [--single-pass] [--no-cache]\n"
+         "       python main.py --cache-stats\n"
+         "Опция --no-daemon выполняет сборку в этом процессе, даже если запущен демон (daemon.py)")
+
+def pop_option(args, name):
+    """Удаляет из args опцию со значением и возвращает значение (или None)."""
+    if name not in args:
+        return None
+    index = args.index(name)
+    if index + 1 >= len(args):
+        raise ValueError(name)
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
+def link_objects(output_file, object_files, tracer, output_format=FORMAT_HEX):
+    """Компонует объектные модули и записывает программу."""
+    compiler = Compiler(tracer)
+    modules = [load_object(path) for path in object_files]
+    machine_code, compiler.labels = link(modules, DATA_START_ADDRESS)
+    compiler.program_size = len(machine_code)
+    compiler.print_labels()
+    return compiler._write_to_file(output_file, machine_code, output_format)
+
+def main(args=None, include_cache=None, cache_dir=None):
+    """Командная строка ассемблера.
+
+    Демон (daemon.py) вызывает её в своём процессе: include_cache остаётся
+    между запросами, cache_dir - каталог кэша сборки клиента.
+    """
+    args = sys.argv[1:] if args is None else list(args)
+    if "--no-daemon" in args:
+        args.remove("--no-daemon")
+
+    def build_cache():
+        return BuildCache(cache_dir) if cache_dir else BuildCache()
+
+    if args == ["--cache-stats"]:
+        cache = build_cache()
+        stats = cache.stats()
+        print(f"Кэш сборки: {cache.directory}")
+        print(f"Попаданий: {stats['hits']}, промахов: {stats['misses']}")
+        print(f"Записей: {stats['entries']}, байт: {stats['bytes']} (предел {cache.size_limit})")
+        return
+
+    use_cache = "--no-cache" not in args
+    if not use_cache:
+        args.remove("--no-cache")
+
+    single_pass = "--single-pass" in args
+    if single_pass:
+        args.remove("--single-pass")
+
+    show_stats = "--stats" in args
+    if show_stats:
+        args.remove("--stats")
+
+    try:
+        trace_categories = pop_option(args, "--trace")
+        trace_level = int(pop_option(args, "--trace-level") or DEBUG)
+    except ValueError:
+        print("Ошибка: неверный формат опций --trace/--trace-level. Используйте --trace <категории> --trace-level <n>")
+        return
+
+    optimize = "-O" in args
+    if optimize:
+        args.remove("-O")
+
+    auto_bank = "--auto-bank" in args
+    if auto_bank:
+        args.remove("--auto-bank")
+
+    data_segment = "--data-segment" in args
+    if data_segment:
+        args.remove("--data-segment")
+
+    try:
+        output_format = pop_option(args, "--format") or (FORMAT_VBIN if data_segment else FORMAT_HEX)
+    except ValueError:
+        output_format = None
+    if output_format not in FORMATS:
+        print(f"Ошибка: неверный формат вывода. Используйте --format {'|'.join(FORMATS)}")
+        return
+
+    try:
+        debug_map_file = pop_option(args, "--debug-map")
+    except ValueError:
+        print("Ошибка: неверный формат опции --debug-map. Используйте --debug-map <файл>")
+        return
+
+    defines = {}
+    try:
+        while "-D" in args:
+            name, value = pop_option(args, "-D").split("=", 1)
+            defines[name.upper()] = parse_number(value.upper())
+    except ValueError:
+        print("Ошибка: неверный формат опции -D. Используйте -D <ИМЯ>=<значение>")
+        return
+
+    categories = trace_categories.lower().split(',') if trace_categories else []
+    unknown = [name for name in categories if name not in CATEGORIES and name != 'all']
+    if unknown:
+        print(f"Ошибка: неизвестные категории трассировки: {', '.join(unknown)}. Доступны: {', '.join(CATEGORIES)}, all")
+        return
+
+    try:
+        batch_spec = pop_option(args, "--batch")
+        jobs_count = pop_option(args, "--jobs")
+        workers = int(jobs_count) if jobs_count else None
+    except ValueError:
+        print("Ошибка: неверный формат опций --batch/--jobs. Используйте --batch <манифест|маска> --jobs <n>")
+        return
+
+    if data_segment and (output_format != FORMAT_VBIN or batch_spec is not None or "--cassette" in args
+                         or "--link" in args or "--object" in args):
+        print(f"Ошибка: --data-segment поддерживается только при сборке одного файла в формате {FORMAT_VBIN}")
+        return
+
+    if (optimize or auto_bank or debug_map_file) and (batch_spec is not None or "--link" in args or "--object" in args):
+        print("Ошибка: -O, --auto-bank и --debug-map поддерживаются только при сборке одного файла")
+        return
+
+    if defines and (batch_spec is not None or "--link" in args):
+        print("Ошибка: -D не поддерживается при пакетной сборке и компоновке")
+        return
+
+    if batch_spec is not None:
+        jobs = parse_manifest(batch_spec) if os.path.isfile(batch_spec) else jobs_from_glob(batch_spec, output_format)
+        batch_cache_dir = str(build_cache().directory) if use_cache else None
+        start = time.perf_counter()
+        results = run_batch(jobs, workers, single_pass, batch_cache_dir, output_format)
+        print(format_summary(results, time.perf_counter() - start))
+        if any(result.error is not None for result in results):
+            sys.exit(1)
+        return
+
+    link_mode = "--link" in args
+    if link_mode:
+        args.remove("--link")
+    object_mode = "--object" in args
+    if object_mode:
+        args.remove("--object")
+
+    if len(args) < 2 or (object_mode and len(args) != 2):
+        print(USAGE)
+        return
+
+    tracer = Tracer(categories, trace_level)
+    if link_mode:
+        if link_objects(args[0], args[1:], tracer, output_format):
+            print("Компоновка прошла успешно")
+        else:
+            print("Компоновка не удалась")
+        return
+    if object_mode:
+        compiler = Compiler(tracer, include_cache)
+        compiler.predefines = defines
+        compiler.compile_object(args[1], args[0])
+        if show_stats:
+            print(compiler.stats.report())
         return
 
     use_cassette = False
@@ -12,31 +182,47 @@ def main():
     input_file = ""
 
 
-    if "--cassette" in sys.argv:
+    if "--cassette" in args:
         use_cassette = True
         try:
-            cassette_index = sys.argv.index("--cassette")
-            section_number = int(sys.argv[cassette_index + 1])
+            cassette_index = args.index("--cassette")
+            section_number = int(args[cassette_index + 1])
             if section_number < 0:
               raise Exception()
-            output_file = sys.argv[cassette_index+2]
-            input_file = sys.argv[-1]
+            output_file = args[cassette_index+2]
+            input_file = args[-1]
         except (ValueError, IndexError, Exception):
             print("Ошибка: неверный формат команды --cassette. Используйте --cassette <section_number> <output_file> <input_file>")
             return
 
-    elif  len(sys.argv) == 3:
-        output_file = sys.argv[1]
-        input_file = sys.argv[2]
+    elif  len(args) == 2:
+        output_file = args[0]
+        input_file = args[1]
     else:
-         print("Ошибка: неверный формат команды. Используйте [--cassette <section_number>] <output_file> <input_file>")
+         print("Ошибка: неверный формат команды. Используйте [--single-pass] [--stats] [--no-cache] [--cassette <section_number>] <output_file> <input_file>")
          return
     
-    compiler = Compiler()
-    if compiler.compile(input_file, output_file, use_cassette, section_number):
+    compiler = Compiler(tracer, include_cache)
+    compiler.predefines = defines
+    compiler.data_segment = data_segment
+    compiler.optimize = optimize
+    compiler.auto_bank = auto_bank
+    if debug_map_file is not None:
+        compiler.debug_ranges = []
+    cache = build_cache() if use_cache else None
+    if compiler.compile(input_file, output_file, use_cassette, section_number, single_pass, cache, output_format,
+                        debug_map_file):
          print("Компиляция прошла успешно")
     else:
          print("Компиляция не удалась")
+    if show_stats:
+         print(compiler.stats.report())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Если запущен демон ассемблера, сборка выполняется в нём (см. daemon.py)
+    from daemon import forward
+    exit_code = forward(sys.argv[1:])
+    if exit_code is None:
+        main()
+    else:
+        sys.exit(exit_code)
\ No newline at end of file
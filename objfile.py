@@ -0,0 +1,74 @@
+# objfile.py
+import json
+from typing import Dict, List, Optional, Union
+
+OBJECT_MAGIC = 'VOBJ'
+OBJECT_VERSION = 1
+
+
+class Relocation:
+    """Байт кода модуля, который компоновщик заполнит адресом или номером банка."""
+    __slots__ = ('offset', 'kind', 'symbol', 'addend', 'bank', 'after_bank', 'location', 'text')
+
+    def __init__(self, offset: int, kind: str, symbol: Optional[str], addend: int,
+                 bank: Union[int, str, None], after_bank: bool, location: str, text: str):
+        self.offset = offset          # смещение байта в коде модуля
+        self.kind = kind              # JUMP, BYTE, BANK или DATA (см. code_generator)
+        self.symbol = symbol          # метка или None для числового адреса
+        self.addend = addend          # числовой адрес перехода или адрес данных .DB
+        self.bank = bank              # активный банк в точке перехода: число, метка или None
+        self.after_bank = after_bank  # перед переходом стоит инструкция BANK
+        self.location = location      # место в исходнике для сообщений об ошибках
+        self.text = text
+
+    def to_list(self) -> list:
+        return [self.offset, self.kind, self.symbol, self.addend, self.bank, self.after_bank, self.location, self.text]
+
+
+class ObjectModule:
+    """Перемещаемый объектный модуль: код, собранный с адреса 0, метки и перемещения.
+
+    Экспортируются метки из директивы .EXPORT; все неразрешённые в модуле
+    метки считаются импортируемыми.
+    """
+
+    def __init__(self, name: str, code: bytes, symbols: Dict[str, int], exports: List[str],
+                 imports: List[str], relocations: List[Relocation], data_size: int = 0):
+        self.name = name
+        self.code = code
+        self.symbols = symbols          # все метки модуля: имя -> смещение
+        self.exports = exports
+        self.imports = imports
+        self.relocations = relocations
+        self.data_size = data_size      # сколько байт .DB занимает модуль начиная с DATA_START_ADDRESS
+
+    def to_dict(self) -> Dict:
+        return {
+            'magic': OBJECT_MAGIC,
+            'version': OBJECT_VERSION,
+            'name': self.name,
+            'code': self.code.hex(),
+            'symbols': self.symbols,
+            'exports': self.exports,
+            'imports': self.imports,
+            'relocations': [reloc.to_list() for reloc in self.relocations],
+            'data_size': self.data_size,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ObjectModule':
+        if data.get('magic') != OBJECT_MAGIC or data.get('version') != OBJECT_VERSION:
+            raise ValueError("неизвестный формат объектного модуля")
+        return cls(data['name'], bytes.fromhex(data['code']), data['symbols'], data['exports'],
+                   data['imports'], [Relocation(*item) for item in data['relocations']], data['data_size'])
+
+
+def save_object(module: ObjectModule, path):
+    """Записывает объектный модуль в файл."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(module.to_dict(), f)
+
+def load_object(path) -> ObjectModule:
+    """Читает объектный модуль из файла."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return ObjectModule.from_dict(json.load(f))
@@ -0,0 +1,298 @@
+# optimizer.py
+from typing import Dict, List, Optional, Tuple
+
+from lexer import LABEL, DIRECTIVE, INSTRUCTION, Statement, parse_number
+from errors import CompilationError
+from expr import is_expression, operand_names
+from isa import JUMPS
+
+TERMINATORS = ('JMP', 'RET', 'HLT')  # после них выполнение не продолжается на следующей строке
+
+# Правила оптимизации: имя -> описание для отчёта
+RULES = {
+    'nop': 'Удаление NOP',
+    'set-mov': 'Лишние SET/MOV',
+    'bank': 'Повторный BANK',
+    'dead-code': 'Недостижимый код',
+    'jump-thread': 'Переход на переход',
+}
+
+
+class OptimizationReport:
+    """Сколько записей удалено (или переходов перенаправлено) и байт сэкономлено по каждому правилу."""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {rule: 0 for rule in RULES}
+        self.saved: Dict[str, int] = {rule: 0 for rule in RULES}
+        self.disabled: Optional[str] = None  # причина, по которой код не сокращался
+
+    def add(self, rule: str, stmt: Statement, saved: bool = True):
+        self.counts[rule] += 1
+        if saved:
+            self.saved[rule] += stmt.size
+
+    def total(self) -> int:
+        return sum(self.saved.values())
+
+    def format(self) -> str:
+        rows = ["\nОптимизация (-O):", "-" * 40]
+        if self.disabled:
+            rows.append(f"Сокращение кода отключено: {self.disabled}")
+        rows.append(f"{'Правило':<22} {'Записей':>8} {'Байт':>8}")
+        rows.append("-" * 40)
+        for rule, title in RULES.items():
+            rows.append(f"{title:<22} {self.counts[rule]:>8} {self.saved[rule]:>8}")
+        rows.append("-" * 40)
+        rows.append(f"{'Всего сэкономлено':<22} {'':>8} {self.total():>8}")
+        return '\n'.join(rows)
+
+    def to_dict(self) -> Dict:
+        return {'counts': self.counts, 'saved': self.saved, 'disabled': self.disabled}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'OptimizationReport':
+        report = cls()
+        report.counts.update(data['counts'])
+        report.saved.update(data['saved'])
+        report.disabled = data['disabled']
+        return report
+
+
+def active_statements(compiler, statements: List[Statement]) -> List[Statement]:
+    """Оставляет только записи, попадающие в сборку: .IFNDEF/.ENDIF вычисляются здесь.
+
+    Константы .DEFINE учитываются так же, как в первом проходе; сами директивы
+    .DEFINE остаются в списке, потому что проходы заполняют таблицу заново.
+    """
+    active = []
+    conditional_stack = []
+    is_wr = True
+    for stmt in statements:
+        if stmt.kind == DIRECTIVE:
+            if stmt.name == '.IFNDEF':
+                if len(stmt.operands) != 1:
+                    raise CompilationError("Неверный формат .IFNDEF")
+                conditional_stack.append(stmt.operands[0] not in compiler.defines)
+                is_wr = all(conditional_stack)
+                continue
+            if stmt.name == '.ENDIF':
+                if not conditional_stack:
+                    raise CompilationError("Директива .ENDIF без соотв. .IFNDEF")
+                conditional_stack.pop()
+                is_wr = all(conditional_stack)
+                continue
+            if stmt.name == '.DEFINE' and is_wr:
+                compiler._parse_define(stmt)
+        if is_wr:
+            active.append(stmt)
+    if conditional_stack:
+        raise CompilationError("Незакрытые директивы .IFNDEF")
+    compiler.defines = dict(compiler.predefines)
+    return active
+
+
+def layout(compiler, statements: List[Statement]) -> Dict[str, int]:
+    """Адреса меток для списка без условных директив (как в первом проходе)."""
+    labels = {}
+    address = 0
+    for stmt in statements:
+        if stmt.kind == LABEL:
+            labels[stmt.name] = address
+        elif not (stmt.kind == DIRECTIVE and stmt.name == '.DB' and compiler.data_segment):
+            address += stmt.size
+    return labels
+
+
+def numeric_jump(statements: List[Statement]) -> Optional[Statement]:
+    """Первый переход по числовому адресу или выражению: такие адреса сдвинутся при сокращении кода."""
+    for stmt in statements:
+        if stmt.kind == INSTRUCTION and stmt.name in JUMPS and stmt.operands:
+            if is_expression(stmt.operands[0]):
+                return stmt
+            try:
+                parse_number(stmt.operands[0])
+                return stmt
+            except ValueError:
+                pass
+    return None
+
+
+def fixed_bank(statements: List[Statement], labels: Dict[str, int]) -> Optional[Statement]:
+    """Первый BANK с номером, не выводимым из меток (число или константа): он не следует за сдвигом кода."""
+    for stmt in statements:
+        if stmt.kind == INSTRUCTION and stmt.name == 'BANK' and stmt.operands:
+            names = operand_names(stmt.operands[0])
+            if not names or not names <= labels.keys():
+                return stmt
+    return None
+
+
+def remove_nops(compiler, statements, report):
+    result = []
+    for stmt in statements:
+        if stmt.kind == INSTRUCTION and stmt.name == 'NOP' and not stmt.operands:
+            report.add('nop', stmt)
+            continue
+        result.append(stmt)
+    return result
+
+
+def _registers(compiler, stmt) -> Optional[Tuple[str, ...]]:
+    """Операнды SET/MOV, если запись годится для правила set-mov."""
+    if stmt.kind != INSTRUCTION or stmt.name not in ('SET', 'MOV') or len(stmt.operands) != 2:
+        return None
+    dest, source = stmt.operands
+    if dest not in compiler.registers or (stmt.name == 'MOV' and source not in compiler.registers):
+        return None
+    return stmt.operands
+
+
+def remove_redundant_moves(compiler, statements, report):
+    """SET/MOV, чей результат сразу перезаписан; MOV R R; повтор MOV Rx Ry или обратный MOV Ry Rx."""
+    result = []
+    last = None  # индекс в result последней инструкции после последней метки
+    for stmt in statements:
+        if stmt.kind == LABEL:
+            last = None
+            result.append(stmt)
+            continue
+        if stmt.kind != INSTRUCTION:
+            result.append(stmt)
+            continue
+        operands = _registers(compiler, stmt)
+        if operands is not None and stmt.name == 'MOV' and operands[0] == operands[1]:
+            report.add('set-mov', stmt)
+            continue
+        prev = result[last] if last is not None else None
+        prev_operands = _registers(compiler, prev) if prev is not None else None
+        if operands is not None and prev_operands is not None:
+            dest, source = operands
+            if prev.name == 'MOV' and stmt.name == 'MOV' and \
+                    (operands == prev_operands or operands == prev_operands[::-1]):
+                report.add('set-mov', stmt)  # значения регистров уже равны
+                continue
+            if prev_operands[0] == dest and (stmt.name == 'SET' or source != dest):
+                report.add('set-mov', prev)  # предыдущая запись в регистр не используется
+                result[last] = None
+        last = len(result)
+        result.append(stmt)
+    return [stmt for stmt in result if stmt is not None]
+
+
+def remove_redundant_banks(compiler, statements, report):
+    """BANK на уже активный банк. Банк известен только внутри блока: метка и CALL его сбрасывают.
+
+    BANK прямо перед переходом остаётся: по нему компилятор проверяет банк цели.
+    """
+    result = []
+    bank = 0  # при запуске программы активен банк 0
+    for index, stmt in enumerate(statements):
+        if stmt.kind == LABEL:
+            bank = None
+        elif stmt.kind == INSTRUCTION:
+            if stmt.name == 'BANK' and len(stmt.operands) == 1:
+                operand = stmt.operands[0]
+                try:
+                    value = parse_number(operand)
+                except ValueError:
+                    value = operand  # BANK <метка>
+                following = statements[index + 1] if index + 1 < len(statements) else None
+                before_jump = following is not None and following.kind == INSTRUCTION and following.name in JUMPS
+                if value == bank and not before_jump:
+                    report.add('bank', stmt)
+                    continue
+                bank = value
+            elif stmt.name == 'CALL':
+                bank = None  # подпрограмма могла переключить банк
+        result.append(stmt)
+    return result
+
+
+def remove_dead_code(compiler, statements, report):
+    """Инструкции после JMP/RET/HLT до следующей метки.
+
+    BANK и директивы остаются: по ним компилятор отслеживает текущий банк и адреса .DB.
+    """
+    result = []
+    dead = False
+    for stmt in statements:
+        if stmt.kind == LABEL:
+            dead = False
+        elif stmt.kind == INSTRUCTION:
+            if dead and stmt.name != 'BANK':
+                report.add('dead-code', stmt)
+                continue
+            if stmt.name in TERMINATORS:
+                dead = True
+        result.append(stmt)
+    return result
+
+
+def thread_jumps(compiler, statements, report):
+    """Переход на метку, за которой сразу стоит JMP, ведёт прямо к цели этого JMP.
+
+    Перенаправление допустимо, только если новая цель в том же банке, что и
+    старая: номер банка задаётся отдельной инструкцией BANK.
+    """
+    labels = layout(compiler, statements)
+    forward = {}  # метка -> метка, на которую сразу переходит JMP после неё
+    pending = []
+    for stmt in statements:
+        if stmt.kind == LABEL:
+            pending.append(stmt.name)
+            continue
+        if stmt.kind == INSTRUCTION and stmt.name == 'JMP' and len(stmt.operands) == 1 and stmt.operands[0] in labels:
+            for name in pending:
+                forward[name] = stmt.operands[0]
+        if stmt.kind == INSTRUCTION or (stmt.kind == DIRECTIVE and stmt.size):
+            pending = []
+
+    result = []
+    for stmt in statements:
+        if stmt.kind == INSTRUCTION and stmt.name in JUMPS and len(stmt.operands) == 1:
+            target = stmt.operands[0]
+            seen = {target}
+            while target in forward and forward[target] not in seen and \
+                    labels[forward[target]] // 256 == labels[stmt.operands[0]] // 256:
+                target = forward[target]
+                seen.add(target)
+            if target != stmt.operands[0]:
+                report.add('jump-thread', stmt, saved=False)
+                stmt = Statement(stmt.kind, stmt.name, stmt.opcode, (target,), stmt.size, stmt.file, stmt.line, stmt.text)
+        result.append(stmt)
+    return result
+
+
+def optimize(compiler, statements: List[Statement]) -> Tuple[List[Statement], OptimizationReport]:
+    """Оптимизирует список записей до расстановки адресов; адреса меток потом считают проходы заново.
+
+    Правила, сокращающие код, применяются, пока дают результат (удаление кода
+    открывает новые возможности). Если в программе есть переходы по числовым
+    адресам, код не сокращается - такие адреса сдвинулись бы. Числовой BANK
+    тоже не пересчитывается: если после сокращения хоть одна метка попала в
+    другой банк, сокращение отменяется.
+    """
+    report = OptimizationReport()
+    statements = active_statements(compiler, statements)
+    fixed = numeric_jump(statements)
+    if fixed is not None:
+        report.disabled = f"переход по числовому адресу или выражению ({fixed.location()})"
+    else:
+        original = statements
+        while True:
+            size = len(statements)
+            for rule in (remove_nops, remove_redundant_moves, remove_redundant_banks, remove_dead_code):
+                statements = rule(compiler, statements, report)
+            if len(statements) == size:
+                break
+        labels = layout(compiler, original)
+        fixed = fixed_bank(original, labels)
+        if fixed is not None:
+            moved = layout(compiler, statements)
+            if any(moved[name] // 256 != address // 256 for name, address in labels.items()):
+                statements = original
+                report = OptimizationReport()
+                report.disabled = f"метки сменили банк, а BANK задан числом ({fixed.location()})"
+    # Перенаправление не меняет размеров, поэтому выполняется по окончательной раскладке
+    statements = thread_jumps(compiler, statements, report)
+    return statements, report
@@ -0,0 +1,150 @@
+# profiler.py
+import linecache
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from debugmap import DebugMap
+from emulator import MEMORY_SIZE, BANK_SIZE
+from isa import OPCODES
+
+CALL = OPCODES['CALL']
+RET = OPCODES['RET']
+UNKNOWN = '?'  # адрес вне меток и строк отладочной карты
+
+
+class Profiler:
+    """Считающий профилировщик: подключается к эмулятору как hook.
+
+    Перед каждой инструкцией увеличивает счётчики инструкций и тактов по её
+    адресу; по меткам и строкам счётчики сводятся уже после выполнения.
+    Стек вызовов для flame graph ведётся по CALL/RET: кадр - метка, на
+    которую выполнен CALL, корневой кадр - метка точки входа.
+    """
+
+    def __init__(self, debug_map: DebugMap):
+        self.debug_map = debug_map
+        self.instructions = [0] * MEMORY_SIZE
+        self.cycles = [0] * MEMORY_SIZE
+        self.stacks: Dict[str, int] = defaultdict(int)  # "кадр;кадр;..." -> такты
+        self._frames: List[str] = []
+        self._key = ''
+
+    def attach(self, emulator):
+        """Подключает профилировщик к эмулятору, начиная стек с текущего pc."""
+        self._frames = [self._frame(emulator.pc)]
+        self._key = self._frames[0]
+        emulator.hook = self.hook
+
+    def _frame(self, address: int) -> str:
+        return self.debug_map.label_for(address) or hex(address)
+
+    def hook(self, pc: int, emulator):
+        memory = emulator.memory
+        opcode = memory[pc]
+        cycles = emulator._opcode_cycles[opcode]
+        self.instructions[pc] += 1
+        self.cycles[pc] += cycles
+        self.stacks[self._key] += cycles
+        if opcode == CALL and pc + 1 < MEMORY_SIZE:
+            self._frames.append(self._frame(emulator.bank * BANK_SIZE + memory[pc + 1]))
+            self._key = ';'.join(self._frames)
+        elif opcode == RET and len(self._frames) > 1:
+            self._frames.pop()
+            self._key = ';'.join(self._frames)
+
+    def total_cycles(self) -> int:
+        return sum(self.cycles)
+
+    def _group(self, key) -> List[Tuple[object, int, int]]:
+        """Сводит счётчики по адресам в (ключ, такты, инструкции), по убыванию тактов."""
+        cycles: Dict[object, int] = defaultdict(int)
+        instructions: Dict[object, int] = defaultdict(int)
+        for address in range(MEMORY_SIZE):
+            if self.instructions[address]:
+                group = key(address)
+                cycles[group] += self.cycles[address]
+                instructions[group] += self.instructions[address]
+        return sorted(((group, cycles[group], instructions[group]) for group in cycles),
+                      key=lambda item: -item[1])
+
+    def by_label(self) -> List[Tuple[str, int, int]]:
+        """Такты и инструкции по меткам (адрес относится к ближайшей метке не выше него)."""
+        return self._group(lambda address: self.debug_map.label_for(address) or UNKNOWN)
+
+    def by_line(self) -> List[Tuple[Optional[Tuple[str, int]], int, int]]:
+        """Такты и инструкции по строкам исходника."""
+        return self._group(self.debug_map.lookup)
+
+    def format(self, top: int = 10) -> str:
+        total = self.total_cycles() or 1
+        rows = ["\nПрофиль по меткам:", "-" * 60,
+                f"{'Метка':<24} {'Тактов':>12} {'%':>7} {'Инструкций':>12}", "-" * 60]
+        for label, cycles, instructions in self.by_label():
+            rows.append(f"{label:<24} {cycles:>12} {cycles * 100 / total:>6.1f}% {instructions:>12}")
+        rows += [f"\nГорячие строки (первые {top}):", "-" * 60]
+        for location, cycles, instructions in self.by_line()[:top]:
+            if location is None:
+                rows.append(f"{UNKNOWN:<24} {cycles:>12} {cycles * 100 / total:>6.1f}%")
+                continue
+            file, line = location
+            source = linecache.getline(file, line).strip()
+            rows.append(f"{f'{file}:{line}':<24} {cycles:>12} {cycles * 100 / total:>6.1f}%  {source}")
+        return '\n'.join(rows)
+
+    def write_collapsed(self, path):
+        """Записывает стеки в формате collapsed stacks (flamegraph.pl, speedscope): "a;b;c такты"."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, cycles in sorted(self.stacks.items()):
+                if cycles:
+                    f.write(f"{key} {cycles}\n")
+
+
+if __name__ == "__main__":
+    import sys
+    from debugmap import load_debug_map
+    from emulator import Emulator, STOP_HALT
+    from errors import EmulatorError
+
+    args = sys.argv[1:]
+    usage = ("Использование: python profiler.py <program> <отладочная карта> [--max-instructions <n>] "
+             "[--max-cycles <n>] [--collapsed <файл>] [--top <n>]")
+
+    def option(name):
+        if name not in args:
+            return None
+        index = args.index(name)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    try:
+        max_instructions = option('--max-instructions')
+        max_cycles = option('--max-cycles')
+        collapsed_file = option('--collapsed')
+        top = option('--top')
+    except IndexError:
+        print(usage)
+        sys.exit(1)
+    if len(args) != 2:
+        print(usage)
+        sys.exit(1)
+
+    emulator = Emulator()
+    try:
+        emulator.load_file(args[0])
+        profiler = Profiler(load_debug_map(args[1]))
+    except (OSError, ValueError, EmulatorError) as e:
+        print(f"Ошибка загрузки: {e}")
+        sys.exit(1)
+    profiler.attach(emulator)
+    try:
+        result = emulator.run(int(max_instructions) if max_instructions else None,
+                              int(max_cycles) if max_cycles else None)
+        print(f"Остановка: {'HLT' if result.reason == STOP_HALT else 'лимит'}, "
+              f"инструкций: {result.instructions}, тактов: {result.cycles}")
+    except EmulatorError as e:
+        print(f"Ошибка выполнения: {e}")
+    print(profiler.format(int(top) if top else 10))
+    if collapsed_file:
+        profiler.write_collapsed(collapsed_file)
+        print(f"\nСтеки для flame graph записаны в {collapsed_file}")
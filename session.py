@@ -0,0 +1,359 @@
+# session.py
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set
+
+from assembler import AssemblyResult, Diagnostic, ERROR, IncludeResolver, Source, no_includes
+from compiler import Compiler
+from errors import CompilationError
+from expr import operand_names
+from lexer import LABEL, DIRECTIVE, INSTRUCTION, lex_line
+from macro import is_local_label
+
+FULL = 'full'
+INCREMENTAL = 'incremental'
+
+
+class PrefixSums:
+    """Дерево Фенвика над размерами записей: изменение размера и сумма до позиции за O(log n)."""
+
+    def __init__(self, values: Iterable[int]):
+        self.values = list(values)
+        tree = [0] + self.values
+        size = len(tree)
+        for index in range(1, size):
+            parent = index + (index & -index)
+            if parent < size:
+                tree[parent] += tree[index]
+        self._tree = tree
+
+    def __len__(self):
+        return len(self.values)
+
+    def set(self, index: int, value: int):
+        delta = value - self.values[index]
+        if not delta:
+            return
+        self.values[index] = value
+        tree = self._tree
+        index += 1
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def prefix(self, index: int) -> int:
+        """Сумма значений с позиции 0 до index (не включая)."""
+        tree = self._tree
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+
+class Session:
+    """Сессия сборки одного файла для редактора: после правки пересобирается только изменённое.
+
+    Хранит записи программы, размеры их кода в дереве Фенвика (адрес записи -
+    сумма размеров до неё) и машинный код. Правка строк разбирает только новые
+    строки, заменяет их код, пересчитывает адреса меток и заново генерирует
+    лишь записи, которые ссылаются на сдвинувшиеся метки (и запись сразу за
+    правкой - для проверки BANK). Если правка затрагивает директивы, BANK
+    или смещает банк после BANK <метка>, а также после сборки с ошибкой
+    программа собирается заново целиком.
+    """
+
+    def __init__(self, source: Source, include_resolver: Optional[IncludeResolver] = None,
+                 defines: Optional[Dict[str, int]] = None, source_name: str = '<source>',
+                 data_segment: bool = False):
+        self.lines: List[str] = source.splitlines(True) if isinstance(source, str) else list(source)
+        self.include_resolver = include_resolver if include_resolver is not None else no_includes
+        self.predefines = {name.upper(): value for name, value in (defines or {}).items()}
+        self.source_name = source_name
+        self.data_segment = data_segment
+        self.full_builds = 0
+        self.incremental_builds = 0
+        self.last_build = FULL
+        self.last_generated = 0  # записей, для которых код сгенерирован при последней сборке
+        self.error: Optional[str] = None
+        self.rebuild()
+
+    # Полная сборка
+
+    def _compiler(self) -> Compiler:
+        compiler = Compiler()
+        compiler.include_resolver = self.include_resolver
+        compiler.predefines = self.predefines
+        compiler.data_segment = self.data_segment
+        return compiler
+
+    def rebuild(self) -> AssemblyResult:
+        """Собирает программу целиком (например, после изменения файлов .INCLUDE)."""
+        self.full_builds += 1
+        self.last_build = FULL
+        compiler = self.compiler = self._compiler()
+        origins: List[int] = []
+        try:
+            statements = compiler.preprocess_includes(self.lines, self.source_name, origins)
+            compiler.first_pass(statements)
+            compiler.defines = dict(compiler.predefines)
+            machine_code = compiler.second_pass(statements)
+        except CompilationError as e:
+            self.error = str(e)
+            self.code = bytearray()
+            return self.result()
+
+        self.error = None
+        self.statements = statements
+        self.origins = origins  # строка основного файла для каждой записи
+        # Строки блоков .MACRO и .REPT основного файла: их тела не стали отдельными записями
+        self.blocks = [[first, last] for file, first, last in compiler.macros.blocks if file == self.source_name]
+        self.code = bytearray(machine_code)
+        self.data = bytes(compiler.data_bytes)
+        self.last_generated = len(statements)
+        self._index()
+        return self.result()
+
+    def _index(self):
+        """Строит по записям таблицы, которые поддерживаются при правках."""
+        self.active: List[bool] = []           # запись попадает в сборку (вне ложного .IFNDEF)
+        self.banks: List[int] = []             # позиции инструкций BANK
+        self.define_positions: List[int] = []  # позиции .DEFINE и заданные ими константы
+        self.define_values: List[tuple] = []
+        self.users: Dict[str, Set[int]] = {}   # имя -> позиции записей, где оно операнд
+        self.define_labels: Set[str] = set()   # метки в выражениях .DEFINE
+        conditional_stack = []
+        is_wr = True
+        compiler = self.compiler
+        defines = compiler.defines = dict(self.predefines)
+        sizes = []
+        for position, stmt in enumerate(self.statements):
+            if stmt.kind == DIRECTIVE:
+                if stmt.name == '.IFNDEF':
+                    conditional_stack.append(stmt.operands[0] not in defines)
+                    is_wr = all(conditional_stack)
+                elif stmt.name == '.ENDIF':
+                    conditional_stack.pop()
+                    is_wr = all(conditional_stack)
+                elif stmt.name == '.DEFINE' and is_wr and len(stmt.operands) == 2:
+                    value = compiler._parse_define(stmt)  # метки уже известны по первому проходу
+                    if value is not None:
+                        self.define_positions.append(position)
+                        self.define_values.append((stmt.operands[0], value))
+                        self.define_labels.update(name for name in operand_names(stmt.operands[1])
+                                                  if name in compiler.labels and name not in defines)
+            self.active.append(is_wr)
+            sizes.append(self._size(stmt, is_wr))
+            if is_wr and stmt.kind == INSTRUCTION:
+                if stmt.name == 'BANK':
+                    self.banks.append(position)
+                self._add_user(stmt, position)
+        self.sizes = PrefixSums(sizes)
+        self._find_labels()
+        self.addresses = self._label_addresses()
+
+    def _size(self, stmt, active: bool) -> int:
+        """Байт кода записи (как в первом проходе)."""
+        if not active or stmt.kind == LABEL or (self.data_segment and stmt.name == '.DB'):
+            return 0
+        return stmt.size
+
+    def _add_user(self, stmt, position: int):
+        registers = self.compiler.registers
+        for operand in stmt.operands:
+            if operand not in registers:
+                for name in operand_names(operand):
+                    self.users.setdefault(name, set()).add(position)
+
+    def _remove_user(self, stmt, position: int):
+        if stmt.kind == INSTRUCTION:
+            for operand in stmt.operands:
+                for name in operand_names(operand):
+                    self.users.get(name, set()).discard(position)
+
+    def _find_labels(self):
+        """Позиция каждой метки (последнее объявление, как в первом проходе)."""
+        self.label_positions: Dict[str, int] = {}
+        for position, stmt in enumerate(self.statements):
+            if stmt.kind == LABEL and self.active[position]:
+                self.label_positions[stmt.name] = position
+
+    def _label_addresses(self) -> Dict[str, int]:
+        prefix = self.sizes.prefix
+        return {name: prefix(position) for name, position in self.label_positions.items()}
+
+    # Правки
+
+    def update(self, source: Source) -> AssemblyResult:
+        """Принимает новый текст файла целиком; правкой считаются строки между общими началом и концом."""
+        lines = source.splitlines(True) if isinstance(source, str) else list(source)
+        old = self.lines
+        if lines == old:
+            return self.result()
+        start = 0
+        limit = min(len(old), len(lines))
+        while start < limit and old[start] == lines[start]:
+            start += 1
+        end_old, end_new = len(old), len(lines)
+        while end_old > start and end_new > start and old[end_old - 1] == lines[end_new - 1]:
+            end_old -= 1
+            end_new -= 1
+        return self.edit(start + 1, end_old - start, lines[start:end_new])
+
+    def edit(self, line: int, count: int, new_lines: Source) -> AssemblyResult:
+        """Заменяет count строк, начиная со строки line (нумерация с 1), строками new_lines."""
+        new_lines = new_lines.splitlines(True) if isinstance(new_lines, str) else list(new_lines)
+        index = line - 1
+        if not 0 <= index <= len(self.lines) or count < 0 or index + count > len(self.lines):
+            raise ValueError(f"строки {line}..{line + count - 1} вне файла ({len(self.lines)} строк)")
+        self.lines[index:index + count] = new_lines
+        if self.error is not None:
+            return self.rebuild()
+        try:
+            if not self._apply(line, count, new_lines):
+                return self.rebuild()
+        except CompilationError:
+            # Сообщения об ошибках - такие же, как при обычной сборке
+            return self.rebuild()
+        self.incremental_builds += 1
+        self.last_build = INCREMENTAL
+        return self.result()
+
+    def _apply(self, line: int, count: int, new_lines: List[str]) -> bool:
+        """Правка без полной сборки; False - правку так выполнить нельзя."""
+        origins = self.origins
+        if any(start < line + count and line <= end for start, end in self.blocks):
+            return False  # правка внутри блока .MACRO или .REPT
+        first = bisect_left(origins, line)
+        last = bisect_left(origins, line + count)
+        opcodes = self.compiler.opcodes
+        macros = self.compiler.macros.macros
+        new_statements = []
+        for offset, text in enumerate(new_lines):
+            stmt = lex_line(text, opcodes, self.source_name, line + offset)
+            if stmt is not None:
+                new_statements.append(stmt)
+        old_statements = self.statements[first:last]
+        for stmt in old_statements + new_statements:
+            if stmt.kind == DIRECTIVE or stmt.name == 'BANK' or stmt.file != self.source_name or \
+                    stmt.name in macros or (stmt.kind == LABEL and is_local_label(stmt.name)):
+                return False
+
+        start = self.sizes.prefix(first)
+        old_size = sum(self.sizes.values[first:last])
+        for position in range(first, last):
+            if self.active[position]:
+                self._remove_user(self.statements[position], position)
+
+        # Замена записей; позиции и номера строк ниже правки сдвигаются
+        end = first + len(new_statements)
+        active = self.active[first - 1] if first else True
+        sizes = [self._size(stmt, active) for stmt in new_statements]
+        self.statements[first:last] = new_statements
+        self.active[first:last] = [active] * len(new_statements)
+        origins[first:last] = [stmt.line for stmt in new_statements]
+        if end != last:
+            self._shift(last, end - last)
+            values = self.sizes.values
+            values[first:last] = sizes
+            self.sizes = PrefixSums(values)
+        else:
+            for offset, size in enumerate(sizes):
+                self.sizes.set(first + offset, size)
+        shift = len(new_lines) - count
+        if shift:
+            for block in self.blocks:
+                if block[0] >= line + count:
+                    block[0] += shift
+                    block[1] += shift
+            statements = self.statements
+            for position in range(end, len(statements)):
+                origins[position] += shift
+                if statements[position].file == self.source_name:
+                    statements[position].line += shift
+        if active:
+            for offset, stmt in enumerate(new_statements):
+                if stmt.kind == INSTRUCTION:
+                    self._add_user(stmt, first + offset)
+
+        # Метки, адрес которых изменился (а также добавленные и удалённые)
+        if any(stmt.kind == LABEL for stmt in old_statements + new_statements):
+            self._find_labels()
+        addresses = self._label_addresses()
+        changed = {name for name in addresses.keys() | self.addresses.keys()
+                   if addresses.get(name) != self.addresses.get(name)}
+        if changed & self.define_labels:
+            return False  # сдвинулась метка, от которой зависит константа
+        self.addresses = addresses
+        self.compiler.labels = dict(addresses)
+
+        generated = bytearray()
+        for position in range(first, end):
+            generated += self._generate(position)
+        self.code[start:start + old_size] = generated
+        self.last_generated = len(new_statements)
+
+        # Ссылки на изменившиеся метки и запись после правки (у неё другая предыдущая запись для проверки BANK)
+        dirty = set()
+        for name in changed:
+            dirty.update(self.users.get(name, ()))
+        following = end
+        while following < len(self.statements) and self.statements[following].kind == LABEL:
+            following += 1
+        if following < len(self.statements):
+            dirty.add(following)
+        for position in sorted(dirty):
+            if first <= position < end:
+                continue
+            stmt = self.statements[position]
+            address = self.sizes.prefix(position)
+            code = self._generate(position)
+            if stmt.name == 'BANK' and code != self.code[address:address + len(code)]:
+                return False  # сменился банк всех следующих записей
+            self.code[address:address + len(code)] = code
+            self.last_generated += 1
+        return True
+
+    def _shift(self, position: int, delta: int):
+        """Сдвигает позиции записей, начиная с position, на delta."""
+        self.banks = [p + delta if p >= position else p for p in self.banks]
+        self.define_positions = [p + delta if p >= position else p for p in self.define_positions]
+        for name, label in self.label_positions.items():
+            if label >= position:
+                self.label_positions[name] = label + delta
+        for name, positions in self.users.items():
+            if any(p >= position for p in positions):
+                self.users[name] = {p + delta if p >= position else p for p in positions}
+
+    def _generate(self, position: int) -> bytes:
+        """Код записи при текущих метках, банке и константах в её позиции."""
+        stmt = self.statements[position]
+        if stmt.kind != INSTRUCTION or not self.active[position]:
+            return b''
+        compiler = self.compiler
+        bank = bisect_left(self.banks, position) - 1
+        compiler.current_bank = self.code[self.sizes.prefix(self.banks[bank]) + 1] if bank >= 0 else 0
+        previous = position - 1
+        while previous >= 0 and self.statements[previous].kind == LABEL:
+            previous -= 1
+        compiler.prev_statement = self.statements[previous] if previous >= 0 else None
+        compiler.defines = dict(self.predefines)
+        compiler.defines.update(self.define_values[:bisect_left(self.define_positions, position)])
+        compiler.bank_errors = []
+        code = bytes(compiler._generate_instruction(stmt, []))
+        compiler._raise_bank_errors()
+        if len(code) != self.sizes.values[position]:
+            raise CompilationError(f"{stmt.location()}: Размер кода {len(code)} вместо {stmt.size}\n{stmt.text}")
+        return code
+
+    # Результат
+
+    @property
+    def labels(self) -> Dict[str, int]:
+        return dict(self.addresses) if self.error is None else {}
+
+    def result(self) -> AssemblyResult:
+        """Результат последней сборки (как у assembler.assemble)."""
+        if self.error is not None:
+            return AssemblyResult(b'', {}, [Diagnostic(ERROR, self.error)])
+        return AssemblyResult(bytes(self.code), self.labels, [], self.data if self.data_segment else None,
+                              list(self.compiler.included_files))
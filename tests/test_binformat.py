@@ -0,0 +1,30 @@
+# tests/test_binformat.py
+import unittest
+
+from binformat import FORMAT_BIN, FORMAT_HEX, FORMAT_VBIN, decode_program, detect_format, encode_program
+
+
+class DetectFormatTest(unittest.TestCase):
+    """Определение формата по началу файла (дизассемблер читает первые CHUNK_SIZE байт)."""
+
+    def test_formats_written_by_assembler(self):
+        code = bytes([0x01, 0x01, 0x05, 0xff])
+        for output_format in (FORMAT_HEX, FORMAT_BIN, FORMAT_VBIN):
+            data = encode_program(code, output_format)
+            self.assertEqual(detect_format(data), output_format)
+            self.assertEqual(decode_program(data)[0], code)
+
+    def test_truncated_hex(self):
+        head = encode_program(bytes(range(256)) * 8, FORMAT_HEX)[:1001]  # обрезан посередине токена
+        self.assertEqual(detect_format(head, complete=False), FORMAT_HEX)
+
+    def test_head_without_separators_is_bin(self):
+        # Сырой дамп из байтов 0x01: ASCII-текст без пробелов, а не пустой hex
+        head = b'\x01' * 4096
+        self.assertEqual(detect_format(head, complete=False), FORMAT_BIN)
+        self.assertEqual(detect_format(head), FORMAT_BIN)
+        self.assertEqual(detect_format(b'0101ff', complete=False), FORMAT_BIN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# tests/test_layout.py
+import random
+import unittest
+
+from assembler import assemble
+from emulator import MEMORY_SIZE, STOP_HALT, Emulator
+
+
+def chain_program(rnd: random.Random, blocks: int, filler: int, junk: bool = False):
+    """Блоки B0..Bn, выполняемые в случайном порядке, и подпрограммы S0..Sm.
+
+    Каждый блок добавляет к контрольной сумме в R1 своё число, каждый CALL -
+    единицу; возвращает текст программы и ожидаемое значение R1 после HLT.
+    junk=True добавляет то, что убирает -O: NOP, перезаписанные SET, мёртвый
+    код после переходов и переходы через промежуточный JMP.
+    """
+    order = list(range(1, blocks))
+    rnd.shuffle(order)
+    order.insert(0, 0)
+    following = dict(zip(order, order[1:]))
+    subroutines = rnd.randint(1, 3)
+    lines = ["SET R3 3", "SET R5 1", "SET R1 0", "JMP B0"]
+    trampolines = []
+    sums = {}
+    for i in range(blocks):
+        number, calls = rnd.randint(0, 255), rnd.randint(0, 2)
+        lines += [f":B{i}", "MUL R1 R3"]
+        if junk:
+            lines += ["NOP", "SET R2 99"]
+        lines += [f"SET R2 {number}", "ADD R1 R2"] + ["SET R4 7"] * rnd.randint(0, filler)
+        lines += [f"CALL S{rnd.randrange(subroutines)}" for _ in range(calls)]
+        if i not in following:
+            lines.append("HLT")
+        elif following[i] != i + 1 or rnd.random() < 0.3:
+            if junk and rnd.random() < 0.5:
+                trampolines += [f":T{i}", f"JMP B{following[i]}"]
+                lines.append(f"JMP T{i}")
+            else:
+                lines.append(f"JMP B{following[i]}")
+        if junk and lines[-1].startswith(('JMP', 'HLT')):
+            lines += ["SET R1 0", "MOV R6 R6"]  # после перехода не выполняется
+        sums[i] = number + calls
+    lines += trampolines
+    for s in range(subroutines):
+        lines += [f":S{s}", "ADD R1 R5"] + ["SET R4 1"] * rnd.randint(0, filler) + ["RET"]
+    expected = 0
+    for i in order:
+        expected = (expected * 3 + sums[i]) % 256
+    return "\n".join(lines) + "\n", expected
+
+
+class LayoutTest(unittest.TestCase):
+    """Код после --auto-bank и -O выполняется в эмуляторе так же, как задумано в исходном тексте."""
+
+    def run_program(self, result):
+        self.assertTrue(result.ok, result.diagnostics)
+        emulator = Emulator()
+        emulator.load(result.code)
+        self.assertEqual(emulator.run(200000).reason, STOP_HALT)
+        return emulator.registers[1]
+
+    def check(self, blocks, filler, junk=False, seeds=range(40), **options):
+        """Собирает программы с options и сверяет R1; возвращает результаты сборки."""
+        results = []
+        for seed in seeds:
+            source, expected = chain_program(random.Random(seed), blocks, filler, junk)
+            result = assemble(source, **options)
+            if len(result.code) > MEMORY_SIZE:
+                continue  # не помещается в память эмулятора
+            with self.subTest(seed=seed):
+                self.assertEqual(self.run_program(result), expected)
+            results.append(result)
+        self.assertGreater(len(results), len(seeds) // 2)
+        return results
+
+    def test_auto_bank(self):
+        results = self.check(20, 12, auto_bank=True)
+        self.assertTrue(all(max(result.labels.values()) >= 256 for result in results))
+
+    def test_optimizer(self):
+        # Программы в одном банке: без BANK -O сокращает код свободно
+        for result in self.check(5, 3, junk=True, optimize=True):
+            self.assertGreater(result.optimization.total(), 0)
+
+    def test_optimizer_with_auto_bank(self):
+        self.check(20, 12, junk=True, optimize=True, auto_bank=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# tests/test_session.py
+import random
+import unittest
+
+from assembler import assemble
+from session import Session
+
+BASE = """.DEFINE MAXV 10
+.DB 1, 2, MAXV
+.MACRO PLOT X
+    SET R1 X
+    CLRPX R1 R2
+.ENDM
+.MACRO SPIN REG
+:AGAIN
+    SUB REG R6
+    JNE AGAIN
+.ENDM
+.REPT 3 I
+    SET R3 I
+.ENDR
+"""
+HEADER_LINES = len(BASE.splitlines())
+LABELS = [f"L{i}" for i in range(12)]
+
+
+def random_line(rnd: random.Random) -> str:
+    r = rnd.random()
+    if r < 0.15:
+        return f":{rnd.choice(LABELS)}\n"
+    if r < 0.35:
+        return f"    {rnd.choice(['JMP', 'JE', 'JNE', 'CALL'])} {rnd.choice(LABELS)}\n"
+    if r < 0.45:
+        return f"    SET R1 {rnd.choice(LABELS + ['MAXV', '5', '0x10'])}\n"
+    if r < 0.55:
+        return "    NOP\n"
+    if r < 0.6:
+        return rnd.choice(["\n", "    ; комментарий\n"])
+    if r < 0.63:
+        return "    BANK 0\n"
+    if r < 0.69:
+        return f"    PLOT {rnd.choice(['1', 'MAXV', '(MAXV + 1)', 'L3'])}\n"
+    if r < 0.73:
+        return f"    SPIN {rnd.choice(['R1', 'R4'])}\n"
+    if r < 0.75:
+        return rnd.choice(["    SET R1 LOW(L2)+1\n", ".DEFINE X 3\n"])
+    return f"    {rnd.choice(['ADD R1 R2', 'MOV R3 R1', 'CMP R1 R3', 'RET', 'HLT', 'SET R2 MAXV'])}\n"
+
+
+class SessionTest(unittest.TestCase):
+    """Пересборка при правках даёт то же, что полная сборка текста."""
+
+    def assertSameAsFull(self, result, lines):
+        reference = assemble("".join(lines))
+        self.assertEqual(result.ok, reference.ok)
+        self.assertEqual(result.code, reference.code)
+        self.assertEqual(result.labels, reference.labels)
+        self.assertEqual([str(d) for d in result.diagnostics], [str(d) for d in reference.diagnostics])
+
+    def replay(self, session, lines, line, count, new_lines):
+        lines[line - 1:line - 1 + count] = new_lines
+        result = session.edit(line, count, new_lines)
+        self.assertEqual(session.lines, lines)
+        self.assertSameAsFull(result, lines)
+        return result
+
+    def test_scripted_edits(self):
+        lines = (BASE + "".join(f":{label}\n    NOP\n" for label in LABELS)).splitlines(True)
+        session = Session(lines)
+        first = HEADER_LINES + 1
+        self.replay(session, lines, first + 1, 1, ["    SET R1 L5\n"])       # та же длина
+        self.assertEqual(session.last_build, 'incremental')
+        self.replay(session, lines, first + 1, 0, ["    ADD R1 R2\n"] * 3)  # сдвиг всех меток ниже
+        self.assertEqual(session.last_build, 'incremental')
+        self.replay(session, lines, first + 3, 2, [])                      # удаление
+        self.replay(session, lines, first + 1, 0, ["    JMP L11\n"])        # переход вперёд
+        self.replay(session, lines, first + 5, 0, ["    BANK 0\n", "    JMP L9\n"])
+        self.replay(session, lines, first + 1, 0, ["    SET R1 (MAXV + 1)\n"])  # правка перед BANK
+        self.replay(session, lines, first + 7, 1, ["    BANK L9\n"])
+        self.replay(session, lines, first + 2, 0, ["    PLOT MAXV\n", "    SPIN R4\n"])
+        self.replay(session, lines, 1, 1, [".DEFINE MAXV 300\n"])         # значение не помещается в байт
+        self.replay(session, lines, 1, 1, [".DEFINE MAXV 20\n"])
+        self.replay(session, lines, 4, 1, ["    SET R2 X\n"])              # тело макроса
+        self.replay(session, lines, 13, 1, ["    SET R4 I\n", "    NOP\n"])  # тело .REPT
+        self.replay(session, lines, first, 1, [])                          # удалена метка L0
+        self.assertFalse(session.result().ok)
+        self.replay(session, lines, first, 0, [":L0\n"])
+        self.replay(session, lines, first + 1, 0, [".ENDR\n"])
+        self.replay(session, lines, first + 1, 1, [])
+        lines = lines[:first] + ["    CALL L7\n"] + lines[first:]
+        self.assertSameAsFull(session.update("".join(lines)), lines)
+
+    def test_edits_across_banks(self):
+        lines = ([":START\n", "    SET R1 1\n", "    BANK 1\n", "    JMP FAR\n"] + ["    SET R4 7\n"] * 100 +
+                 [":FAR\n", "    HLT\n"])
+        session = Session(lines)
+        self.replay(session, lines, 2, 1, ["    SET R1 1\n", "    SET R2 2\n"])  # BANK сдвинулся
+        self.replay(session, lines, 6, 0, ["    JMP FAR\n"])  # банк цели проверяется по сдвинутому BANK
+        self.assertEqual(session.last_build, 'incremental')
+        self.replay(session, lines, 7, 0, ["    CALL FAR\n"])
+        self.assertEqual(session.last_build, 'incremental')
+        result = self.replay(session, lines, 8, 30, [])  # FAR попала в банк 0
+        self.assertFalse(result.ok)
+        result = self.replay(session, lines, 8, 0, ["    SET R4 7\n"] * 30)
+        self.assertTrue(result.ok)
+
+    def test_random_edits(self):
+        for seed in range(3):
+            rnd = random.Random(seed)
+            lines = (BASE + "".join(f":{label}\n    NOP\n" for label in LABELS)).splitlines(True)
+            session = Session(lines)
+            for _ in range(300):
+                line = rnd.randint(HEADER_LINES + 1, len(lines) + 1)
+                count = rnd.randint(0, min(3, len(lines) + 1 - line))
+                new_lines = [random_line(rnd) for _ in range(rnd.randint(0, 2))]
+                if any(text.startswith(':') for text in lines[line - 1:line - 1 + count]) and rnd.random() < 0.9:
+                    continue  # метки удаляются редко, иначе почти все правки - с ошибкой
+                if rnd.random() < 0.3:
+                    lines[line - 1:line - 1 + count] = new_lines
+                    self.assertSameAsFull(session.update("".join(lines)), lines)
+                else:
+                    self.replay(session, lines, line, count, new_lines)
+                missing = [f":{label}\n" for label in LABELS if f":{label}\n" not in lines]
+                if missing and rnd.random() < 0.3:
+                    self.replay(session, lines, len(lines) + 1, 0, missing)  # ошибку исправили
+            self.assertGreater(session.incremental_builds, session.full_builds)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# tracing.py
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+# Категории трассировки
+LEXER = 'lexer'
+PASS1 = 'pass1'
+PASS2 = 'pass2'
+BANK_CHECK = 'bank-check'
+OUTPUT = 'output'
+CACHE = 'cache'
+CATEGORIES = (LEXER, PASS1, PASS2, BANK_CHECK, OUTPUT, CACHE)
+
+# Уровни трассировки
+OFF = 0
+INFO = 1      # сводка по файлам и проходам
+DEBUG = 2     # по строке на каждую запись
+VERBOSE = 3   # дампы таблиц и состояния
+
+# Названия фаз для отчёта --stats
+PHASE_NAMES = {
+    'include': 'Подстановка INCLUDE',
+    'optimize': 'Оптимизация (-O)',
+    'bank-layout': 'Раскладка по банкам',
+    'pass1': 'Проход 1',
+    'pass2': 'Проход 2',
+    'output': 'Запись результата',
+    'cache': 'Кэш сборки',
+    'cassette': 'Запись в кассету',
+    'disassemble': 'Дизассемблирование',
+}
+
+
+class Tracer:
+    """Отладочный вывод по категориям.
+
+    Уровень каждой категории хранится в отдельном атрибуте (pass2, bank_check ...),
+    поэтому проверка в горячем цикле - одно сравнение, а сообщение
+    форматируется только если категория включена:
+
+        if trace.pass2 >= DEBUG:
+            trace.emit(PASS2, f"...")
+    """
+    __slots__ = ('lexer', 'pass1', 'pass2', 'bank_check', 'output', 'cache', 'stream')
+
+    def __init__(self, categories=(), level=DEBUG, stream=None):
+        self.stream = stream
+        for category in CATEGORIES:
+            enabled = category in categories or 'all' in categories
+            setattr(self, category.replace('-', '_'), level if enabled else OFF)
+
+    def emit(self, category: str, message: str):
+        """Выводит сообщение трассировки."""
+        print(f"[{category}] {message}", file=self.stream or sys.stderr)
+
+
+class Stats:
+    """Время фаз сборки и объём обработанных данных для отчёта --stats."""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.lines: int = 0
+        self.bytes: int = 0
+
+    @contextmanager
+    def phase(self, name: str):
+        """Замеряет время фазы сборки."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def report(self) -> str:
+        """Формирует текстовый отчёт о сборке."""
+        total = self.total()
+        rows = ["Статистика сборки:", "-" * 40]
+        for name, seconds in self.phases.items():
+            rows.append(f"{PHASE_NAMES.get(name, name):<24} {seconds * 1000:>10.3f} мс")
+        rows.append("-" * 40)
+        rows.append(f"{'Всего':<24} {total * 1000:>10.3f} мс")
+        rate = self.lines / total if total > 0 else 0.0
+        rows.append(f"{'Строк исходника':<24} {self.lines:>10} ({rate:.0f} строк/с)")
+        rows.append(f"{'Байт машинного кода':<24} {self.bytes:>10}")
+        rows.append("-" * 40)
+        return '\n'.join(rows)